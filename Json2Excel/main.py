@@ -0,0 +1,105 @@
+import os
+import json
+import logging
+from zipfile import BadZipFile
+from openpyxl import Workbook, load_workbook
+from openpyxl.utils.exceptions import InvalidFileException
+import invoice_store
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+SUMMARIES_DIR = 'Data/Summaries'
+SUMMARY_STATE_FILE = os.getenv('SUMMARY_STATE_FILE', 'Data/Summaries/summary_state.json')
+SHEET_TITLE = 'Invoices'
+COLUMNS = ['client', 'date', 'brutto', 'net', 'vat', 'currency']
+
+def load_summary_state():
+    """
+    Per-client watermarks: the last invoice store id written to the workbook
+    ('summarized_id') and the last one uploaded ('uploaded_id').
+    """
+    if os.path.exists(SUMMARY_STATE_FILE):
+        with open(SUMMARY_STATE_FILE, 'r') as f:
+            return json.load(f)
+    return {}
+
+def save_summary_state(state):
+    os.makedirs(os.path.dirname(SUMMARY_STATE_FILE) or '.', exist_ok=True)
+    tmp_path = SUMMARY_STATE_FILE + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, indent=4)
+    os.replace(tmp_path, SUMMARY_STATE_FILE)
+
+def invoice_row(record):
+    return [record.get(column) for column in COLUMNS]
+
+def write_workbook(excel_path, records):
+    """
+    Writes a summary from scratch in openpyxl's write-only mode, which streams
+    rows to disk instead of keeping every cell in memory.
+    """
+    os.makedirs(os.path.dirname(excel_path) or '.', exist_ok=True)
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(SHEET_TITLE)
+    sheet.append(COLUMNS)
+    for record in records:
+        sheet.append(invoice_row(record))
+    # Write under a temporary name so an upload never picks up half a workbook
+    tmp_path = excel_path + '.tmp'
+    workbook.save(tmp_path)
+    os.replace(tmp_path, excel_path)
+
+def append_workbook(excel_path, records):
+    """
+    Adds rows below the existing ones of a summary.
+
+    An xlsx file is a zip archive, so openpyxl still loads and rewrites the
+    whole workbook; the cost grows with the summary. Callers pass all new
+    rows of a client at once, so it is paid once per batch, not per invoice.
+    """
+    workbook = load_workbook(excel_path)
+    sheet = workbook[SHEET_TITLE]
+    for record in records:
+        sheet.append(invoice_row(record))
+    tmp_path = excel_path + '.tmp'
+    workbook.save(tmp_path)
+    os.replace(tmp_path, excel_path)
+
+def update_summary(client, client_state, excel_path=None):
+    """
+    Brings a client's summary up to date with the invoice store.
+
+    Only records past the client's watermark are appended, all in one
+    append_workbook() call. The workbook is rebuilt when it is missing or has
+    no watermark yet.
+
+    :param client: Client name as stored in the invoice store.
+    :param client_state: The client's watermarks, updated in place.
+    :param excel_path: Path of the workbook, <SUMMARIES_DIR>/<client>.xlsx by default.
+    :return: Whether the workbook changed.
+    """
+    excel_path = excel_path or os.path.join(SUMMARIES_DIR, client + '.xlsx')
+    summarized_id = client_state.get('summarized_id', 0)
+    rows = None
+    if summarized_id and os.path.exists(excel_path):
+        rows = invoice_store.records(client, after_id=summarized_id)
+        if not rows:
+            return False
+        try:
+            append_workbook(excel_path, [record for _, record in rows])
+            logger.info(f"Appended {len(rows)} row(s) to {excel_path}.")
+        except (OSError, KeyError, BadZipFile, InvalidFileException) as e:
+            logger.warning(f"Could not append to {excel_path}, rebuilding it: {e}")
+            rows = None
+    if rows is None:
+        rows = invoice_store.records(client)
+        try:
+            write_workbook(excel_path, [record for _, record in rows])
+        except OSError as e:
+            logger.error(f"Failed to write summary {excel_path}: {e}")
+            return False
+        logger.info(f"Rebuilt {excel_path} with {len(rows)} row(s).")
+    if rows:
+        client_state['summarized_id'] = rows[-1][0]
+    return True
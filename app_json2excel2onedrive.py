@@ -1,10 +1,16 @@
 import os
-import requests
-from msal import PublicClientApplication, SerializableTokenCache
+from urllib.parse import quote
+import graph_client
+import graph_batch
+import upload_session
+import invoice_store
+import upload_manifest
+from graph_client import GRAPH_URL
+from token_provider import get_access_token
 import logging
 from dotenv import load_dotenv
 load_dotenv()
-from Json2Excel.main import process_invoice
+from Json2Excel.main import load_summary_state, save_summary_state, update_summary
 
 logging.basicConfig(
     filename='email_fetch_upload.log',
@@ -14,88 +20,75 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # Configuration
-CLIENT_ID = os.getenv('CLIENT_ID') 
 ACCOUNT_EMAIL = os.getenv('ACCOUNT_EMAIL') 
-AUTHORITY = 'https://login.microsoftonline.com/common'
-SCOPES = ['Mail.Read', 'Files.ReadWrite']
-TOKEN_CACHE_FILE = 'token_cache.json'
 ATTACHMENTS_DIR = 'Data/attachments' 
 ONEDRIVE_DEST_FOLDER = '/Invoices'  # OneDrive folder path
 
-def load_token_cache():
-    cache = SerializableTokenCache()
-    if os.path.exists(TOKEN_CACHE_FILE):
-        with open(TOKEN_CACHE_FILE, 'r') as f:
-            cache.deserialize(f.read())
-    return cache
-
-def save_token_cache(cache):
-    if cache.has_state_changed:
-        with open(TOKEN_CACHE_FILE, 'w') as f:
-            f.write(cache.serialize())
-
-def get_access_token():
-    cache = load_token_cache()
-    app = PublicClientApplication(
-        client_id=CLIENT_ID,
-        authority=AUTHORITY,
-        token_cache=cache
-    )
-
-    accounts = app.get_accounts()
-    if accounts:
-        result = app.acquire_token_silent(SCOPES, account=accounts[0])
-        if result and 'access_token' in result:
-            save_token_cache(cache)
-            logger.info("Acquired token silently.")
-            return result['access_token']
-
-    flow = app.initiate_device_flow(scopes=SCOPES)
-    if 'user_code' not in flow:
-        logger.error(f"Device flow initiation failed: {flow.get('error')}")
-        raise Exception(f"Device flow initiation failed: {flow.get('error')}")
-
-    logger.info("Initiating device code flow. Please authenticate.")
-    print(flow['message'])  
-    result = app.acquire_token_by_device_flow(flow)
-
-    if 'access_token' in result:
-        save_token_cache(cache)
-        logger.info("Acquired token via device code flow.")
-        return result['access_token']
-    else:
-        logger.error(f"Failed to get access token: {result.get('error_description')}")
-        raise Exception(f"Failed to get access token: {result.get('error_description')}")
+DRIVE_ITEM_SELECT = 'eTag,size'
+
+def drive_item_path(destination_folder, destination_file_name):
+    return f"/me/drive/root:{quote(destination_folder)}/{quote(destination_file_name)}"
 
 def upload_to_onedrive(access_token, file_path, destination_file_name, destination_folder=ONEDRIVE_DEST_FOLDER):
     """
-    Uploads a file to OneDrive.
+    Uploads a file to OneDrive unless the same content was already uploaded there.
+
+    An unchanged file is only skipped while the OneDrive copy is still the one
+    we uploaded. A deleted copy is uploaded again, a replaced one is treated
+    like any other conflict.
 
     :param access_token: OAuth2 access token.
     :param file_path: Local path to the file.
     :param file_name: Name to save the file as in OneDrive.
     :param destination_folder: OneDrive folder path where the file will be uploaded.
     """
+    destination = upload_manifest.destination_path(destination_folder, destination_file_name)
+    changed, entry, sha256 = upload_manifest.check(file_path, destination)
+    if not changed:
+        response = graph_client.get(
+            GRAPH_URL + drive_item_path(destination_folder, destination_file_name),
+            access_token=access_token, params={'$select': DRIVE_ITEM_SELECT}
+        )
+        remote = upload_manifest.remote_state(entry, response.status_code, response.json() if response.status_code == 200 else None)
+        if remote == 'unchanged':
+            logger.info(f"Skipping unchanged {destination_file_name} in {destination_folder}.")
+            return True
+        logger.warning(f"{destination_file_name} was {remote} in OneDrive, uploading it again.")
+        if remote == 'missing':
+            entry = None
+
     headers = {
-        'Authorization': f'Bearer {access_token}',
         'Content-Type': 'application/octet-stream'
     }
+    # Fails with 412 if the OneDrive copy was edited since our last upload
+    headers.update(upload_manifest.conditional_headers(entry))
 
     # files sizes (<4MB)
     destination_folder = destination_folder.replace(' ', '%20')
-    upload_url = f'https://graph.microsoft.com/v1.0/me/drive/root:{destination_folder}/{destination_file_name}:/content'
+    upload_url = f'{GRAPH_URL}/me/drive/root:{destination_folder}/{destination_file_name}:/content'
 
     # Read the file content
     with open(file_path, 'rb') as f:
         file_content = f.read()
 
     # request to upload the file
-    response = requests.put(upload_url, headers=headers, data=file_content)
+    response = graph_client.put(upload_url, access_token=access_token, headers=headers, data=file_content)
+
+    if 'If-Match' in headers and response.status_code in [404, 412]:
+        if response.status_code == 412 and not upload_manifest.OVERWRITE_CONFLICTS:
+            logger.error(f"{destination_file_name} was changed in OneDrive since the last upload, not overwriting it.")
+            return False
+        # The file was removed remotely, or overwriting conflicts is allowed
+        logger.warning(f"Uploading {destination_file_name} unconditionally after {response.status_code}.")
+        del headers['If-Match']
+        response = graph_client.put(upload_url, access_token=access_token, headers=headers, data=file_content)
 
     if response.status_code in [200, 201]:
+        upload_manifest.record_upload(destination, file_path, sha256, response.json())
         logger.info(f"Successfully uploaded {destination_file_name} to OneDrive at {destination_folder}.")
-    else:
-        logger.error(f"Failed to upload {destination_file_name} to OneDrive: {response.status_code} - {response.text}")
+        return True
+    logger.error(f"Failed to upload {destination_file_name} to OneDrive: {response.status_code} - {response.text}")
+    return False
 
 def upload_large_file_to_onedrive(access_token, file_path, file_name, destination_folder=ONEDRIVE_DEST_FOLDER):
     """
@@ -106,52 +99,70 @@ def upload_large_file_to_onedrive(access_token, file_path, file_name, destinatio
     :param file_name: Name to save the file as in OneDrive.
     :param destination_folder: OneDrive folder path where the file will be uploaded.
     """
-    headers = {
-        'Authorization': f'Bearer {access_token}'
-    }
-
-    destination_folder = destination_folder.replace(' ', '%20')
-    upload_session_url = f"https://graph.microsoft.com/v1.0/me/drive/root:{destination_folder}/{file_name}:/createUploadSession"
+    return upload_session.resumable_upload(access_token, file_path, file_name, destination_folder)
 
-    upload_session_payload = {
-        "item": {
-            "@microsoft.graph.conflictBehavior": "rename",
-            "name": file_name
-        }
-    }
-
-    upload_session_response = requests.post(upload_session_url, headers=headers, json=upload_session_payload)
-
-    if upload_session_response.status_code == 200:
-        upload_url = upload_session_response.json()['uploadUrl']
-    else:
-        logger.error(f"Failed to create upload session for {file_name}: {upload_session_response.status_code} - {upload_session_response.text}")
-        return
+def upload_files_batched(access_token, uploads):
+    """
+    Uploads many small files to OneDrive with $batch calls of up to 20 PUTs.
 
-    # Read the file in chunks and upload
-    file_size = os.path.getsize(file_path)
-    chunk_size = 320 * 1024  # 320KB chunks
-    with open(file_path, 'rb') as f:
-        bytes_uploaded = 0
-        while bytes_uploaded < file_size:
-            chunk_data = f.read(chunk_size)
-            if not chunk_data:
-                break
-            start_range = bytes_uploaded
-            end_range = bytes_uploaded + len(chunk_data) - 1
-            headers = {
-                'Content-Length': str(len(chunk_data)),
-                'Content-Range': f'bytes {start_range}-{end_range}/{file_size}'
-            }
-            chunk_response = requests.put(upload_url, headers=headers, data=chunk_data)
-            if chunk_response.status_code in [200, 201, 202]:
-                bytes_uploaded += len(chunk_data)
-                logger.info(f"Uploaded {bytes_uploaded}/{file_size} bytes of {file_name}.")
-            else:
-                logger.error(f"Failed to upload chunk {start_range}-{end_range} of {file_name}: {chunk_response.status_code} - {chunk_response.text}")
-                break
+    Files over MAX_BATCH_UPLOAD_SIZE are uploaded on their own.
 
-    logger.info(f"Finished uploading {file_name} to OneDrive.")
+    :param access_token: OAuth2 access token.
+    :param uploads: List of (file_path, destination_file_name, destination_folder).
+    :return: Dict of upload tuple to whether it succeeded.
+    """
+    uploaded = {}
+    checks = []
+    for upload in uploads:
+        file_path, destination_file_name, destination_folder = upload
+        destination = upload_manifest.destination_path(destination_folder, destination_file_name)
+        checks.append((upload, destination, *upload_manifest.check(file_path, destination)))
+
+    # Unchanged files are only skipped while their OneDrive copy is the one we uploaded
+    item_requests = [
+        graph_batch.batch_request(i, 'GET', f"{drive_item_path(upload[2], upload[1])}?$select={DRIVE_ITEM_SELECT}")
+        for i, (upload, _, changed, _, _) in enumerate(checks) if not changed
+    ]
+    items = graph_batch.send_batch(access_token, item_requests) if item_requests else {}
+
+    entries = {}
+    for i, (upload, destination, changed, entry, sha256) in enumerate(checks):
+        file_path, destination_file_name, destination_folder = upload
+        if not changed:
+            item = items[str(i)]
+            remote = upload_manifest.remote_state(entry, item['status'], item.get('body'))
+            if remote == 'unchanged':
+                logger.info(f"Skipping unchanged {destination_file_name} in {destination_folder}.")
+                uploaded[upload] = True
+                continue
+            logger.warning(f"{destination_file_name} was {remote} in OneDrive, uploading it again.")
+            if remote == 'missing':
+                # Nothing to protect, upload without If-Match
+                entry = None
+        if os.path.getsize(file_path) > graph_batch.MAX_BATCH_UPLOAD_SIZE:
+            uploaded[upload] = upload_to_onedrive(access_token, file_path, destination_file_name, destination_folder)
+            continue
+        with open(file_path, 'rb') as f:
+            file_content = f.read()
+        url = f"/me/drive/root:{quote(destination_folder)}/{quote(destination_file_name)}:/content"
+        headers = upload_manifest.conditional_headers(entry)
+        request = graph_batch.batch_request(len(entries), 'PUT', url, body=file_content, headers=headers)
+        entries[str(len(entries))] = (upload, destination, sha256, bool(headers), request)
+
+    results = graph_batch.send_batch(access_token, [entry[-1] for entry in entries.values()])
+    for request_id, (upload, destination, sha256, conditional, _) in entries.items():
+        result = results[request_id]
+        if conditional and result['status'] in [404, 412]:
+            # Conflicts and remotely removed files are resolved by the single upload
+            uploaded[upload] = upload_to_onedrive(access_token, *upload)
+            continue
+        uploaded[upload] = result['status'] in [200, 201]
+        if uploaded[upload]:
+            upload_manifest.record_upload(destination, upload[0], sha256, result.get('body'))
+            logger.info(f"Successfully uploaded {upload[1]} to OneDrive at {upload[2]}.")
+        else:
+            logger.error(f"Failed to upload {upload[1]} to OneDrive: {result['status']} - {result.get('body')}")
+    return uploaded
 
 def upload_json2onedrive(json_filename=None, excel_filename=None, company_name=None, directory=None):
     # full_path_json  = os.path.join('Data/InvoiceData/', json_filename)
@@ -163,21 +174,42 @@ def upload_json2onedrive(json_filename=None, excel_filename=None, company_name=N
     # else:
     #     print("Invoice processing failed.")
     if directory:
-        for file in os.listdir(directory):
-            if file.endswith('.json'):
-                file_name = file.split('.')[0]
-                full_path = os.path.join(directory, file)
-                excel_filename = file_name + '.xlsx'
-                full_path_excel = os.path.join('Data/Summaries/', excel_filename)
-                if process_invoice(full_path, full_path_excel):
-                    access_token = get_access_token()
-                    upload_to_onedrive(access_token=access_token, file_path=full_path, destination_file_name=file, destination_folder="/Invoices/InvoiceData")
-                    upload_to_onedrive(access_token=access_token, file_path=full_path_excel, destination_file_name=excel_filename, destination_folder="/Invoices/Summaries")
-                    print(f"Uploaded {file} to OneDrive.")
+        # Only clients with records newer than their last upload are exported, summarized and uploaded
+        state = load_summary_state()
+        uploads = {}
+        for client, last_id in invoice_store.latest_ids().items():
+            client_state = state.setdefault(client, {})
+            if client_state.get('uploaded_id', 0) >= last_id:
+                continue
+            full_path = invoice_store.export_client_json(client, directory)
+            excel_filename = client + '.xlsx'
+            full_path_excel = os.path.join('Data/Summaries/', excel_filename)
+            if update_summary(client, client_state, full_path_excel):
+                # The rows are in the workbook now; a failed upload below must not append them again
+                save_summary_state(state)
+            if client_state.get('summarized_id', 0) >= last_id:
+                uploads[client] = ([
+                    (full_path, client + '.json', "/Invoices/InvoiceData"),
+                    (full_path_excel, excel_filename, "/Invoices/Summaries"),
+                ], last_id)
+            else:
+                print(f"Processing failed for {client}.")
+
+        if uploads:
+            access_token = get_access_token()
+            uploaded = upload_files_batched(access_token, [u for pair, _ in uploads.values() for u in pair])
+            for client, (pair, last_id) in uploads.items():
+                if all(uploaded[(path, name, folder)] for path, name, folder in pair):
+                    state[client]['uploaded_id'] = last_id
+                    print(f"Uploaded {client} to OneDrive.")
                 else:
-                    print(f"Processing failed for {file}.")
+                    print(f"Upload failed for {client}.")
+        else:
+            print("No summaries changed.")
+        save_summary_state(state)
 
 if __name__ == "__main__":
     # Example usage:
     # upload_json2onedrive('PSI Concepts SA.json', 'invoice_data.xlsx', 'Aevux')
-    upload_json2onedrive(directory='Data/InvoiceData/')
\ No newline at end of file
+    upload_json2onedrive(directory='Data/InvoiceData/')
+    graph_client.log_latency_stats()
\ No newline at end of file
@@ -1,6 +1,19 @@
 import os
-import requests
-from msal import PublicClientApplication, SerializableTokenCache
+import json
+import time
+import hashlib
+import tempfile
+import threading
+from contextlib import nullcontext
+from concurrent.futures import Future, ThreadPoolExecutor
+import graph_client
+import graph_batch
+import dedup_index
+import attachment_rules
+import extraction_worker
+import upload_session
+from graph_client import GRAPH_URL
+from token_provider import get_access_token
 import logging
 from dotenv import load_dotenv
 load_dotenv()
@@ -14,58 +27,29 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # Configuration
-CLIENT_ID = os.getenv('CLIENT_ID') 
 ACCOUNT_EMAIL = os.getenv('ACCOUNT_EMAIL') 
-AUTHORITY = 'https://login.microsoftonline.com/common'
-SCOPES = ['Mail.Read', 'Files.ReadWrite']
-TOKEN_CACHE_FILE = 'token_cache.json'
 ATTACHMENTS_DIR = 'attachments' 
 ONEDRIVE_DEST_FOLDER = '/Attachments'  # OneDrive folder path
+SYNC_MODE = os.getenv('SYNC_MODE', 'delta')  # 'delta' or 'latest'
+SYNC_START = os.getenv('SYNC_START')  # first delta sync only covers mail received since, e.g. 2024-01-01; default: since that run
+DELTA_STATE_FILE = 'delta_state.json'
+DELTA_ENDPOINT = f'{GRAPH_URL}/me/mailFolders/inbox/messages/delta'
+DELTA_PAGE_SIZE = 50
+MAX_SEEN_IDS = 5000  # bound on remembered message ids in the state file
+MAX_MESSAGE_RETRIES = int(os.getenv('MAX_MESSAGE_RETRIES', '5'))  # syncs that retry a message with failed transfers
+MAX_WORKERS = int(os.getenv('MAX_WORKERS', '4'))  # concurrent attachment transfers
+MAX_PENDING_TRANSFERS = int(os.getenv('MAX_PENDING_TRANSFERS', str(MAX_WORKERS * 2)))
+STREAM_BUFFER_SIZE = 64 * 1024  # read size when piping downloads into uploads
+EXTRACTABLE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.pdf')  # kept locally for app_pdf2json.py
 
-def load_token_cache():
-    cache = SerializableTokenCache()
-    if os.path.exists(TOKEN_CACHE_FILE):
-        with open(TOKEN_CACHE_FILE, 'r') as f:
-            cache.deserialize(f.read())
-    return cache
-
-def save_token_cache(cache):
-    if cache.has_state_changed:
-        with open(TOKEN_CACHE_FILE, 'w') as f:
-            f.write(cache.serialize())
-
-def get_access_token():
-    cache = load_token_cache()
-    app = PublicClientApplication(
-        client_id=CLIENT_ID,
-        authority=AUTHORITY,
-        token_cache=cache
-    )
+attachment_handler = None
 
-    accounts = app.get_accounts()
-    if accounts:
-        result = app.acquire_token_silent(SCOPES, account=accounts[0])
-        if result and 'access_token' in result:
-            save_token_cache(cache)
-            logger.info("Acquired token silently.")
-            return result['access_token']
-
-    flow = app.initiate_device_flow(scopes=SCOPES)
-    if 'user_code' not in flow:
-        logger.error(f"Device flow initiation failed: {flow.get('error')}")
-        raise Exception(f"Device flow initiation failed: {flow.get('error')}")
-
-    logger.info("Initiating device code flow. Please authenticate.")
-    print(flow['message'])  
-    result = app.acquire_token_by_device_flow(flow)
-
-    if 'access_token' in result:
-        save_token_cache(cache)
-        logger.info("Acquired token via device code flow.")
-        return result['access_token']
-    else:
-        logger.error(f"Failed to get access token: {result.get('error_description')}")
-        raise Exception(f"Failed to get access token: {result.get('error_description')}")
+def set_attachment_handler(handler):
+    """
+    Hands downloaded attachments to handler(file_path) instead of the extraction worker.
+    """
+    global attachment_handler
+    attachment_handler = handler
 
 def upload_to_onedrive(access_token, file_path, destination_file_name, destination_folder=ONEDRIVE_DEST_FOLDER):
     """
@@ -76,28 +60,39 @@ def upload_to_onedrive(access_token, file_path, destination_file_name, destinati
     :param file_name: Name to save the file as in OneDrive.
     :param destination_folder: OneDrive folder path where the file will be uploaded.
     """
+    # Read the file content
+    with open(file_path, 'rb') as f:
+        file_content = f.read()
+
+    return upload_bytes_to_onedrive(access_token, file_content, destination_file_name, destination_folder)
+
+def upload_bytes_to_onedrive(access_token, file_content, destination_file_name, destination_folder=ONEDRIVE_DEST_FOLDER):
+    """
+    Uploads in-memory content (<4MB) to OneDrive with a single PUT.
+
+    :param access_token: OAuth2 access token.
+    :param file_content: Bytes to upload.
+    :param destination_file_name: Name to save the file as in OneDrive.
+    :param destination_folder: OneDrive folder path where the file will be uploaded.
+    """
     headers = {
-        'Authorization': f'Bearer {access_token}',
         'Content-Type': 'application/octet-stream'
     }
 
     # files sizes (<4MB)
     destination_folder = destination_folder.replace(' ', '%20')
-    upload_url = f'https://graph.microsoft.com/v1.0/me/drive/root:{destination_folder}/{destination_file_name}:/content'
-
-    # Read the file content
-    with open(file_path, 'rb') as f:
-        file_content = f.read()
+    upload_url = f'{GRAPH_URL}/me/drive/root:{destination_folder}/{destination_file_name}:/content'
 
     # request to upload the file
-    response = requests.put(upload_url, headers=headers, data=file_content)
+    response = graph_client.put(upload_url, access_token=access_token, headers=headers, data=file_content)
 
     if response.status_code in [200, 201]:
         logger.info(f"Successfully uploaded {destination_file_name} to OneDrive at {destination_folder}.")
-    else:
-        logger.error(f"Failed to upload {destination_file_name} to OneDrive: {response.status_code} - {response.text}")
+        return True
+    logger.error(f"Failed to upload {destination_file_name} to OneDrive: {response.status_code} - {response.text}")
+    return False
 
-def upload_large_file_to_onedrive(access_token, file_path, destination_file_name, destination_folder=ONEDRIVE_DEST_FOLDER):
+def upload_large_file_to_onedrive(access_token, file_path, destination_file_name, destination_folder=ONEDRIVE_DEST_FOLDER, source=None):
     """
     Uploads a large file to OneDrive using an upload session.
 
@@ -105,107 +100,389 @@ def upload_large_file_to_onedrive(access_token, file_path, destination_file_name
     :param file_path: Local path to the file.
     :param file_name: Name to save the file as in OneDrive.
     :param destination_folder: OneDrive folder path where the file will be uploaded.
+    :param source: Id of the attachment the file was downloaded from, so a retry resumes the session.
     """
-    headers = {
-        'Authorization': f'Bearer {access_token}'
-    }
+    return upload_session.resumable_upload(access_token, file_path, destination_file_name, destination_folder, source)
 
-    destination_folder = destination_folder.replace(' ', '%20')
-    upload_session_url = f"https://graph.microsoft.com/v1.0/me/drive/root:{destination_folder}/{destination_file_name}:/createUploadSession"
+def load_delta_state():
+    if os.path.exists(DELTA_STATE_FILE):
+        with open(DELTA_STATE_FILE, 'r') as f:
+            state = json.load(f)
+        state.setdefault('retry_ids', {})
+        return state
+    return {'deltaLink': None, 'seen_ids': [], 'retry_ids': {}}
 
-    upload_session_payload = {
-        "item": {
-            "@microsoft.graph.conflictBehavior": "rename",
-            "name": file_name
-        }
-    }
+def save_delta_state(state):
+    state['seen_ids'] = state['seen_ids'][-MAX_SEEN_IDS:]
+    tmp_file = DELTA_STATE_FILE + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp_file, DELTA_STATE_FILE)
 
-    upload_session_response = requests.post(upload_session_url, headers=headers, json=upload_session_payload)
+def sync_start_time(sync_start=None):
+    """
+    Returns the OData timestamp the initial delta sync starts at.
 
-    if upload_session_response.status_code == 200:
-        upload_url = upload_session_response.json()['uploadUrl']
-    else:
-        logger.error(f"Failed to create upload session for {file_name}: {upload_session_response.status_code} - {upload_session_response.text}")
-        return
+    :param sync_start: Date (2024-01-01) or UTC timestamp (2024-01-01T08:00:00Z), None for now.
+    """
+    if not sync_start:
+        return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+    if 'T' not in sync_start:
+        return f'{sync_start}T00:00:00Z'
+    return sync_start
 
-    # Read the file in chunks and upload
-    file_size = os.path.getsize(file_path)
-    chunk_size = 320 * 1024  # 320KB chunks
-    with open(file_path, 'rb') as f:
-        bytes_uploaded = 0
-        while bytes_uploaded < file_size:
-            chunk_data = f.read(chunk_size)
-            if not chunk_data:
-                break
-            start_range = bytes_uploaded
-            end_range = bytes_uploaded + len(chunk_data) - 1
-            headers = {
-                'Content-Length': str(len(chunk_data)),
-                'Content-Range': f'bytes {start_range}-{end_range}/{file_size}'
-            }
-            chunk_response = requests.put(upload_url, headers=headers, data=chunk_data)
-            if chunk_response.status_code in [200, 201, 202]:
-                bytes_uploaded += len(chunk_data)
-                logger.info(f"Uploaded {bytes_uploaded}/{file_size} bytes of {file_name}.")
-            else:
-                logger.error(f"Failed to upload chunk {start_range}-{end_range} of {file_name}: {chunk_response.status_code} - {chunk_response.text}")
-                break
+def fetch_delta_pages(access_token, state):
+    """
+    Yields pages of changed inbox messages since the stored deltaLink.
+
+    Follows @odata.nextLink until Graph hands out a new @odata.deltaLink, which
+    is stored in the state for the next run. Without a stored deltaLink an
+    initial sync starts, limited to messages received since SYNC_START (or
+    since the first run), so a new install does not fetch the inbox's history.
+
+    :param access_token: OAuth2 access token.
+    :param state: Delta state as returned by load_delta_state().
+    """
+    if not state.get('sync_start'):
+        # Kept in the state, so a restart after an expired deltaLink covers the same period
+        state['sync_start'] = sync_start_time(SYNC_START)
+    # receivedDateTime ge is the one $filter message delta supports
+    initial_url = (
+        f"{DELTA_ENDPOINT}?$select={attachment_rules.MESSAGE_SELECT}"
+        f"&$filter=receivedDateTime ge {state['sync_start']}"
+    )
+    url = state.get('deltaLink') or initial_url
+    page_headers = {'Prefer': f'odata.maxpagesize={DELTA_PAGE_SIZE}'}
+
+    while url:
+        response = graph_client.get(url, access_token=access_token, headers=page_headers)
+        if response.status_code == 410 and url != initial_url:
+            # deltaLink expired or was invalidated, restart with a full sync
+            logger.warning("Delta token expired, restarting full sync.")
+            state['deltaLink'] = None
+            url = initial_url
+            continue
+        if response.status_code != 200:
+            logger.error(f"Failed to fetch delta page: {response.status_code} - {response.text}")
+            return
+
+        page = response.json()
+        yield page.get('value', [])
+        url = page.get('@odata.nextLink')
+        if '@odata.deltaLink' in page:
+            state['deltaLink'] = page['@odata.deltaLink']
+
+def local_attachment_path(message_id, attachment_id, safe_attachment_name):
+    """
+    Path of the local copy, prefixed with a short hash of the Graph ids.
+
+    Attachments of different messages often share a name (invoice.pdf), and
+    transfers run concurrently, so the plain name could be overwritten.
+    """
+    prefix = hashlib.sha256(f'{message_id}/{attachment_id}'.encode('utf-8')).hexdigest()[:12]
+    return os.path.join(ATTACHMENTS_DIR, f"{prefix}_{safe_attachment_name}")
 
-    logger.info(f"Finished uploading {file_name} to OneDrive.")
+def transfer_attachment(access_token, message_id, attachment):
+    """
+    Streams a single file attachment from Outlook into OneDrive.
+
+    The $value body is piped into the upload through a fixed-size buffer, so
+    memory use does not grow with the attachment size. A local copy is only
+    written (tee) for files the extraction step picks up from ATTACHMENTS_DIR.
+    Attachments and contents already in the dedup index are skipped; a large
+    attachment whose name and size were seen before is hashed before it is
+    uploaded. The local copy is only handed to extraction once the transfer
+    succeeded. Upload sessions are journaled per attachment, so when a large
+    upload fails the retry downloads it again but only sends what is missing.
+    Runs on the transfer pool, so failures are logged instead of raised.
 
-def fetch_emails():
+    :return: True when the attachment is in OneDrive, also if it was skipped as already transferred.
+    """
+    attachment_name = attachment['name']
+    attachment_id = attachment['id']
+    safe_attachment_name = os.path.basename(attachment_name)
+    if dedup_index.is_attachment_seen(message_id, attachment_id):
+        logger.info(f"Skipping already processed attachment: {safe_attachment_name}")
+        return True
+    tee_path = None
+    part_path = None
+    if safe_attachment_name.lower().endswith(EXTRACTABLE_EXTENSIONS):
+        os.makedirs(ATTACHMENTS_DIR, exist_ok=True)
+        tee_path = local_attachment_path(message_id, attachment_id, safe_attachment_name)
+        # Written under a temporary name, so a failed transfer never leaves a truncated file for extraction
+        part_path = tee_path + '.part'
+    source = f'{message_id}/{attachment_id}'
+    claims = []
     try:
-        access_token = get_access_token()
-        headers = {'Authorization': f'Bearer {access_token}'}
-        endpoint = 'https://graph.microsoft.com/v1.0/me/messages?$top=1&$orderby=receivedDateTime desc&$expand=attachments'
-
-        response = requests.get(endpoint, headers=headers)
-        if response.status_code == 200:
-            emails = response.json()
-            for email in emails.get('value', []):
-                subject = email.get('subject', '(No Subject)')
-                sender = email.get('from', {}).get('emailAddress', {}).get('address', '(Unknown Sender)')
-                logger.info(f"From: {sender}, Subject: {subject}")
-
-                attachments = email.get('attachments', [])
-                if attachments:
-                    logger.info(f"Found {len(attachments)} attachment(s). Downloading and uploading to OneDrive...")
-                    for attachment in attachments:
-                        if attachment['@odata.type'] == '#microsoft.graph.fileAttachment':
-                            attachment_name = attachment['name']
-                            attachment_id = attachment['id']
-                            download_endpoint = f"https://graph.microsoft.com/v1.0/me/messages/{email['id']}/attachments/{attachment_id}/$value"
-                            download_response = requests.get(download_endpoint, headers=headers)
-                            
-                            if download_response.status_code == 200:
-                                # Save attachment locally
-                                os.makedirs(ATTACHMENTS_DIR, exist_ok=True)
-                                safe_attachment_name = os.path.basename(attachment_name)
-                                file_path = os.path.join(ATTACHMENTS_DIR, safe_attachment_name)
-                                with open(file_path, 'wb') as f:
-                                    f.write(download_response.content)
-                                logger.info(f"Downloaded attachment: {safe_attachment_name}")
-
-                                # Determine if the file is large and choose upload method
-                                file_size = os.path.getsize(file_path)
-                                if file_size < 4 * 1024 * 1024:  # <4MB
-                                    upload_to_onedrive(access_token, file_path, safe_attachment_name)
-                                else:
-                                    upload_large_file_to_onedrive(access_token, file_path, safe_attachment_name)
-                            else:
-                                logger.error(f"Failed to download attachment {attachment_name}: {download_response.status_code} - {download_response.text}")
-                        elif attachment['@odata.type'] == '#microsoft.graph.itemAttachment':
-                            logger.warning("Item attachments are not handled in this script.")
-                        else:
-                            logger.warning(f"Unknown attachment type: {attachment['@odata.type']}")
+        download_endpoint = f"{GRAPH_URL}/me/messages/{message_id}/attachments/{attachment_id}/$value"
+        with graph_client.get(download_endpoint, access_token=access_token, stream=True) as download_response:
+            if download_response.status_code != 200:
+                logger.error(f"Failed to download attachment {attachment_name}: {download_response.status_code} - {download_response.text}")
+                return False
+
+            file_size = int(download_response.headers.get('Content-Length', 0))
+            spool = not file_size  # unknown length, the upload session needs the total size up front
+            if file_size >= 4 * 1024 * 1024:
+                # The hash is only known once the content went by, so large copies
+                # are told apart by name and size before an upload session is opened.
+                # Spooled copies are hashed and claimed by content, only the first
+                # copy of a name and size has to be claimed before streaming it.
+                spool = dedup_index.is_processed_size('fetch', safe_attachment_name, file_size)
+                if not spool:
+                    claims.append(claim(f'fetch:{safe_attachment_name}:{file_size}', safe_attachment_name))
+                    spool = dedup_index.is_processed_size('fetch', safe_attachment_name, file_size)
+            if spool:
+                if part_path is None:
+                    fd, part_path = tempfile.mkstemp()
+                    os.close(fd)
+                sha256 = spool_attachment(download_response, part_path)
+                if is_duplicate(sha256, message_id, attachment_id, safe_attachment_name, claims):
+                    return True
+                if os.path.getsize(part_path) < 4 * 1024 * 1024:  # <4MB
+                    uploaded = upload_to_onedrive(access_token, part_path, safe_attachment_name)
+                else:
+                    uploaded = upload_large_file_to_onedrive(access_token, part_path, safe_attachment_name, source=source)
+            elif file_size < 4 * 1024 * 1024:  # <4MB
+                file_content = download_response.content
+                sha256 = dedup_index.content_sha256(file_content)
+                if is_duplicate(sha256, message_id, attachment_id, safe_attachment_name, claims):
+                    return True
+                if part_path:
+                    with open(part_path, 'wb') as f:
+                        f.write(file_content)
+                uploaded = upload_bytes_to_onedrive(access_token, file_content, safe_attachment_name)
+            else:
+                hasher = hashlib.sha256()
+                with open(part_path, 'wb') if part_path else nullcontext() as tee:
+                    uploaded = upload_session.stream_upload(
+                        access_token, hashed_chunks(download_response.iter_content(STREAM_BUFFER_SIZE), hasher),
+                        file_size, safe_attachment_name, ONEDRIVE_DEST_FOLDER, tee=tee, source=source
+                    )
+                sha256 = hasher.hexdigest()
+            if not uploaded:
+                return False
+            dedup_index.mark_processed('fetch', sha256, message_id, attachment_id, safe_attachment_name, file_size or None)
+            if tee_path:
+                os.replace(part_path, tee_path)
+                logger.info(f"Downloaded attachment: {safe_attachment_name}")
+                # Start extraction right away, in the pipeline or on a worker that keeps the model loaded
+                if attachment_handler is not None:
+                    attachment_handler(tee_path)
                 else:
-                    logger.info("No attachments found in this email.")
-                logger.info("-" * 50)
+                    extraction_worker.submit([tee_path])
+            return True
+    except Exception as e:
+        logger.error(f"Failed to transfer attachment {attachment_name}: {e}")
+        return False
+    finally:
+        for key in claims:
+            dedup_index.release(key)
+        if part_path and os.path.exists(part_path):
+            os.remove(part_path)
+
+def hashed_chunks(chunks, hasher):
+    for data in chunks:
+        hasher.update(data)
+        yield data
+
+def spool_attachment(download_response, file_path):
+    """
+    Writes a download to disk in STREAM_BUFFER_SIZE pieces.
+
+    :return: The SHA-256 of the content.
+    """
+    hasher = hashlib.sha256()
+    with open(file_path, 'wb') as f:
+        for data in hashed_chunks(download_response.iter_content(STREAM_BUFFER_SIZE), hasher):
+            f.write(data)
+    return hasher.hexdigest()
+
+def claim(key, safe_attachment_name):
+    """
+    Claims a transfer in the dedup index, so concurrent copies are not uploaded twice.
+
+    A copy that is being transferred by another worker fails, and is retried by a later sync.
+    """
+    if not dedup_index.claim(key):
+        raise Exception(f"Another transfer of {safe_attachment_name} is in progress.")
+    return key
+
+def skip_duplicate(sha256, message_id, attachment_id, safe_attachment_name):
+    """
+    Tells whether the content was already transferred, remembering this copy's ids if so.
+    """
+    if not dedup_index.is_processed('fetch', sha256):
+        return False
+    # Same invoice forwarded again
+    logger.info(f"Skipping duplicate attachment: {safe_attachment_name}")
+    dedup_index.mark_processed('fetch', sha256, message_id, attachment_id, safe_attachment_name)
+    return True
+
+def is_duplicate(sha256, message_id, attachment_id, safe_attachment_name, claims):
+    """
+    Skips content that was already transferred, otherwise claims it for this transfer.
+
+    :param claims: List the claim key is added to, for the caller to release.
+    """
+    if skip_duplicate(sha256, message_id, attachment_id, safe_attachment_name):
+        return True
+    claims.append(claim(f'fetch:{sha256}', safe_attachment_name))
+    # Another worker may have finished the same content before the claim
+    return skip_duplicate(sha256, message_id, attachment_id, safe_attachment_name)
+
+def submit_transfer(executor, slots, *args):
+    """
+    Queues a transfer on the pool, blocking while MAX_PENDING_TRANSFERS are in flight.
+
+    The semaphore is the backpressure: message listing pauses until a worker
+    frees a slot, so at most MAX_PENDING_TRANSFERS attachments are held at once.
+    """
+    slots.acquire()
+    future = executor.submit(transfer_attachment, *args)
+    future.add_done_callback(lambda _: slots.release())
+    return future
+
+def process_email(access_token, email, executor=None, slots=None):
+    """
+    Logs an email and transfers its file attachments.
+
+    With an executor the transfers are queued on the pool, otherwise they run
+    inline. Either way a future per transfer is returned, with the result of
+    transfer_attachment().
+    """
+    subject = email.get('subject', '(No Subject)')
+    sender = email.get('from', {}).get('emailAddress', {}).get('address', '(Unknown Sender)')
+    logger.info(f"From: {sender}, Subject: {subject}")
+
+    futures = []
+    attachments = email.get('attachments', [])
+    if attachments:
+        logger.info(f"Found {len(attachments)} attachment(s). Downloading and uploading to OneDrive...")
+        for attachment in attachments:
+            # Only metadata was listed so far, skipped attachments are never downloaded
+            if not attachment_rules.attachment_matches(attachment):
+                logger.info(f"Skipping attachment {attachment.get('name')} ({attachment.get('contentType')}, {attachment.get('size')} bytes).")
+                continue
+            if executor is None:
+                future = Future()
+                future.set_result(transfer_attachment(access_token, email['id'], attachment))
+                futures.append(future)
+            else:
+                futures.append(submit_transfer(executor, slots, access_token, email['id'], attachment))
+    else:
+        logger.info("No attachments found in this email.")
+    logger.info("-" * 50)
+    return futures
+
+def fetch_latest_emails(access_token, executor=None, slots=None):
+    """
+    Processes the latest message with attachments.
+
+    Attachments are listed by metadata only; their content is downloaded once,
+    by the transfer, instead of also being inlined by $expand.
+    """
+    endpoint = f'{GRAPH_URL}/me/messages'
+    params = {
+        '$top': 1,
+        '$select': attachment_rules.MESSAGE_SELECT,
+        '$filter': attachment_rules.message_filter(),
+        '$orderby': 'receivedDateTime desc',
+    }
+
+    response = graph_client.get(endpoint, access_token=access_token, params=params)
+    if response.status_code == 200:
+        emails = [m for m in response.json().get('value', []) if attachment_rules.message_matches(m)]
+        attachments = graph_batch.fetch_attachment_metadata(access_token, [m['id'] for m in emails])
+        for email in emails:
+            email['attachments'] = attachments.get(email['id'], [])
+            process_email(access_token, email, executor, slots)
+    else:
+        logger.error(f"Failed to fetch emails: {response.status_code} - {response.text}")
+
+def process_messages(access_token, messages, state, seen_ids, executor=None, slots=None, check_rules=True):
+    """
+    Transfers the attachments of a page of messages and records which ones are done.
+
+    A message is only remembered as handled once all its transfers succeeded.
+    The delta query does not return the others again, so they are kept in
+    state['retry_ids'] and retried by the next syncs, at most MAX_MESSAGE_RETRIES times.
+
+    :param check_rules: Apply the sender/subject rules, which need the message's metadata.
+    """
+    # One $batch call lists the attachments of up to 20 messages
+    # Message delta only filters on receivedDateTime, so the sender/subject rules are applied here
+    listed_ids = [m['id'] for m in messages if not check_rules or attachment_rules.message_matches(m)]
+    attachments = graph_batch.fetch_attachment_metadata(access_token, listed_ids)
+    message_futures = []
+    for message in messages:
+        if message['id'] in listed_ids and message['id'] not in attachments:
+            # Listing the attachments failed
+            message_futures.append((message['id'], None))
+            continue
+        message['attachments'] = attachments.get(message['id'], [])
+        message_futures.append((message['id'], process_email(access_token, message, executor, slots)))
+
+    for message_id, futures in message_futures:
+        # Waits for the page's transfers, so none are lost when the state is saved
+        if futures is not None and all(future.result() for future in futures):
+            state['retry_ids'].pop(message_id, None)
         else:
-            logger.error(f"Failed to fetch emails: {response.status_code} - {response.text}")
+            attempts = state['retry_ids'].get(message_id, 0) + 1
+            if attempts <= MAX_MESSAGE_RETRIES:
+                logger.warning(f"Transfers of message {message_id} failed, it will be retried ({attempts}/{MAX_MESSAGE_RETRIES}).")
+                state['retry_ids'][message_id] = attempts
+                continue
+            logger.error(f"Giving up on message {message_id} after {MAX_MESSAGE_RETRIES} retries.")
+            state['retry_ids'].pop(message_id, None)
+        if message_id not in seen_ids:
+            seen_ids.add(message_id)
+            state['seen_ids'].append(message_id)
+
+def sync_emails(access_token, executor=None, slots=None):
+    """
+    Processes only the inbox messages that changed since the last run.
+
+    Message ids already handled are remembered in the state file, so messages
+    that show up again (e.g. because they were marked as read) are skipped.
+    Messages with failed transfers from earlier runs are retried first.
+    """
+    state = load_delta_state()
+    seen_ids = set(state['seen_ids'])
+    processed = 0
+
+    retry_ids = list(state['retry_ids'])
+    if retry_ids:
+        logger.info(f"Retrying {len(retry_ids)} message(s) with failed transfers.")
+        # They passed the sender/subject rules when they were first listed
+        process_messages(access_token, [{'id': message_id} for message_id in retry_ids], state, seen_ids, executor, slots, check_rules=False)
+        save_delta_state(state)
+
+    for messages in fetch_delta_pages(access_token, state):
+        new_messages = [m for m in messages if '@removed' not in m and m['id'] not in seen_ids]
+        process_messages(access_token, new_messages, state, seen_ids, executor, slots)
+        processed += len(new_messages)
+        # Persist after every page so a crash does not reprocess handled messages
+        save_delta_state(state)
+    save_delta_state(state)
+
+    logger.info(f"Delta sync finished, processed {processed} new message(s).")
+
+def fetch_emails(mode=SYNC_MODE, max_workers=MAX_WORKERS):
+    try:
+        # Sign in up front; requests then get a current token from the provider,
+        # since a sync can outlast the one-hour lifetime of any token taken here
+        get_access_token()
+        slots = threading.BoundedSemaphore(MAX_PENDING_TRANSFERS)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            if mode == 'delta':
+                sync_emails(None, executor, slots)
+            else:
+                fetch_latest_emails(None, executor, slots)
 
     except Exception as e:
         logger.error(f"An error occurred: {e}")
+    finally:
+        graph_client.log_latency_stats()
 
 if __name__ == "__main__":
     fetch_emails()
@@ -1,51 +1,142 @@
-from transformers import AutoProcessor, AutoModelForImageTextToText
-from qwen_vl_utils import process_vision_info
+from PIL import Image
 import json
-import torch
 import os 
-from app_json2excel2onedrive import upload_to_onedrive, get_access_token
 import shutil
+import dedup_index
+import pdf_pages
+import invoice_text
+import inference_cache
+import invoice_store
+import extraction_worker
+import extraction_pool
 
-processor = AutoProcessor.from_pretrained("Qwen/Qwen2-VL-2B-Instruct")
-model = AutoModelForImageTextToText.from_pretrained("Qwen/Qwen2-VL-2B-Instruct")
+MODEL_ID = os.getenv('PDF2JSON_MODEL', 'Qwen/Qwen2-VL-2B-Instruct')
+MODEL_REVISION = os.getenv('PDF2JSON_MODEL_REVISION', 'main')  # pin a commit hash to keep cached results exact
+BATCH_SIZE = int(os.getenv('PDF2JSON_BATCH_SIZE', '4'))  # images per generate() call
+RESIZED_HEIGHT = int(os.getenv('PDF2JSON_RESIZED_HEIGHT', '696'))  # 0 keeps the native resolution
+RESIZED_WIDTH = int(os.getenv('PDF2JSON_RESIZED_WIDTH', '943'))
+MAX_NEW_TOKENS = int(os.getenv('PDF2JSON_MAX_NEW_TOKENS', '1024'))  # upper bound, generation stops at the end of the JSON
+ANSWER_PREFIX = '{'
+DTYPE = os.getenv('PDF2JSON_DTYPE', 'float32')  # 'float32', 'bfloat16' or 'int8'
+NUM_THREADS = int(os.getenv('PDF2JSON_NUM_THREADS', '0'))  # intra-op threads, 0 = torch default
+INTEROP_THREADS = int(os.getenv('PDF2JSON_INTEROP_THREADS', '0'))
+COMPILE = os.getenv('PDF2JSON_COMPILE', '0') == '1'
+PROMPT = "Retrieve invoice_number, date_of_issue, seller_info, client_info, invoice_items_table, currency. Response must be in JSON format"
 
+processor = None
+model = None
 
-if torch.cuda.is_available():
-    model = model.to("cuda")
-    print("Model moved to GPU")
-else:
-    model = model.to("cpu")
-    print("Model moved to CPU")
 
+def load_model():
+    """
+    Loads the processor and model on first use.
 
-def pdf2json(file_path):
-    file_name = file_path
+    torch/transformers are imported here as well, so a run without anything
+    to extract does not pay the multi-second import and load.
+    """
+    global processor, model
+    if model is None:
+        set_threads(NUM_THREADS, INTEROP_THREADS)
+        processor, model = create_model(DTYPE, COMPILE)
+    return processor, model
+
+def set_threads(num_threads=0, interop_threads=0):
+    """
+    Pins torch's intra-op and inter-op thread pools; 0 keeps torch's default.
+
+    The inter-op pool can only be sized before torch runs any parallel work.
+    """
+    import torch
+
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    if interop_threads:
+        torch.set_num_interop_threads(interop_threads)
+
+def create_model(dtype='float32', compile_model=False):
+    """
+    Builds the processor and model for the given CPU performance settings.
+
+    :param dtype: 'float32', 'bfloat16' or 'int8' (dynamic quantization of the
+        Linear layers, CPU only).
+    :param compile_model: Wrap the forward pass in torch.compile.
+    """
+    from transformers import AutoProcessor, AutoModelForImageTextToText
+    import torch
+
+    processor = AutoProcessor.from_pretrained(MODEL_ID, revision=MODEL_REVISION)
+    # Decoder-only generation needs the padding on the left when batching prompts
+    processor.tokenizer.padding_side = "left"
+    torch_dtype = torch.bfloat16 if dtype == 'bfloat16' else torch.float32
+    model = AutoModelForImageTextToText.from_pretrained(MODEL_ID, revision=MODEL_REVISION, torch_dtype=torch_dtype)
+
+    if torch.cuda.is_available():
+        model = model.to("cuda")
+        print("Model moved to GPU")
+    else:
+        model = model.to("cpu")
+        print("Model moved to CPU")
+        if dtype == 'int8':
+            model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+            print("Model quantized to int8")
+    model.eval()
+    if compile_model:
+        model.forward = torch.compile(model.forward)
+    return processor, model
 
-    messages = [
+def build_messages(file_name):
+    image = {
+        "type": "image",
+        "image": file_name,
+    }
+    if RESIZED_HEIGHT and RESIZED_WIDTH:
+        image["resized_height"] = RESIZED_HEIGHT
+        image["resized_width"] = RESIZED_WIDTH
+    return [
         {
             "role": "user",
             "content": [
-                {
-                    "type": "image",
-                    "image": file_name,
-                    "resized_height": 696,
-                    "resized_width": 943,
-                },
+                image,
                 {
                     "type": "text",
-                    "text": "Retrieve invoice_number, date_of_issue, seller_info, client_info, invoice_items_table, currency. Response must be in JSON format"
+                    "text": PROMPT
                 }
             ]
         }
     ]
 
-    text = processor.apply_chat_template(
-        messages, tokenize=False, add_generation_prompt=True
-    )
+def image_area(file_name):
+    """
+    Number of pixels fed to the vision encoder, which drives the prompt length.
+    """
+    if RESIZED_HEIGHT and RESIZED_WIDTH:
+        return RESIZED_HEIGHT * RESIZED_WIDTH
+    with Image.open(file_name) as image:
+        return image.width * image.height
+
+def generate_outputs(file_names):
+    """
+    Runs one padded generate() call over all given images.
+
+    :param file_names: Image paths, ideally of similar size to keep padding low.
+    :return: Raw model output per image, in the same order.
+    """
+    import torch
+    from qwen_vl_utils import process_vision_info
+    from transformers import StoppingCriteriaList
+    from json_stopping import JsonObjectStoppingCriteria
 
-    image_inputs, video_inputs = process_vision_info(messages)
+    processor, model = load_model()
+    batch_messages = [build_messages(file_name) for file_name in file_names]
+    # The answer is started with '{' so the model continues a JSON object right away
+    texts = [
+        processor.apply_chat_template(messages, tokenize=False, add_generation_prompt=True) + ANSWER_PREFIX
+        for messages in batch_messages
+    ]
+
+    image_inputs, video_inputs = process_vision_info(batch_messages)
     inputs = processor(
-        text=[text],
+        text=texts,
         images=image_inputs,
         videos=video_inputs,
         padding=True,
@@ -56,21 +147,122 @@ def pdf2json(file_path):
     device = "cuda" if torch.cuda.is_available() else "cpu"
     inputs = {key: value.to(device) for key, value in inputs.items()}
 
-    generated_ids = model.generate(**inputs, max_new_tokens=1024)
+    # Each sequence stops as soon as its JSON object is closed instead of running to MAX_NEW_TOKENS
+    stopping_criteria = StoppingCriteriaList([
+        JsonObjectStoppingCriteria(processor.tokenizer, len(texts), prefix=ANSWER_PREFIX)
+    ])
+    with torch.inference_mode():
+        generated_ids = model.generate(**inputs, max_new_tokens=MAX_NEW_TOKENS, stopping_criteria=stopping_criteria)
     generated_ids_trimmed = [
         out_ids[len(in_ids) :] for in_ids, out_ids in zip(inputs["input_ids"], generated_ids)
     ]
 
-    output_text = processor.batch_decode(
+    output_texts = processor.batch_decode(
         generated_ids_trimmed, skip_special_tokens=True, clean_up_tokenization_spaces=True)
+    return [ANSWER_PREFIX + output_text for output_text in output_texts]
+
+def pdf2json(file_path):
+    pdf2json_batch([file_path])
 
-    json_string = output_text[0]
+def pdf2json_batch(file_paths, batch_size=BATCH_SIZE, map_batches=map):
+    """
+    Extracts invoice data from many images and PDFs with batched generation.
+
+    PDFs with a text layer that parses with enough confidence skip the model.
+    Other PDFs are rasterized lazily: each round sends the next page of every
+    document that has no valid result yet, so a multi-page invoice only
+    renders pages until one of them yields the invoice data. Within a round
+    pages are sorted by size so each batch pads as little as possible, then
+    processed batch_size at a time in a single generate() call each.
+    Generations are cached by image hash, prompt, model and token budget, so
+    re-processing a file (e.g. after a failed upload) skips the model.
+
+    :param file_paths: Image or PDF paths.
+    :param batch_size: Number of images per generate() call.
+    :param map_batches: map()-like function used to run generate_outputs over
+        the batches of a round, e.g. a process pool's map. Results must come
+        back in batch order.
+    :return: The paths whose content is now marked as extracted, including
+        ones skipped because they already were.
+    """
+    extracted = []
+    pending = []
+    for file_path in file_paths:
+        # The same invoice is often forwarded several times, skip contents already extracted
+        sha256 = dedup_index.file_sha256(file_path)
+        if dedup_index.is_processed('extract', sha256):
+            print(f"Skipping already extracted file: {file_path}")
+            extracted.append(file_path)
+            continue
+        if file_path.lower().endswith('.pdf'):
+            # Digitally generated invoices carry their data in the text layer, no VLM needed
+            record = invoice_text.extract_invoice(file_path)
+            if record is not None:
+                print(f"Read invoice data from text layer: {file_path}")
+                if store_record(file_path, sha256, record):
+                    extracted.append(file_path)
+                continue
+            size = (RESIZED_WIDTH, RESIZED_HEIGHT) if RESIZED_HEIGHT and RESIZED_WIDTH else None
+            pages = pdf_pages.iter_pdf_pages(file_path, size=size, sha256=sha256)
+        else:
+            pages = iter([file_path])
+        pending.append((file_path, sha256, pages))
+
+    while pending:
+        items = []
+        next_pending = []
+        for file_path, sha256, pages in pending:
+            page = next(pages, None)
+            if page is None:
+                print(f"No invoice data found in: {file_path}")
+                continue
+            page_sha256 = sha256 if page == file_path else dedup_index.file_sha256(page)
+            image_settings = f"{RESIZED_WIDTH}x{RESIZED_HEIGHT}" if page == file_path else f"{RESIZED_WIDTH}x{RESIZED_HEIGHT}@{pdf_pages.PDF_DPI}dpi"
+            key = inference_cache.cache_key(
+                page_sha256, PROMPT + ANSWER_PREFIX, MODEL_ID, f"{MODEL_REVISION}:{DTYPE}", MAX_NEW_TOKENS, image_settings
+            )
+            cached = inference_cache.get(key)
+            if cached is None:
+                items.append((page, file_path, sha256, pages, key))
+            elif cached[1] is None:
+                # Cached result without invoice data, try the next page
+                next_pending.append((file_path, sha256, pages))
+            elif store_record(file_path, sha256, cached[1]):
+                extracted.append(file_path)
+
+        items.sort(key=lambda item: image_area(item[0]))
+        batches = [items[start:start + batch_size] for start in range(0, len(items), batch_size)]
+        batch_pages = [[page for page, _, _, _, _ in batch] for batch in batches]
+        for batch, output_texts in zip(batches, map_batches(generate_outputs, batch_pages)):
+            for (page, file_path, sha256, pages, key), output_text in zip(batch, output_texts):
+                formatted_json = parse_output(output_text)
+                inference_cache.put(key, output_text, formatted_json)
+                if formatted_json is None:
+                    next_pending.append((file_path, sha256, pages))
+                elif store_record(file_path, sha256, formatted_json):
+                    extracted.append(file_path)
+        pending = next_pending
+    return extracted
+
+def parse_output(output_text):
+    """
+    Maps the model output to the client/date/brutto/net/vat/currency record.
+
+    :return: The record, or None when the output is not usable.
+    """
+    json_string = output_text
     json_string = json_string.strip("[]'")
     json_string = json_string.replace("```json\n", "").replace("\n```", "")
     json_string = json_string.replace("'", "")
     print(json_string)
     try:
-        formatted_json2 = json.loads(json_string)
+        try:
+            formatted_json2 = json.loads(json_string)
+        except json.JSONDecodeError:
+            from json_stopping import strip_trailing_commas
+
+            # Trailing commas are the most common slip in otherwise complete objects
+            formatted_json2 = json.loads(strip_trailing_commas(json_string))
         # formatted_json2 = {
         #     "invoice_number": "04/85/1345",
         #     "date_of_issue": "04. January 2023",
@@ -103,49 +295,69 @@ def pdf2json(file_path):
             "vat": formatted_json2["invoice_items_table"][0]["vat_amount"],
             "currency": formatted_json2["currency"],
         }
-        extension = file_name.split('.')[-1]
-        filename = file_name.split('/')[-1]
-        formatted_json['date'] = formatted_json['date'].replace('.', '')
-        formatted_filename = formatted_json['client'] + '.' + extension
-        formatted_filename_json = formatted_json['client'] + '.json'
-        file_path = 'Data/InvoiceData/' + formatted_filename_json
-
-        if os.path.exists(file_path):
-            with open(file_path, 'r') as f:
-                existing_data = json.load(f)
-                if not isinstance(existing_data, list):
-                    existing_data = [existing_data]
-        else:
-            existing_data = []
-
-        existing_data.append(formatted_json)
-
-        with open(file_path, 'w') as f:
-            json.dump(existing_data, f, indent=4)
-            access_token = get_access_token()
-            filepathinOneDrive = 'Attachments/' + formatted_json['client'] + '/' + formatted_json['client'] + '_' + formatted_json['date'] + '.' + extension
-            print('filename: ', filename)
-            print('filepathinOneDrive: ', filepathinOneDrive)
-            print('formatted_filename: ', formatted_filename)
-            print('extension: ', extension)
-            upload_to_onedrive(access_token, file_name, filepathinOneDrive)
-            # if subdirectory does not exist, create it
-            if not os.path.exists('Data/Attachments/' + formatted_json['client']):
-                os.makedirs('Data/Attachments/' + formatted_json['client'])
-                print("creating the dir!!!!")
-            shutil.copy(file_path, 'Data/' + filepathinOneDrive)    
+        return formatted_json
     except json.JSONDecodeError as e:
         print("Not valid JSON format:", e)
+    except (KeyError, IndexError, TypeError) as e:
+        print("Missing invoice field:", e)
+    return None
+
+def store_record(file_name, sha256, formatted_json):
+    """
+    Appends an invoice record to the invoice store and uploads the invoice.
+
+    The per-client JSON files are exported from the store when summaries are
+    built, instead of being rewritten for every invoice.
+
+    :return: Whether the invoice was uploaded and its content marked as extracted.
+    """
+    from app_json2excel2onedrive import upload_to_onedrive
+    from token_provider import get_access_token
+
+    extension = file_name.split('.')[-1]
+    filename = file_name.split('/')[-1]
+    formatted_json['date'] = formatted_json['date'].replace('.', '')
+    formatted_filename = formatted_json['client'] + '.' + extension
+
+    if not invoice_store.append(formatted_json, sha256=sha256):
+        print(f"Invoice record already stored for: {file_name}")
+
+    access_token = get_access_token()
+    filepathinOneDrive = 'Attachments/' + formatted_json['client'] + '/' + formatted_json['client'] + '_' + formatted_json['date'] + '.' + extension
+    print('filename: ', filename)
+    print('filepathinOneDrive: ', filepathinOneDrive)
+    print('formatted_filename: ', formatted_filename)
+    print('extension: ', extension)
+    uploaded = upload_to_onedrive(access_token, file_name, filepathinOneDrive)
+    if uploaded:
+        dedup_index.mark_processed('extract', sha256, name=filename)
+    # if subdirectory does not exist, create it
+    if not os.path.exists('Data/Attachments/' + formatted_json['client']):
+        os.makedirs('Data/Attachments/' + formatted_json['client'])
+        print("creating the dir!!!!")
+    shutil.copy(file_name, 'Data/' + filepathinOneDrive)
+    return uploaded
 
 if __name__ == "__main__":
     attachments_folder = "attachments/"
     try:
+        file_paths = []
         for filename in os.listdir(attachments_folder):
             file_path = os.path.join(attachments_folder, filename)
             if filename.lower().endswith(('.jpg', '.jpeg', '.png')):
                 print(f"Processing picture file: {file_path}")
-                pdf2json(file_path)
+                file_paths.append(file_path)
+            elif filename.lower().endswith('.pdf'):
+                print(f"Processing PDF file: {file_path}")
+                file_paths.append(file_path)
             # else:
             #     print(f"Can not process: {file_path}. It needs to be a picture file.")
+        # Hand the files to a running extraction worker, which already has the model loaded
+        if file_paths and not extraction_worker.submit(file_paths):
+            workers = extraction_pool.default_workers()
+            if workers > 1 and len(file_paths) > BATCH_SIZE:
+                extraction_pool.pdf2json_parallel(file_paths, workers)
+            else:
+                pdf2json_batch(file_paths)
     except Exception as e:
-        print(f"Error: {e}")
\ No newline at end of file
+        print(f"Error: {e}")
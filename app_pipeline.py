@@ -0,0 +1,142 @@
+"""
+Runs fetch -> extract -> store -> summarize -> upload as one streaming pipeline.
+
+Attachments go to extraction as soon as they are downloaded, and summaries
+are rebuilt and uploaded as soon as new invoices are stored, instead of each
+stage waiting for the previous script to finish and rescanning its folder.
+
+    python app_pipeline.py            # one sync, then drain the pipeline (cron)
+    python app_pipeline.py --watch    # keep syncing every PIPELINE_POLL_INTERVAL seconds
+"""
+import os
+import sys
+import time
+import queue
+import logging
+import threading
+import app_outlook2pdf2onedrive
+import app_pdf2json
+import app_json2excel2onedrive
+from dotenv import load_dotenv
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+EXTRACT_QUEUE_SIZE = int(os.getenv('PIPELINE_EXTRACT_QUEUE_SIZE', '16'))  # downloads waiting for extraction
+POLL_INTERVAL = int(os.getenv('PIPELINE_POLL_INTERVAL', '30'))  # seconds between mailbox syncs with --watch
+INVOICE_DATA_DIR = 'Data/InvoiceData/'
+STOP = None
+
+def pending_attachments():
+    """
+    Attachments left by an earlier run that were not extracted yet.
+
+    extract_stage() removes every attachment once it is extracted, so the
+    folder only holds pending work and nothing needs to be hashed here.
+    """
+    attachments_dir = app_outlook2pdf2onedrive.ATTACHMENTS_DIR
+    if not os.path.isdir(attachments_dir):
+        return []
+    return [
+        os.path.join(attachments_dir, filename)
+        for filename in sorted(os.listdir(attachments_dir))
+        if filename.lower().endswith(app_outlook2pdf2onedrive.EXTRACTABLE_EXTENSIONS)
+    ]
+
+def remove_extracted(file_paths):
+    """
+    Deletes local attachments whose content is marked as extracted.
+
+    The invoice is in OneDrive and under Data/Attachments/ by then. Files
+    without invoice data stay, so the next start tries them again.
+    """
+    for file_path in file_paths:
+        try:
+            os.remove(file_path)
+        except FileNotFoundError:
+            pass
+
+def extract_stage(files, summaries):
+    """
+    Extracts downloaded attachments, up to BATCH_SIZE per generate() call.
+
+    Whatever is queued is taken right away rather than waiting for a full
+    batch, so a single invoice is not held back.
+    """
+    while True:
+        file_paths = [files.get()]
+        while len(file_paths) < app_pdf2json.BATCH_SIZE and file_paths[-1] is not STOP:
+            try:
+                file_paths.append(files.get_nowait())
+            except queue.Empty:
+                break
+        stop = file_paths[-1] is STOP
+        file_paths = [p for p in file_paths if p is not STOP and os.path.exists(p)]
+        if file_paths:
+            try:
+                remove_extracted(app_pdf2json.pdf2json_batch(file_paths))
+            except Exception as e:
+                logger.error(f"Extraction of {file_paths} failed: {e}")
+            try:
+                # One pending summary run covers every batch stored before it starts
+                summaries.put_nowait(True)
+            except queue.Full:
+                pass
+        if stop:
+            summaries.put(STOP)
+            return
+
+def summarize_stage(summaries):
+    """
+    Rebuilds and uploads the summaries of clients with new invoices.
+    """
+    while True:
+        signal = summaries.get()
+        try:
+            app_json2excel2onedrive.upload_json2onedrive(directory=INVOICE_DATA_DIR)
+        except Exception as e:
+            logger.error(f"Summary upload failed: {e}")
+        if signal is STOP:
+            return
+
+def run_pipeline(watch=False, wait_for_changes=None):
+    """
+    Syncs the mailbox and streams its attachments through the pipeline.
+
+    The extraction queue is bounded: when extraction falls behind, transfers
+    block on it, which in turn pauses the mailbox listing.
+
+    :param watch: Keep syncing every POLL_INTERVAL seconds instead of stopping after one sync.
+    :param wait_for_changes: Blocks until the mailbox should be synced again,
+        e.g. on a change notification; implies watch.
+    """
+    files = queue.Queue(maxsize=EXTRACT_QUEUE_SIZE)
+    summaries = queue.Queue(maxsize=1)
+    stages = [
+        threading.Thread(target=extract_stage, args=(files, summaries), name='extract'),
+        threading.Thread(target=summarize_stage, args=(summaries,), name='summarize'),
+    ]
+    for stage in stages:
+        stage.start()
+
+    app_outlook2pdf2onedrive.set_attachment_handler(files.put)
+    try:
+        for file_path in pending_attachments():
+            files.put(file_path)
+        while True:
+            app_outlook2pdf2onedrive.fetch_emails()
+            if wait_for_changes is not None:
+                wait_for_changes()
+            elif watch:
+                time.sleep(POLL_INTERVAL)
+            else:
+                break
+    finally:
+        # Let the queued attachments and summaries finish before exiting
+        files.put(STOP)
+        for stage in stages:
+            stage.join()
+
+if __name__ == "__main__":
+    run_pipeline(watch='--watch' in sys.argv)
@@ -0,0 +1,65 @@
+import os
+
+# Configuration
+ATTACHMENT_CONTENT_TYPES = [t.strip().lower() for t in os.getenv('ATTACHMENT_CONTENT_TYPES', 'application/pdf,image/jpeg,image/png').split(',') if t.strip()]
+ATTACHMENT_EXTENSIONS = tuple(e.strip().lower() for e in os.getenv('ATTACHMENT_EXTENSIONS', '.pdf,.jpg,.jpeg,.png').split(',') if e.strip())
+ATTACHMENT_MIN_IMAGE_SIZE = int(os.getenv('ATTACHMENT_MIN_IMAGE_SIZE', str(10 * 1024)))  # logos and signature images are smaller
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tif', '.tiff')
+ATTACHMENT_MAX_SIZE = int(os.getenv('ATTACHMENT_MAX_SIZE', str(25 * 1024 * 1024)))
+SENDER_RULES = [s.strip().lower() for s in os.getenv('INVOICE_SENDERS', '').split(',') if s.strip()]  # addresses or @domains
+SUBJECT_KEYWORDS = [k.strip().lower() for k in os.getenv('INVOICE_SUBJECT_KEYWORDS', '').split(',') if k.strip()]
+MESSAGE_SELECT = 'id,subject,from,hasAttachments,receivedDateTime'
+ATTACHMENT_SELECT = 'id,name,contentType,size,isInline'
+
+def message_filter():
+    """
+    OData $filter for message listings (not delta queries, which only filter on receivedDateTime).
+
+    Graph requires the $orderby property (receivedDateTime) to come first.
+    Subject keywords are left to message_matches() since contains() on
+    subjects is not reliably supported together with $orderby.
+    """
+    clauses = ["receivedDateTime ge 1900-01-01T00:00:00Z", "hasAttachments eq true"]
+    senders = [s for s in SENDER_RULES if not s.startswith('@')]
+    if senders and len(senders) == len(SENDER_RULES):
+        escaped = [s.replace("'", "''") for s in senders]
+        clauses.append('(' + ' or '.join(f"from/emailAddress/address eq '{s}'" for s in escaped) + ')')
+    return ' and '.join(clauses)
+
+def message_matches(message):
+    """
+    Tells whether a message can carry an invoice, from its listing fields only.
+    """
+    if not message.get('hasAttachments'):
+        return False
+    if SENDER_RULES:
+        sender = message.get('from', {}).get('emailAddress', {}).get('address', '').lower()
+        if not any(sender == rule or (rule.startswith('@') and sender.endswith(rule)) for rule in SENDER_RULES):
+            return False
+    if SUBJECT_KEYWORDS:
+        subject = (message.get('subject') or '').lower()
+        if not any(keyword in subject for keyword in SUBJECT_KEYWORDS):
+            return False
+    return True
+
+def attachment_matches(attachment):
+    """
+    Tells whether an attachment looks like an invoice, from its metadata only.
+
+    Item and reference attachments, inline images (signatures, logos) and
+    files outside the type and size rules are never downloaded. The minimum
+    size only applies to images, a text-only PDF invoice can be a few KiB.
+    """
+    odata_type = attachment.get('@odata.type', '#microsoft.graph.fileAttachment')
+    if odata_type != '#microsoft.graph.fileAttachment':
+        return False
+    if attachment.get('isInline'):
+        return False
+    content_type = (attachment.get('contentType') or '').lower()
+    name = (attachment.get('name') or '').lower()
+    if content_type not in ATTACHMENT_CONTENT_TYPES and not name.endswith(ATTACHMENT_EXTENSIONS):
+        return False
+    size = attachment.get('size', 0)
+    is_image = content_type.startswith('image/') or name.endswith(IMAGE_EXTENSIONS)
+    min_size = ATTACHMENT_MIN_IMAGE_SIZE if is_image else 0
+    return min_size <= size <= ATTACHMENT_MAX_SIZE
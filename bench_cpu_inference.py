@@ -0,0 +1,86 @@
+"""
+Benchmarks the invoice extraction model on CPU under different performance settings.
+
+Every combination of dtype, thread count and torch.compile is loaded in turn
+and run over the same images after one warm-up batch. Results are printed as
+a table and can be written to a JSON file to compare machines or releases.
+
+Example:
+    python bench_cpu_inference.py attachments/*.jpg --dtypes float32 bfloat16 int8 --threads 4 8 --compile
+"""
+import os
+import json
+import time
+import argparse
+import itertools
+import app_pdf2json
+
+def count_tokens(processor, output_texts):
+    # The forced answer prefix was not generated by the model
+    return sum(
+        len(processor.tokenizer(output_text[len(app_pdf2json.ANSWER_PREFIX):]).input_ids)
+        for output_text in output_texts
+    )
+
+def run_config(file_paths, dtype, num_threads, compile_model, batch_size, repeats):
+    import torch
+
+    app_pdf2json.set_threads(num_threads)
+    processor, model = app_pdf2json.create_model(dtype, compile_model)
+    app_pdf2json.processor, app_pdf2json.model = processor, model
+
+    torch.manual_seed(0)
+    # Warm-up, also triggers compilation when enabled
+    app_pdf2json.generate_outputs(file_paths[:batch_size])
+
+    generated_tokens = 0
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for i in range(0, len(file_paths), batch_size):
+            output_texts = app_pdf2json.generate_outputs(file_paths[i:i + batch_size])
+            generated_tokens += count_tokens(processor, output_texts)
+    elapsed = time.perf_counter() - start
+
+    invoices = len(file_paths) * repeats
+    return {
+        'dtype': dtype,
+        'threads': num_threads or torch.get_num_threads(),
+        'compile': compile_model,
+        'batch_size': batch_size,
+        'invoices': invoices,
+        'generated_tokens': generated_tokens,
+        'seconds_per_invoice': elapsed / invoices,
+        'tokens_per_second': generated_tokens / elapsed,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('images', nargs='+', help='Invoice images to extract.')
+    parser.add_argument('--dtypes', nargs='+', default=['float32', 'bfloat16', 'int8'])
+    parser.add_argument('--threads', nargs='+', type=int, default=[0], help='Intra-op thread counts, 0 = torch default.')
+    parser.add_argument('--interop-threads', type=int, default=0, help='Inter-op threads, fixed for the whole run.')
+    parser.add_argument('--compile', action='store_true', help='Also run every configuration with torch.compile.')
+    parser.add_argument('--batch-size', type=int, default=app_pdf2json.BATCH_SIZE)
+    parser.add_argument('--repeats', type=int, default=1)
+    parser.add_argument('--output', help='Write the results to this JSON file.')
+    args = parser.parse_args()
+
+    app_pdf2json.set_threads(interop_threads=args.interop_threads)
+    compile_options = [False, True] if args.compile else [False]
+    file_paths = [os.path.abspath(p) for p in args.images]
+
+    results = []
+    for dtype, num_threads, compile_model in itertools.product(args.dtypes, args.threads, compile_options):
+        result = run_config(file_paths, dtype, num_threads, compile_model, args.batch_size, args.repeats)
+        results.append(result)
+        print(
+            f"{result['dtype']:>9} threads={result['threads']:<3} compile={str(result['compile']):<5} "
+            f"{result['seconds_per_invoice']:8.2f} s/invoice {result['tokens_per_second']:8.2f} tokens/s"
+        )
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4)
+
+if __name__ == "__main__":
+    main()
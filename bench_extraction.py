@@ -0,0 +1,239 @@
+"""
+Benchmarks invoice extraction settings on a synthetic corpus with known answers.
+
+A corpus of invoice images is generated once (or an existing one is loaded,
+see ground_truth.json), then every combination of resize, max_new_tokens,
+dtype and batch size is run in its own process and reported with seconds per
+invoice, peak RSS, generated tokens and per-field accuracy for
+client/date/net/vat/brutto/currency. The inference cache and the invoice
+store are bypassed.
+
+Set PDF2JSON_MODEL to a small local checkpoint to run it offline on CPU.
+
+Example:
+    python bench_extraction.py --corpus Data/bench_corpus --count 20 --resize 696x943 0x0 --batch-sizes 1 4
+"""
+import io
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import resource
+import itertools
+import contextlib
+import multiprocessing
+from datetime import datetime, timedelta
+from PIL import Image, ImageDraw, ImageFont
+
+GROUND_TRUTH_FILE = 'ground_truth.json'
+FIELDS = ['client', 'date', 'net', 'vat', 'brutto', 'currency']
+AMOUNT_FIELDS = ('net', 'vat', 'brutto')
+SELLERS = ['PSI Services', 'Luxcon Global', 'Moselle Consulting', 'Nordlicht Software', 'Atelier Vert', 'Rheinfeld Logistik']
+SUFFIXES = ['SA', 'S.à r.l.', 'GmbH', 'AG', 'Ltd', 'SAS']
+CUSTOMERS = ['PSI Concepts SA', 'Aevux SARL', 'Kirchberg Holdings SA', 'Delta Trading GmbH']
+ITEMS = ['Yearly Fee', 'Consulting services', 'Software licence', 'Maintenance contract', 'Transport']
+CURRENCIES = ['EUR', 'CHF', 'USD', 'GBP']  # codes, the default font has no glyphs for € or £
+VAT_RATES = [0.03, 0.08, 0.17, 0.19, 0.20]
+DATE_FORMATS = ['%d %B %Y', '%d %b %Y', '%d/%m/%Y', '%d-%m-%Y', '%Y-%m-%d', '%B %d, %Y', '%d.%m.%Y']
+
+def font(size):
+    return ImageFont.load_default(size=size)
+
+def render_invoice(file_path, truth, customer, invoice_number, item, vat_rate, rng):
+    """
+    Draws a one-page A4 invoice at 150 dpi with the seller on top and a single item line.
+    """
+    image = Image.new('RGB', (1240, 1754), 'white')
+    draw = ImageDraw.Draw(image)
+    amount = lambda value: f"{value:,.2f} {truth['currency']}"
+
+    draw.text((100, 100), truth['client'], fill='black', font=font(44))
+    draw.text((100, 160), f"{rng.randint(1, 99)}, Rue de {rng.choice(['Flawetter', 'Luxembourg', 'Hollerich'])} - L-{rng.randint(1000, 9999)}", fill='black', font=font(24))
+    draw.text((100, 200), f"VAT LU{rng.randint(10000000, 99999999)}", fill='black', font=font(24))
+    draw.text((750, 300), "Bill to:", fill='black', font=font(24))
+    draw.text((750, 335), customer, fill='black', font=font(28))
+    draw.text((100, 420), "INVOICE", fill='black', font=font(56))
+    draw.text((100, 500), f"Invoice number: {invoice_number}", fill='black', font=font(28))
+    draw.text((100, 540), f"Date of issue: {truth['date']}", fill='black', font=font(28))
+
+    columns = [100, 180, 620, 760, 920, 1080]
+    for x, header in zip(columns, ['Pos', 'Description', 'VAT %', 'Net', 'VAT', 'Gross']):
+        draw.text((x, 650), header, fill='black', font=font(24))
+    draw.line((100, 685, 1140, 685), fill='black', width=2)
+    row = ['1', item, f"{vat_rate * 100:.2f}", f"{truth['net']:,.2f}", f"{truth['vat']:,.2f}", f"{truth['brutto']:,.2f}"]
+    for x, value in zip(columns, row):
+        draw.text((x, 700), value, fill='black', font=font(24))
+
+    draw.text((760, 820), f"Total net: {amount(truth['net'])}", fill='black', font=font(26))
+    draw.text((760, 860), f"VAT: {amount(truth['vat'])}", fill='black', font=font(26))
+    draw.text((760, 900), f"Total: {amount(truth['brutto'])}", fill='black', font=font(30))
+    draw.text((100, 1600), f"Payable within 30 days. Currency: {truth['currency']}", fill='black', font=font(22))
+    image.save(file_path)
+
+def generate_corpus(directory, count, seed=0):
+    """
+    Writes count invoice images and their expected records to ground_truth.json.
+    """
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    ground_truth = {}
+    for i in range(count):
+        net = round(rng.uniform(50, 20000), 2)
+        vat_rate = rng.choice(VAT_RATES)
+        vat = round(net * vat_rate, 2)
+        truth = {
+            'client': f"{rng.choice(SELLERS)} {rng.choice(SUFFIXES)}",
+            'date': (datetime(2022, 1, 1) + timedelta(days=rng.randint(0, 1000))).strftime('%d. %B %Y'),
+            'net': net,
+            'vat': vat,
+            'brutto': round(net + vat, 2),
+            'currency': rng.choice(CURRENCIES),
+        }
+        file_name = f"invoice_{i:04d}.png"
+        render_invoice(
+            os.path.join(directory, file_name), truth, rng.choice(CUSTOMERS),
+            f"{rng.randint(1, 12):02d}/{rng.randint(10, 99)}/{rng.randint(1000, 9999)}", rng.choice(ITEMS), vat_rate, rng
+        )
+        ground_truth[file_name] = truth
+    with open(os.path.join(directory, GROUND_TRUTH_FILE), 'w') as f:
+        json.dump(ground_truth, f, indent=4)
+    return ground_truth
+
+def load_corpus(directory, count, seed=0):
+    ground_truth_path = os.path.join(directory, GROUND_TRUTH_FILE)
+    if os.path.exists(ground_truth_path):
+        with open(ground_truth_path, 'r') as f:
+            return json.load(f)
+    return generate_corpus(directory, count, seed)
+
+def normalize_date(value):
+    text = ' '.join(str(value).replace('.', ' ').replace(',', ', ').split()).replace(' ,', ',')
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, date_format.replace('.', ' ')).date().isoformat()
+        except ValueError:
+            continue
+    return text.lower()
+
+def normalize_amount(value):
+    import invoice_text
+
+    if isinstance(value, (int, float)):
+        return round(float(value), 2)
+    match = invoice_text.AMOUNT_PATTERN.search(str(value))
+    return invoice_text.parse_amount(match.group(0)) if match else None
+
+def normalize_currency(value):
+    import invoice_text
+
+    value = str(value).strip()
+    return invoice_text.CURRENCIES.get(value, invoice_text.CURRENCIES.get(value.upper(), value.upper()))
+
+def field_matches(field, predicted, expected):
+    if predicted is None:
+        return False
+    if field in AMOUNT_FIELDS:
+        predicted = normalize_amount(predicted)
+        return predicted is not None and abs(predicted - expected) < 0.01
+    if field == 'date':
+        return normalize_date(predicted) == normalize_date(expected)
+    if field == 'currency':
+        return normalize_currency(predicted) == normalize_currency(expected)
+    return ' '.join(str(predicted).lower().split()) == ' '.join(expected.lower().split())
+
+def peak_rss_bytes():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def run_config(config, file_paths, ground_truth):
+    """
+    Runs one configuration over the corpus; called in a fresh process so peak RSS is its own.
+    """
+    import app_pdf2json
+    from bench_cpu_inference import count_tokens
+
+    app_pdf2json.RESIZED_WIDTH, app_pdf2json.RESIZED_HEIGHT = config['resize']
+    app_pdf2json.MAX_NEW_TOKENS = config['max_new_tokens']
+    app_pdf2json.set_threads(config['threads'])
+    processor, model = app_pdf2json.create_model(config['dtype'], False)
+    app_pdf2json.processor, app_pdf2json.model = processor, model
+
+    batch_size = config['batch_size']
+    correct = {field: 0 for field in FIELDS}
+    parsed = 0
+    generated_tokens = 0
+    start = time.perf_counter()
+    for i in range(0, len(file_paths), batch_size):
+        batch = file_paths[i:i + batch_size]
+        output_texts = app_pdf2json.generate_outputs(batch)
+        generated_tokens += count_tokens(processor, output_texts)
+        for file_path, output_text in zip(batch, output_texts):
+            with contextlib.redirect_stdout(io.StringIO()):
+                record = app_pdf2json.parse_output(output_text)
+            if record is None:
+                continue
+            parsed += 1
+            expected = ground_truth[os.path.basename(file_path)]
+            for field in FIELDS:
+                correct[field] += field_matches(field, record.get(field), expected[field])
+    elapsed = time.perf_counter() - start
+
+    invoices = len(file_paths)
+    return {
+        **config,
+        'resize': f"{config['resize'][0]}x{config['resize'][1]}",
+        'invoices': invoices,
+        'seconds_per_invoice': elapsed / invoices,
+        'peak_rss_mb': peak_rss_bytes() / 1024 / 1024,
+        'generated_tokens': generated_tokens,
+        'tokens_per_invoice': generated_tokens / invoices,
+        'parsed': parsed / invoices,
+        'accuracy': {field: correct[field] / invoices for field in FIELDS},
+    }
+
+def parse_resize(value):
+    width, height = value.lower().split('x')
+    return int(width), int(height)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--corpus', default='Data/bench_corpus', help='Corpus folder, generated if it has no ground_truth.json.')
+    parser.add_argument('--count', type=int, default=20, help='Invoices to generate for a new corpus.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--resize', nargs='+', type=parse_resize, default=[(943, 696)], help='WIDTHxHEIGHT, 0x0 keeps the native size.')
+    parser.add_argument('--max-new-tokens', nargs='+', type=int, default=[1024])
+    parser.add_argument('--dtypes', nargs='+', default=['float32'])
+    parser.add_argument('--batch-sizes', nargs='+', type=int, default=[1])
+    parser.add_argument('--threads', type=int, default=0, help='Intra-op threads, 0 = torch default.')
+    parser.add_argument('--output', help='Write the results to this JSON file.')
+    args = parser.parse_args()
+
+    ground_truth = load_corpus(args.corpus, args.count, args.seed)
+    file_paths = [os.path.abspath(os.path.join(args.corpus, name)) for name in sorted(ground_truth)]
+    configs = [
+        {'resize': resize, 'max_new_tokens': max_new_tokens, 'dtype': dtype, 'batch_size': batch_size, 'threads': args.threads}
+        for resize, max_new_tokens, dtype, batch_size in itertools.product(args.resize, args.max_new_tokens, args.dtypes, args.batch_sizes)
+    ]
+
+    results = []
+    context = multiprocessing.get_context('spawn')
+    for config in configs:
+        with context.Pool(1) as pool:
+            result = pool.apply(run_config, (config, file_paths, ground_truth))
+        results.append(result)
+        accuracy = ' '.join(f"{field}={value:.0%}" for field, value in result['accuracy'].items())
+        print(
+            f"resize={result['resize']:<8} max_new_tokens={result['max_new_tokens']:<5} dtype={result['dtype']:<8} "
+            f"batch={result['batch_size']:<2} {result['seconds_per_invoice']:7.2f} s/invoice "
+            f"{result['peak_rss_mb']:8.0f} MB {result['tokens_per_invoice']:6.1f} tokens/invoice {accuracy}"
+        )
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from contextlib import closing
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+DEDUP_DB = os.getenv('DEDUP_DB', 'Data/dedup_index.sqlite')
+HASH_BLOCK_SIZE = 1024 * 1024
+
+CLAIM_TIMEOUT = 3600  # seconds after which a claim of a crashed transfer can be taken over
+
+_schema_lock = threading.Lock()
+_schema_db = None
+
+def create_schema(conn):
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS processed (
+            stage TEXT NOT NULL,
+            sha256 TEXT NOT NULL,
+            message_id TEXT,
+            attachment_id TEXT,
+            name TEXT,
+            processed_at REAL NOT NULL,
+            size INTEGER,
+            PRIMARY KEY (stage, sha256)
+        )
+    """)
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(processed)')]
+    if 'size' not in columns:
+        # Indexes created before sizes were recorded
+        conn.execute('ALTER TABLE processed ADD COLUMN size INTEGER')
+    conn.execute('CREATE INDEX IF NOT EXISTS processed_name_size ON processed (stage, name, size)')
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS attachments (
+            message_id TEXT NOT NULL,
+            attachment_id TEXT NOT NULL,
+            sha256 TEXT NOT NULL,
+            PRIMARY KEY (message_id, attachment_id)
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS claims (
+            key TEXT PRIMARY KEY,
+            claimed_at REAL NOT NULL
+        )
+    """)
+    conn.commit()
+
+def connect():
+    """
+    Opens the index, creating it on first use.
+
+    Connections are short-lived so the index can be used from worker threads
+    and from several processes at once (WAL journal). The schema is only set
+    up by the first connection of a process.
+    """
+    global _schema_db
+    # A relative DEDUP_DB names another index after a change of directory
+    db_path = os.path.abspath(DEDUP_DB)
+    conn = sqlite3.connect(db_path, timeout=30) if _schema_db == db_path else None
+    if conn is None:
+        with _schema_lock:
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+            conn = sqlite3.connect(db_path, timeout=30)
+            if _schema_db != db_path:
+                create_schema(conn)
+                _schema_db = db_path
+    return conn
+
+def content_sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+def file_sha256(file_path):
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+def is_processed(stage, sha256):
+    """
+    Tells whether content with this hash already went through a stage ('fetch', 'extract').
+    """
+    with closing(connect()) as conn, conn:
+        row = conn.execute('SELECT 1 FROM processed WHERE stage = ? AND sha256 = ?', (stage, sha256)).fetchone()
+    return row is not None
+
+def is_processed_size(stage, name, size):
+    """
+    Tells whether content with this name and size went through a stage.
+
+    Only the hash identifies content, but name and size are known from the
+    attachment metadata before downloading, so a match is worth hashing first.
+    """
+    with closing(connect()) as conn, conn:
+        row = conn.execute(
+            'SELECT 1 FROM processed WHERE stage = ? AND name = ? AND size = ?', (stage, name, size)
+        ).fetchone()
+    return row is not None
+
+def claim(key):
+    """
+    Reserves work on key (e.g. a content hash) for the caller.
+
+    The insert on the unique key is atomic across threads and processes, so
+    of two concurrent copies only one gets the claim. A claim older than
+    CLAIM_TIMEOUT is assumed to belong to a crashed transfer and taken over.
+
+    :return: True when the caller holds the claim and must release() it.
+    """
+    now = time.time()
+    with closing(connect()) as conn, conn:
+        if conn.execute('INSERT OR IGNORE INTO claims (key, claimed_at) VALUES (?, ?)', (key, now)).rowcount:
+            return True
+        return conn.execute(
+            'UPDATE claims SET claimed_at = ? WHERE key = ? AND claimed_at < ?', (now, key, now - CLAIM_TIMEOUT)
+        ).rowcount == 1
+
+def release(key):
+    with closing(connect()) as conn, conn:
+        conn.execute('DELETE FROM claims WHERE key = ?', (key,))
+
+def is_attachment_seen(message_id, attachment_id):
+    """
+    Tells whether a Graph attachment was already handled, before downloading it.
+    """
+    with closing(connect()) as conn, conn:
+        row = conn.execute(
+            'SELECT 1 FROM attachments WHERE message_id = ? AND attachment_id = ?', (message_id, attachment_id)
+        ).fetchone()
+    return row is not None
+
+def mark_processed(stage, sha256, message_id=None, attachment_id=None, name=None, size=None):
+    with closing(connect()) as conn, conn:
+        conn.execute(
+            'INSERT OR IGNORE INTO processed (stage, sha256, message_id, attachment_id, name, processed_at, size) VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (stage, sha256, message_id, attachment_id, name, time.time(), size)
+        )
+        if message_id and attachment_id:
+            conn.execute(
+                'INSERT OR IGNORE INTO attachments (message_id, attachment_id, sha256) VALUES (?, ?, ?)',
+                (message_id, attachment_id, sha256)
+            )
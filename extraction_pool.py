@@ -0,0 +1,90 @@
+import os
+import math
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import psutil
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+EXTRACTION_WORKERS = int(os.getenv('PDF2JSON_WORKERS', '0'))  # 0 = derive from cores and memory
+MIN_WORKER_THREADS = int(os.getenv('PDF2JSON_MIN_WORKER_THREADS', '2'))
+# Resident memory of one Qwen2-VL-2B replica while generating, per dtype
+WORKER_MEMORY_BYTES = {
+    'float32': 10 * 1024 ** 3,
+    'bfloat16': 6 * 1024 ** 3,
+    'int8': 4 * 1024 ** 3,
+}
+WORKER_MEMORY_OVERRIDE = float(os.getenv('PDF2JSON_WORKER_MEMORY_GB', '0'))
+
+def worker_memory(dtype):
+    if WORKER_MEMORY_OVERRIDE:
+        return int(WORKER_MEMORY_OVERRIDE * 1024 ** 3)
+    return WORKER_MEMORY_BYTES.get(dtype, WORKER_MEMORY_BYTES['float32'])
+
+def default_workers(dtype=None):
+    """
+    Number of model replicas this host can run side by side.
+
+    Bounded by the cores (every worker gets at least MIN_WORKER_THREADS) and
+    by the available memory divided by the footprint of one replica, since
+    running out of memory costs far more than an idle core.
+    """
+    import app_pdf2json
+
+    if EXTRACTION_WORKERS:
+        return EXTRACTION_WORKERS
+    cores = psutil.cpu_count(logical=False) or os.cpu_count() or 1
+    by_cores = max(1, cores // MIN_WORKER_THREADS)
+    by_memory = max(1, psutil.virtual_memory().available // worker_memory(dtype or app_pdf2json.DTYPE))
+    return int(min(by_cores, by_memory))
+
+def init_worker(num_threads):
+    """
+    Loads one model replica per worker process with its own share of the cores.
+    """
+    import app_pdf2json
+
+    # OpenMP reads this when torch is first imported, which happens in load_model()
+    os.environ['OMP_NUM_THREADS'] = str(num_threads)
+    app_pdf2json.NUM_THREADS = num_threads
+    app_pdf2json.INTEROP_THREADS = 1
+    app_pdf2json.load_model()
+
+def create_pool(workers):
+    """
+    Starts a process pool whose workers each hold a model replica.
+
+    Processes are spawned rather than forked, as forking after torch has
+    started its thread pools can deadlock.
+    """
+    cores = psutil.cpu_count(logical=False) or os.cpu_count() or 1
+    num_threads = max(1, cores // workers)
+    logger.info(f"Starting {workers} extraction worker(s) with {num_threads} thread(s) each.")
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=init_worker,
+        initargs=(num_threads,),
+    )
+
+def pdf2json_parallel(file_paths, workers=None):
+    """
+    Extracts invoice data with several model replicas working in parallel.
+
+    Batches go out to the workers from the pool's shared queue and their
+    outputs come back in order, so caching, parsing and storing stay in this
+    process and happen exactly as with pdf2json_batch().
+
+    :param file_paths: Image or PDF paths.
+    :param workers: Number of worker processes, default_workers() if None.
+    :return: The paths whose content is now marked as extracted.
+    """
+    import app_pdf2json
+
+    workers = workers or default_workers()
+    # Smaller batches when there are few files, so every worker gets some
+    batch_size = max(1, min(app_pdf2json.BATCH_SIZE, math.ceil(len(file_paths) / workers)))
+    with create_pool(workers) as executor:
+        return app_pdf2json.pdf2json_batch(file_paths, batch_size=batch_size, map_batches=executor.map)
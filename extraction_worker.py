@@ -0,0 +1,124 @@
+import os
+import queue
+import secrets
+import logging
+import threading
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener, Client
+from dotenv import load_dotenv
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+WORKER_ADDRESS = ('127.0.0.1', int(os.getenv('EXTRACTION_WORKER_PORT', '6001')))
+WORKER_AUTHKEY_FILE = os.getenv('EXTRACTION_WORKER_AUTHKEY_FILE', 'extraction_worker.key')
+
+def load_authkey(create=False):
+    """
+    Returns the key shared by the worker and its clients.
+
+    EXTRACTION_WORKER_AUTHKEY takes precedence; otherwise the key is read from
+    WORKER_AUTHKEY_FILE, which serve() fills with a random key on first start.
+    The listener unpickles what authenticated clients send, so there is no
+    default key.
+
+    :param create: Generate the key file (mode 0600) if it does not exist yet.
+    :return: The key, or None when there is none.
+    """
+    authkey = os.getenv('EXTRACTION_WORKER_AUTHKEY')
+    if authkey:
+        return authkey.encode()
+    if create:
+        try:
+            fd = os.open(WORKER_AUTHKEY_FILE, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:
+            pass
+        else:
+            with os.fdopen(fd, 'w') as f:
+                f.write(secrets.token_hex(32))
+    if not os.path.exists(WORKER_AUTHKEY_FILE):
+        return None
+    with open(WORKER_AUTHKEY_FILE, 'r') as f:
+        return f.read().strip().encode() or None
+
+def submit(file_paths):
+    """
+    Queues files on a running extraction worker.
+
+    :param file_paths: Paths of the attachments to extract.
+    :return: False when no worker is running, so the caller can extract itself.
+    """
+    authkey = load_authkey()
+    if authkey is None:
+        # No worker was ever started here
+        return False
+    try:
+        with Client(WORKER_ADDRESS, authkey=authkey) as conn:
+            conn.send({'files': [os.path.abspath(p) for p in file_paths]})
+            return conn.recv() == 'queued'
+    except (ConnectionRefusedError, EOFError, OSError, AuthenticationError):
+        return False
+
+def extract_jobs(jobs, queued, lock):
+    """
+    Drains the job queue, extracting up to BATCH_SIZE queued files per generate() call.
+    """
+    import app_pdf2json
+
+    while True:
+        file_paths = [jobs.get()]
+        while len(file_paths) < app_pdf2json.BATCH_SIZE:
+            try:
+                file_paths.append(jobs.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            app_pdf2json.pdf2json_batch([p for p in file_paths if os.path.exists(p)])
+        except Exception as e:
+            logger.error(f"Extraction of {file_paths} failed: {e}")
+        finally:
+            with lock:
+                queued.difference_update(file_paths)
+
+def serve():
+    """
+    Keeps the model loaded and extracts files sent by submit().
+
+    The model is loaded once at startup so every job skips the reload.
+    """
+    import app_pdf2json
+
+    authkey = load_authkey(create=True)
+    if authkey is None:
+        raise Exception(f"No key for the extraction worker, set EXTRACTION_WORKER_AUTHKEY or make {WORKER_AUTHKEY_FILE} readable.")
+    app_pdf2json.load_model()
+    jobs = queue.Queue()
+    queued = set()
+    lock = threading.Lock()
+    threading.Thread(target=extract_jobs, args=(jobs, queued, lock), daemon=True).start()
+
+    with Listener(WORKER_ADDRESS, authkey=authkey) as listener:
+        logger.info(f"Extraction worker listening on {WORKER_ADDRESS[0]}:{WORKER_ADDRESS[1]}.")
+        while True:
+            try:
+                with listener.accept() as conn:
+                    message = conn.recv()
+                    with lock:
+                        # Files already waiting or in progress are not queued twice
+                        new_files = [p for p in message.get('files', []) if p not in queued]
+                        queued.update(new_files)
+                    for file_path in new_files:
+                        jobs.put(file_path)
+                    conn.send('queued')
+                    logger.info(f"Queued {len(new_files)} file(s) for extraction.")
+            except Exception as e:
+                logger.error(f"Failed to accept job: {e}")
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        filename='extraction_worker.log',
+        level=logging.INFO,
+        format='%(asctime)s %(levelname)s:%(message)s'
+    )
+    serve()
@@ -0,0 +1,145 @@
+import time
+import base64
+import logging
+import graph_client
+import attachment_rules
+from graph_client import GRAPH_URL, MAX_RETRIES, RETRY_STATUS_CODES, retry_delay
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+BATCH_URL = f'{GRAPH_URL}/$batch'
+MAX_BATCH_SIZE = 20  # Graph limit of requests per $batch call
+MAX_BATCH_UPLOAD_SIZE = 128 * 1024  # larger files are uploaded on their own; 20 base64 bodies must stay under the 4MB batch cap
+
+def batch_request(request_id, method, url, body=None, headers=None, depends_on=None):
+    """
+    Builds one entry of a $batch call.
+
+    :param request_id: Id that is unique within the call and identifies the response.
+    :param method: HTTP method.
+    :param url: URL relative to GRAPH_URL, e.g. '/me/messages'.
+    :param body: JSON body, or bytes which are sent base64 encoded.
+    :param headers: Request headers; bytes bodies default to application/octet-stream.
+    :param depends_on: Ids of requests that must succeed before this one runs.
+    """
+    entry = {'id': str(request_id), 'method': method, 'url': url}
+    headers = dict(headers or {})
+    if isinstance(body, bytes):
+        headers.setdefault('Content-Type', 'application/octet-stream')
+        entry['body'] = base64.b64encode(body).decode('ascii')
+    elif body is not None:
+        headers.setdefault('Content-Type', 'application/json')
+        entry['body'] = body
+    if headers:
+        entry['headers'] = headers
+    if depends_on:
+        entry['dependsOn'] = [str(i) for i in depends_on]
+    return entry
+
+def pack_batches(entries):
+    """
+    Splits entries into $batch calls of at most MAX_BATCH_SIZE requests.
+
+    Requests linked through dependsOn are kept in the same call, since Graph
+    only resolves dependencies within one batch.
+    """
+    ids = {entry['id'] for entry in entries}
+    groups = []
+    group_of = {}
+    for entry in entries:
+        # Dependencies that already succeeded in an earlier call are dropped
+        if 'dependsOn' in entry:
+            entry = dict(entry, dependsOn=[i for i in entry['dependsOn'] if i in ids])
+            if not entry['dependsOn']:
+                del entry['dependsOn']
+        group = None
+        for dependency in entry.get('dependsOn', []):
+            if dependency in group_of:
+                group = group_of[dependency]
+        if group is None:
+            group = []
+            groups.append(group)
+        group.append(entry)
+        group_of[entry['id']] = group
+
+    batches = []
+    for group in groups:
+        if len(group) > MAX_BATCH_SIZE:
+            raise ValueError(f"Dependency chain of {len(group)} requests does not fit in one batch.")
+        for batch in batches:
+            if len(batch) + len(group) <= MAX_BATCH_SIZE:
+                batch.extend(group)
+                break
+        else:
+            batches.append(list(group))
+    return batches
+
+def send_batch(access_token, entries):
+    """
+    Runs any number of batch entries and returns their responses by id.
+
+    Entries are sent in $batch calls of up to 20. Items that come back
+    throttled or with a transient error are retried in a later call together
+    with the requests that depended on them (424); other failures are returned
+    as they are, so callers check every item's status.
+
+    :param access_token: OAuth2 access token.
+    :param entries: Entries built with batch_request(). Only idempotent requests should be batched.
+    :return: Dict of request id to {'status', 'headers', 'body'}.
+    """
+    results = {}
+    pending = list(entries)
+    for attempt in range(MAX_RETRIES + 1):
+        retry_after = 0.0
+        for batch in pack_batches(pending):
+            response = graph_client.post(BATCH_URL, access_token=access_token, json={'requests': batch}, retry=True)
+            if response.status_code != 200:
+                logger.error(f"Batch request failed: {response.status_code} - {response.text}")
+                for entry in batch:
+                    results[entry['id']] = {'status': response.status_code, 'headers': dict(response.headers), 'body': None}
+                continue
+            for item in response.json().get('responses', []):
+                results[item['id']] = item
+                if item['status'] in RETRY_STATUS_CODES:
+                    retry_after = max(retry_after, retry_delay(item.get('headers') or {}, attempt))
+
+        retry_ids = {entry['id'] for entry in pending if results[entry['id']]['status'] in RETRY_STATUS_CODES}
+        if not retry_ids or attempt == MAX_RETRIES:
+            break
+        # Failed dependencies are re-run together with the request they depend on
+        pending = [
+            entry for entry in pending
+            if entry['id'] in retry_ids
+            or (results[entry['id']]['status'] == 424 and retry_ids.intersection(entry.get('dependsOn', [])))
+        ]
+        logger.warning(f"Retrying {len(pending)} batch item(s) in {retry_after:.1f}s.")
+        time.sleep(retry_after)
+    return results
+
+def fetch_attachment_metadata(access_token, message_ids):
+    """
+    Lists the attachments of many messages without their content.
+
+    :param access_token: OAuth2 access token.
+    :param message_ids: Ids of the messages.
+    :return: Dict of message id to its list of attachments (id, name, contentType, size, isInline).
+        Messages whose attachments could not be listed are left out, deleted ones have none.
+    """
+    message_ids = list(message_ids)
+    entries = [
+        batch_request(i, 'GET', f"/me/messages/{message_id}/attachments?$select={attachment_rules.ATTACHMENT_SELECT}")
+        for i, message_id in enumerate(message_ids)
+    ]
+    results = send_batch(access_token, entries)
+
+    attachments = {}
+    for i, message_id in enumerate(message_ids):
+        result = results[str(i)]
+        if result['status'] == 200:
+            attachments[message_id] = result['body'].get('value', [])
+        elif result['status'] == 404:
+            attachments[message_id] = []
+        else:
+            logger.error(f"Failed to fetch attachments of message {message_id}: {result['status']} - {result.get('body')}")
+    return attachments
@@ -0,0 +1,270 @@
+import os
+import time
+import random
+import logging
+import threading
+from email.utils import parsedate_to_datetime
+from collections import defaultdict, deque
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+GRAPH_URL = os.getenv('GRAPH_URL', 'https://graph.microsoft.com/v1.0')
+GRAPH_TIMEOUT = float(os.getenv('GRAPH_TIMEOUT', '60'))  # seconds per request
+POOL_CONNECTIONS = 10  # number of hosts kept in the pool (graph + upload hosts)
+POOL_MAXSIZE = int(os.getenv('GRAPH_POOL_MAXSIZE', '16'))  # keep-alive connections per host
+LATENCY_SAMPLES = 1000  # latencies kept per endpoint class for percentiles
+MAX_RETRIES = int(os.getenv('GRAPH_MAX_RETRIES', '5'))
+BACKOFF_BASE = 1.0  # seconds, doubled on every retry
+BACKOFF_MAX = 60.0
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS'}
+
+# Token bucket limits per endpoint group as (requests per second, burst).
+# Outlook throttles per mailbox at roughly 10000 requests per 10 minutes,
+# OneDrive per user; upload session chunks go to a separate host and are not limited.
+RATE_LIMITS = {
+    'mail': (float(os.getenv('GRAPH_MAIL_RATE', '15')), 15),
+    'drive': (float(os.getenv('GRAPH_DRIVE_RATE', '10')), 10),
+    'batch': (float(os.getenv('GRAPH_BATCH_RATE', '1')), 2),
+    'other': (10.0, 10),
+}
+ENDPOINT_GROUPS = {
+    'messages': 'mail',
+    'attachments': 'mail',
+    'attachment_download': 'mail',
+    'delta': 'mail',
+    'drive_upload': 'drive',
+    'upload_session': 'drive',
+    'drive': 'drive',
+    'batch': 'batch',
+    'upload_chunk': None,
+}
+
+_session = None
+_session_lock = threading.Lock()
+_token_provider = None
+_stats_lock = threading.Lock()
+_latency_stats = defaultdict(lambda: {'count': 0, 'errors': 0, 'total': 0.0, 'samples': deque(maxlen=LATENCY_SAMPLES)})
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+class TokenBucket:
+    """
+    Thread-safe token bucket that can also be paused, e.g. for a Retry-After.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                delay = self.paused_until - now
+                if delay <= 0:
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+
+    def pause(self, seconds):
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+def get_session():
+    """
+    Returns the process-wide requests session.
+
+    The session keeps keep-alive connections to graph.microsoft.com and to the
+    upload session hosts, so repeated calls skip the TCP+TLS handshake.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _session = session
+    return _session
+
+def set_token_provider(provider):
+    """
+    Registers the callable used to obtain a bearer token for Graph requests.
+
+    The provider is asked on every attempt and takes precedence over an
+    access_token passed in, so a long sync never sends an expired token.
+    """
+    global _token_provider
+    _token_provider = provider
+
+def endpoint_class(url):
+    """
+    Maps a request URL to a coarse endpoint class used for stats.
+    """
+    if not url.startswith(GRAPH_URL):
+        return 'upload_chunk'
+    path = url[len(GRAPH_URL):].split('?', 1)[0]
+    if path.endswith('/$value'):
+        return 'attachment_download'
+    if path.endswith(':/content'):
+        return 'drive_upload'
+    if path.endswith(':/createUploadSession'):
+        return 'upload_session'
+    if path == '/$batch':
+        return 'batch'
+    if path.endswith('/delta'):
+        return 'delta'
+    if '/attachments' in path:
+        return 'attachments'
+    if '/messages' in path:
+        return 'messages'
+    if '/drive' in path:
+        return 'drive'
+    return 'other'
+
+def get_bucket(endpoint):
+    group = ENDPOINT_GROUPS.get(endpoint, 'other')
+    if group is None:
+        return None
+    with _buckets_lock:
+        if group not in _buckets:
+            _buckets[group] = TokenBucket(*RATE_LIMITS[group])
+        return _buckets[group]
+
+def retry_delay(headers, attempt):
+    """
+    Returns the seconds to wait before the next attempt, preferring Retry-After.
+
+    :param headers: Response headers, or None when no response was received.
+    :param attempt: Number of the failed attempt, starting at 0.
+    """
+    retry_after = headers.get('Retry-After') if headers is not None else None
+    if retry_after:
+        try:
+            return max(float(retry_after), 0.0)
+        except ValueError:
+            try:
+                return max(parsedate_to_datetime(retry_after).timestamp() - time.time(), 0.0)
+            except (TypeError, ValueError):
+                pass
+    return min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+def record_latency(endpoint, elapsed, failed=False):
+    with _stats_lock:
+        stats = _latency_stats[endpoint]
+        stats['count'] += 1
+        stats['total'] += elapsed
+        stats['samples'].append(elapsed)
+        if failed:
+            stats['errors'] += 1
+
+def get_latency_stats():
+    """
+    Returns per-endpoint request counts and latencies in seconds.
+    """
+    summary = {}
+    with _stats_lock:
+        for endpoint, stats in _latency_stats.items():
+            samples = sorted(stats['samples'])
+            summary[endpoint] = {
+                'count': stats['count'],
+                'errors': stats['errors'],
+                'mean': stats['total'] / stats['count'],
+                'p50': samples[int(0.50 * (len(samples) - 1))],
+                'p99': samples[int(0.99 * (len(samples) - 1))],
+                'max': samples[-1],
+            }
+    return summary
+
+def reset_latency_stats():
+    with _stats_lock:
+        _latency_stats.clear()
+
+def log_latency_stats():
+    for endpoint, stats in sorted(get_latency_stats().items()):
+        logger.info(
+            f"Graph {endpoint}: {stats['count']} request(s), {stats['errors']} error(s), "
+            f"mean {stats['mean']:.3f}s, p50 {stats['p50']:.3f}s, p99 {stats['p99']:.3f}s"
+        )
+
+def request(method, url, access_token=None, headers=None, retry=None, **kwargs):
+    """
+    Sends a request through the shared session.
+
+    Requests are rate limited per endpoint group. Throttled (429) responses are
+    always retried since Graph did not process them; transient 5xx responses and
+    connection errors only when the request is idempotent. Backoff is exponential
+    unless Graph sends a Retry-After, which also pauses the whole group so
+    concurrent workers back off together.
+
+    :param method: HTTP method.
+    :param url: Absolute URL, either a Graph URL or a pre-authenticated upload URL.
+    :param access_token: OAuth2 access token, only used when no token provider is registered.
+    :param headers: Extra request headers.
+    :param retry: Force retries on or off; defaults to retrying idempotent methods only.
+    """
+    headers = dict(headers or {})
+    # Upload session URLs are pre-authenticated and must not get the bearer token
+    authorize = url.startswith(GRAPH_URL) and 'Authorization' not in headers
+    kwargs.setdefault('timeout', GRAPH_TIMEOUT)
+    if retry is None:
+        retry = method.upper() in IDEMPOTENT_METHODS
+    max_attempts = MAX_RETRIES + 1
+
+    endpoint = endpoint_class(url)
+    bucket = get_bucket(endpoint)
+    for attempt in range(max_attempts):
+        if bucket is not None:
+            bucket.acquire()
+        if authorize:
+            token = _token_provider() if _token_provider is not None else access_token
+            if token is not None:
+                headers['Authorization'] = f'Bearer {token}'
+        start = time.perf_counter()
+        try:
+            response = get_session().request(method, url, headers=headers, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            record_latency(endpoint, time.perf_counter() - start, failed=True)
+            if not retry or attempt == max_attempts - 1:
+                raise
+            delay = retry_delay(None, attempt)
+            logger.warning(f"{method} {endpoint} failed ({e}), retrying in {delay:.1f}s.")
+            time.sleep(delay)
+            continue
+        record_latency(endpoint, time.perf_counter() - start, failed=response.status_code >= 400)
+
+        retryable = response.status_code == 429 or (retry and response.status_code in RETRY_STATUS_CODES)
+        if not retryable or attempt == max_attempts - 1:
+            return response
+        delay = retry_delay(response.headers, attempt)
+        response.close()
+        if bucket is not None and 'Retry-After' in response.headers:
+            bucket.pause(delay)
+        logger.warning(f"{method} {endpoint} returned {response.status_code}, retrying in {delay:.1f}s.")
+        time.sleep(delay)
+    return response
+
+def get(url, access_token=None, **kwargs):
+    return request('GET', url, access_token=access_token, **kwargs)
+
+def put(url, access_token=None, **kwargs):
+    return request('PUT', url, access_token=access_token, **kwargs)
+
+def post(url, access_token=None, **kwargs):
+    return request('POST', url, access_token=access_token, **kwargs)
+
+def patch(url, access_token=None, **kwargs):
+    return request('PATCH', url, access_token=access_token, **kwargs)
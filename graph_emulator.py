@@ -0,0 +1,433 @@
+"""
+Offline stand-in for the parts of Microsoft Graph this project uses.
+
+Serves inbox messages (listing and delta), attachment metadata and content,
+$batch, drive items, small drive uploads, upload sessions and change
+notification subscriptions from memory, with optional latency and injected
+429/503 responses. Point GRAPH_URL at emulator.graph_url
+before importing the app modules.
+
+    with GraphEmulator(messages=100) as emulator:
+        os.environ['GRAPH_URL'] = emulator.graph_url
+"""
+import json
+import time
+import uuid
+import base64
+import random
+import hashlib
+import threading
+import urllib.error
+import urllib.request
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, quote, unquote
+
+API_PREFIX = '/v1.0'
+DEFAULT_PAGE_SIZE = 10
+
+class GraphEmulator:
+    """
+    In-memory mailbox and drive behind a local HTTP server.
+
+    :param messages: Number of inbox messages, all with attachments.
+    :param attachments_per_message: Invoice attachments per message.
+    :param attachment_size: Size of each invoice attachment in bytes.
+    :param large_every: Every n-th attachment is large_size bytes instead (0 = never).
+    :param large_size: Size of large attachments, above the single PUT limit by default.
+    :param inline_logos: Add a small inline image to every message, as signatures do.
+    :param latency: Seconds added to every response.
+    :param fault_rate: Share of requests answered with 429 or 503 instead.
+    :param retry_after: Retry-After seconds sent with injected 429s.
+    :param seed: Seed for contents and fault injection, for reproducible runs.
+    """
+
+    def __init__(self, messages=100, attachments_per_message=1, attachment_size=200 * 1024, large_every=0,
+                 large_size=6 * 1024 * 1024, inline_logos=True, latency=0.0, fault_rate=0.0, retry_after=0,
+                 seed=0, host='127.0.0.1', port=0):
+        self.latency = latency
+        self.fault_rate = fault_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = Counter()
+        self.uploaded_files = {}
+        self.uploaded_bytes = 0
+        self.upload_sessions = {}
+        self.messages = []
+        self.attachments = {}
+        self.contents = {}
+        self.subscriptions = {}
+
+        self.attachments_per_message = attachments_per_message
+        self.attachment_size = attachment_size
+        self.large_every = large_every
+        self.large_size = large_size
+        self.inline_logos = inline_logos
+        self.content_random = random.Random(seed)
+        self.attachment_index = 0
+        for _ in range(messages):
+            self.add_message()
+
+        self.server = ThreadingHTTPServer((host, port), self.handler_class())
+        self.url = f'http://{host}:{self.server.server_address[1]}'
+        self.graph_url = self.url + API_PREFIX
+
+    def add_message(self):
+        """
+        Adds an inbox message with invoice attachments, e.g. to deliver new mail between syncs.
+
+        :return: The message id.
+        """
+        i = len(self.messages)
+        message_id = f'msg{i:06d}'
+        self.messages.append({
+            'id': message_id,
+            'subject': f'Invoice {i}',
+            'from': {'emailAddress': {'address': f'billing{i % 7}@example.com'}},
+            'hasAttachments': True,
+            'receivedDateTime': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(1700000000 + i * 60)),
+        })
+        attachments = []
+        for j in range(self.attachments_per_message):
+            self.attachment_index += 1
+            large = self.large_every and self.attachment_index % self.large_every == 0
+            size = self.large_size if large else self.attachment_size
+            attachments.append(self.add_attachment(message_id, f'invoice_{i}_{j}.pdf', 'application/pdf', size, False))
+        if self.inline_logos:
+            attachments.append(self.add_attachment(message_id, 'logo.png', 'image/png', 4 * 1024, True))
+        self.attachments[message_id] = attachments
+        return message_id
+
+    def add_attachment(self, message_id, name, content_type, size, is_inline):
+        attachment_id = f'{message_id}-att{len(self.contents)}'
+        self.contents[attachment_id] = self.content_random.randbytes(size)
+        return {
+            '@odata.type': '#microsoft.graph.fileAttachment',
+            'id': attachment_id,
+            'name': name,
+            'contentType': content_type,
+            'size': size,
+            'isInline': is_inline,
+        }
+
+    @property
+    def expected_uploads(self):
+        return sum(1 for attachments in self.attachments.values() for a in attachments if not a['isInline'])
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name='graph-emulator', daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def count(self, route, status):
+        with self.lock:
+            self.requests[(route, status)] += 1
+
+    def inject_fault(self, route):
+        """
+        Returns an injected throttling or server error response, or None.
+        """
+        if not self.fault_rate:
+            return None
+        with self.lock:
+            roll = self.random.random()
+        if roll >= self.fault_rate:
+            return None
+        if roll < self.fault_rate / 2:
+            body = {'error': {'code': 'TooManyRequests', 'message': 'Injected throttling'}}
+            return 429, {'Retry-After': str(self.retry_after)}, body
+        return 503, {}, {'error': {'code': 'ServiceUnavailable', 'message': 'Injected failure'}}
+
+    def dispatch(self, method, target, headers, body):
+        """
+        Handles one Graph request, also used for the items of a $batch.
+
+        :param target: Path and query relative to the API root, e.g. '/me/messages?$top=1'.
+        :return: (route, status, headers, body) where body is a dict, bytes or None.
+        """
+        parsed = urlparse(target)
+        path = unquote(parsed.path)
+        query = parse_qs(parsed.query)
+        route, handler = self.route(method, path)
+        fault = self.inject_fault(route) if handler is not None else None
+        if fault is not None:
+            status, response_headers, response_body = fault
+        elif handler is None:
+            status, response_headers, response_body = 404, {}, {'error': {'code': 'itemNotFound', 'message': path}}
+        else:
+            status, response_headers, response_body = handler(path, query, headers, body)
+        self.count(route, status)
+        return route, status, response_headers, response_body
+
+    def route(self, method, path):
+        parts = path.strip('/').split('/')
+        if method == 'GET' and path == '/me/mailFolders/inbox/messages/delta':
+            return 'delta', self.get_delta
+        if method == 'GET' and path == '/me/messages':
+            return 'messages', self.get_messages
+        if method == 'GET' and len(parts) == 4 and parts[:2] == ['me', 'messages'] and parts[3] == 'attachments':
+            return 'attachments', self.get_attachments
+        if method == 'GET' and len(parts) == 6 and parts[3] == 'attachments' and parts[5] == '$value':
+            return 'attachment_download', self.get_attachment_content
+        if method == 'POST' and path == '/subscriptions':
+            return 'subscriptions', self.post_subscription
+        if method == 'PATCH' and len(parts) == 2 and parts[0] == 'subscriptions':
+            return 'subscriptions', self.patch_subscription
+        if method == 'POST' and path == '/$batch':
+            return 'batch', self.post_batch
+        if method == 'GET' and path.startswith('/me/drive/root:') and ':/' not in path[len('/me/drive/root:'):]:
+            return 'drive_item', self.get_drive_item
+        if method == 'PUT' and path.startswith('/me/drive/root:') and path.endswith(':/content'):
+            return 'drive_upload', self.put_content
+        if method == 'POST' and path.startswith('/me/drive/root:') and path.endswith(':/createUploadSession'):
+            return 'upload_session', self.create_upload_session
+        return 'unknown', None
+
+    def page(self, items, query, headers):
+        """
+        Returns one page of items and the offset of the next one, honouring odata.maxpagesize.
+        """
+        prefer = headers.get('Prefer', '')
+        page_size = int(prefer.split('=')[1]) if prefer.startswith('odata.maxpagesize=') else DEFAULT_PAGE_SIZE
+        skip = int(query.get('$skiptoken', ['0'])[0])
+        return {'value': items[skip:skip + page_size]}, skip + page_size
+
+    def get_delta(self, path, query, headers, body):
+        if '$deltatoken' in query:
+            # Everything up to the token was delivered; this mailbox does not change
+            known = int(query['$deltatoken'][0])
+            items = self.messages[known:]
+            return 200, {}, {'value': items, '@odata.deltaLink': f"{self.graph_url}{path}?$deltatoken={len(self.messages)}"}
+        messages = self.messages
+        received_filter = query.get('$filter', [''])[0]
+        if received_filter:
+            # receivedDateTime ge <timestamp>, the one filter message delta supports
+            since = received_filter.split(' ge ')[-1]
+            messages = [m for m in messages if m['receivedDateTime'] >= since]
+        response, next_skip = self.page(messages, query, headers)
+        if next_skip < len(messages):
+            next_query = f"$skiptoken={next_skip}" + (f"&$filter={quote(received_filter)}" if received_filter else '')
+            response['@odata.nextLink'] = f"{self.graph_url}{path}?{next_query}"
+        else:
+            response['@odata.deltaLink'] = f"{self.graph_url}{path}?$deltatoken={len(self.messages)}"
+        return 200, {}, response
+
+    def get_messages(self, path, query, headers, body):
+        top = int(query.get('$top', [str(DEFAULT_PAGE_SIZE)])[0])
+        newest = sorted(self.messages, key=lambda m: m['receivedDateTime'], reverse=True)
+        return 200, {}, {'value': newest[:top]}
+
+    def get_attachments(self, path, query, headers, body):
+        message_id = path.strip('/').split('/')[2]
+        if message_id not in self.attachments:
+            return 404, {}, {'error': {'code': 'ErrorItemNotFound', 'message': message_id}}
+        return 200, {}, {'value': self.attachments[message_id]}
+
+    def get_attachment_content(self, path, query, headers, body):
+        attachment_id = path.strip('/').split('/')[4]
+        if attachment_id not in self.contents:
+            return 404, {}, {'error': {'code': 'ErrorItemNotFound', 'message': attachment_id}}
+        return 200, {'Content-Type': 'application/octet-stream'}, self.contents[attachment_id]
+
+    def drive_item(self, drive_path, content_hash, size):
+        with self.lock:
+            previous = self.uploaded_files.get(drive_path)
+            version = previous['version'] + 1 if previous else 1
+            item = {
+                'id': previous['id'] if previous else uuid.uuid4().hex,
+                'name': drive_path.rsplit('/', 1)[-1],
+                'size': size,
+                'eTag': f'"{{{content_hash[:8]}}},{version}"',
+                'file': {'hashes': {'sha256Hash': content_hash.upper()}},
+                'version': version,
+            }
+            self.uploaded_files[drive_path] = item
+            self.uploaded_bytes += size
+        return {k: v for k, v in item.items() if k != 'version'}
+
+    def get_drive_item(self, path, query, headers, body):
+        drive_path = path[len('/me/drive/root:'):]
+        item = self.uploaded_files.get(drive_path)
+        if item is None:
+            return 404, {}, {'error': {'code': 'itemNotFound', 'message': drive_path}}
+        return 200, {}, {k: v for k, v in item.items() if k != 'version'}
+
+    def put_content(self, path, query, headers, body):
+        drive_path = path[len('/me/drive/root:'):-len(':/content')]
+        current = self.uploaded_files.get(drive_path)
+        if_match = headers.get('If-Match')
+        if if_match and (current is None or current['eTag'] != if_match):
+            return 412, {}, {'error': {'code': 'resourceModified', 'message': drive_path}}
+        status = 200 if current else 201
+        return status, {}, self.drive_item(drive_path, hashlib.sha256(body).hexdigest(), len(body))
+
+    def create_upload_session(self, path, query, headers, body):
+        drive_path = path[len('/me/drive/root:'):-len(':/createUploadSession')]
+        session_id = uuid.uuid4().hex
+        with self.lock:
+            self.upload_sessions[session_id] = {'path': drive_path, 'next': 0, 'hash': hashlib.sha256()}
+        return 200, {}, {
+            'uploadUrl': f'{self.url}/upload/{session_id}',
+            'expirationDateTime': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(time.time() + 3600)),
+        }
+
+    def upload_chunk(self, method, session_id, headers, body):
+        """
+        Handles the pre-authenticated upload URL, which lives outside the API root.
+        """
+        session = self.upload_sessions.get(session_id)
+        if session is None:
+            return 404, {}, {'error': {'code': 'itemNotFound', 'message': session_id}}
+        if method == 'GET':
+            return 200, {}, {'nextExpectedRanges': [f"{session['next']}-"]}
+        fault = self.inject_fault('upload_chunk')
+        if fault is not None:
+            return fault
+        # Content-Range: bytes start-end/total
+        byte_range, total = headers.get('Content-Range', '').split(' ')[-1].split('/')
+        start, end = (int(x) for x in byte_range.split('-'))
+        if start != session['next'] or end - start + 1 != len(body):
+            return 416, {}, {'error': {'code': 'invalidRange', 'message': f"expected {session['next']}"}}
+        session['hash'].update(body)
+        session['next'] = end + 1
+        if session['next'] < int(total):
+            return 202, {}, {'nextExpectedRanges': [f"{session['next']}-"]}
+        with self.lock:
+            del self.upload_sessions[session_id]
+        return 201, {}, self.drive_item(session['path'], session['hash'].hexdigest(), int(total))
+
+    def validate_endpoint(self, url):
+        """
+        Sends a validation request like Graph does; the endpoint must echo the token as text.
+        """
+        token = uuid.uuid4().hex
+        request = urllib.request.Request(f"{url}?validationToken={quote(token)}", data=b'', method='POST')
+        try:
+            with urllib.request.urlopen(request, timeout=10) as response:
+                return response.status == 200 and response.read().decode('utf-8') == token
+        except OSError:
+            return False
+
+    def post_subscription(self, path, query, headers, body):
+        request = json.loads(body)
+        urls = {request['notificationUrl'], request.get('lifecycleNotificationUrl') or request['notificationUrl']}
+        for url in urls:
+            if not self.validate_endpoint(url):
+                return 400, {}, {'error': {'code': 'InvalidRequest', 'message': f'Subscription validation request failed for {url}.'}}
+        subscription = dict(request, id=uuid.uuid4().hex)
+        with self.lock:
+            self.subscriptions[subscription['id']] = subscription
+        return 201, {}, subscription
+
+    def patch_subscription(self, path, query, headers, body):
+        subscription = self.subscriptions.get(path.strip('/').split('/')[1])
+        if subscription is None:
+            return 404, {}, {'error': {'code': 'ResourceNotFound', 'message': path}}
+        subscription['expirationDateTime'] = json.loads(body)['expirationDateTime']
+        return 200, {}, subscription
+
+    def notify(self, subscription_id, message_id=None, lifecycle_event=None, client_state=None):
+        """
+        Posts a notification for a subscription to its endpoint, as Graph does.
+
+        :param message_id: Message the 'created' change notification is about.
+        :param lifecycle_event: Send this lifecycle event (e.g. 'reauthorizationRequired') instead.
+        :param client_state: Send this instead of the subscription's clientState.
+        :return: HTTP status of the endpoint's response.
+        """
+        subscription = self.subscriptions[subscription_id]
+        notification = {
+            'subscriptionId': subscription_id,
+            'clientState': subscription.get('clientState') if client_state is None else client_state,
+            'subscriptionExpirationDateTime': subscription['expirationDateTime'],
+        }
+        if lifecycle_event:
+            notification['lifecycleEvent'] = lifecycle_event
+            url = subscription.get('lifecycleNotificationUrl') or subscription['notificationUrl']
+        else:
+            notification.update(
+                changeType='created', resource=f"Users/me/Messages/{message_id}",
+                resourceData={'@odata.type': '#Microsoft.Graph.Message', 'id': message_id},
+            )
+            url = subscription['notificationUrl']
+        request = urllib.request.Request(
+            url, data=json.dumps({'value': [notification]}).encode('utf-8'),
+            headers={'Content-Type': 'application/json'}, method='POST'
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=10) as response:
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+    def post_batch(self, path, query, headers, body):
+        responses = []
+        for item in json.loads(body).get('requests', []):
+            item_headers = item.get('headers', {})
+            item_body = item.get('body')
+            if isinstance(item_body, str):
+                item_body = base64.b64decode(item_body)
+            elif item_body is not None:
+                item_body = json.dumps(item_body).encode('utf-8')
+            _, status, response_headers, response_body = self.dispatch(item['method'], item['url'], item_headers, item_body or b'')
+            if isinstance(response_body, bytes):
+                response_body = base64.b64encode(response_body).decode('ascii')
+            responses.append({'id': item['id'], 'status': status, 'headers': response_headers, 'body': response_body})
+        return 200, {}, {'responses': responses}
+
+    def handler_class(self):
+        emulator = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep-alive, like Graph, so the client's connection pool is exercised
+            protocol_version = 'HTTP/1.1'
+            # Headers and body are written separately; without this, delayed ACKs add ~40ms per response
+            disable_nagle_algorithm = True
+
+            def handle_request(self):
+                length = int(self.headers.get('Content-Length', 0))
+                body = self.rfile.read(length) if length else b''
+                if emulator.latency:
+                    time.sleep(emulator.latency)
+                if self.path.startswith('/upload/'):
+                    session_id = self.path[len('/upload/'):]
+                    status, headers, response_body = emulator.upload_chunk(self.command, session_id, self.headers, body)
+                    emulator.count('upload_chunk', status)
+                elif self.path.startswith(API_PREFIX):
+                    _, status, headers, response_body = emulator.dispatch(self.command, self.path[len(API_PREFIX):], self.headers, body)
+                else:
+                    status, headers, response_body = 404, {}, None
+                self.respond(status, headers, response_body)
+
+            do_GET = do_PUT = do_POST = do_PATCH = do_DELETE = handle_request
+
+            def respond(self, status, headers, body):
+                if isinstance(body, bytes):
+                    payload = body
+                    content_type = headers.get('Content-Type', 'application/octet-stream')
+                else:
+                    payload = json.dumps(body).encode('utf-8') if body is not None else b''
+                    content_type = 'application/json'
+                self.send_response(status)
+                for name, value in headers.items():
+                    if name != 'Content-Type':
+                        self.send_header(name, value)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
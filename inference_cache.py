@@ -0,0 +1,75 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+from contextlib import closing
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+INFERENCE_CACHE_DB = os.getenv('INFERENCE_CACHE_DB', 'Data/cache/inference_cache.sqlite')
+INFERENCE_CACHE_MAX_BYTES = int(os.getenv('INFERENCE_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+
+def connect():
+    os.makedirs(os.path.dirname(INFERENCE_CACHE_DB) or '.', exist_ok=True)
+    conn = sqlite3.connect(INFERENCE_CACHE_DB, timeout=30)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS inference_cache (
+            key TEXT PRIMARY KEY,
+            output_text TEXT NOT NULL,
+            parsed_json TEXT,
+            size INTEGER NOT NULL,
+            last_access REAL NOT NULL
+        )
+    """)
+    conn.execute('CREATE INDEX IF NOT EXISTS inference_cache_last_access ON inference_cache (last_access)')
+    return conn
+
+def cache_key(image_sha256, prompt, model_id, model_revision, max_new_tokens, image_settings=''):
+    """
+    Identifies one generation: same image, prompt, model and token budget give the same output.
+
+    :param image_settings: How the image is prepared for the model (resize, render DPI),
+        since the same file gives a different model input under other settings.
+    """
+    payload = json.dumps([image_sha256, prompt, model_id, model_revision, max_new_tokens, image_settings])
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def get(key):
+    """
+    Returns (output_text, parsed_json) of a cached generation, or None on a miss.
+    """
+    with closing(connect()) as conn, conn:
+        row = conn.execute('SELECT output_text, parsed_json FROM inference_cache WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        conn.execute('UPDATE inference_cache SET last_access = ? WHERE key = ?', (time.time(), key))
+    output_text, parsed_json = row
+    return output_text, json.loads(parsed_json) if parsed_json is not None else None
+
+def put(key, output_text, parsed_json):
+    """
+    Stores a generation and evicts the least recently used entries above INFERENCE_CACHE_MAX_BYTES.
+
+    :param parsed_json: Parsed record, or None when the output could not be parsed.
+    """
+    parsed = json.dumps(parsed_json) if parsed_json is not None else None
+    size = len(output_text.encode('utf-8')) + len(parsed.encode('utf-8') if parsed else b'')
+    with closing(connect()) as conn, conn:
+        conn.execute(
+            'INSERT OR REPLACE INTO inference_cache (key, output_text, parsed_json, size, last_access) VALUES (?, ?, ?, ?, ?)',
+            (key, output_text, parsed, size, time.time())
+        )
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM inference_cache').fetchone()[0]
+        if total > INFERENCE_CACHE_MAX_BYTES:
+            evicted = 0
+            for old_key, old_size in conn.execute('SELECT key, size FROM inference_cache ORDER BY last_access').fetchall():
+                if total <= INFERENCE_CACHE_MAX_BYTES:
+                    break
+                conn.execute('DELETE FROM inference_cache WHERE key = ?', (old_key,))
+                total -= old_size
+                evicted += 1
+            logger.info(f"Evicted {evicted} inference cache entr{'y' if evicted == 1 else 'ies'}.")
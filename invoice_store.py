@@ -0,0 +1,124 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+from contextlib import closing
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+INVOICE_STORE_DB = os.getenv('INVOICE_STORE_DB', 'Data/invoice_store.sqlite')
+INVOICE_DATA_DIR = 'Data/InvoiceData'
+SCHEMA_VERSION = 1
+
+def connect():
+    """
+    Opens the store, creating it on first use.
+
+    A new store first imports the per-client JSON files written by earlier
+    versions, so exporting never drops existing history.
+    """
+    os.makedirs(os.path.dirname(INVOICE_STORE_DB) or '.', exist_ok=True)
+    conn = sqlite3.connect(INVOICE_STORE_DB, timeout=30)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS invoices (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            client TEXT NOT NULL,
+            date TEXT,
+            sha256 TEXT,
+            record TEXT NOT NULL,
+            created_at REAL NOT NULL
+        )
+    """)
+    conn.execute('CREATE INDEX IF NOT EXISTS invoices_client_date ON invoices (client, date)')
+    conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS invoices_sha256 ON invoices (sha256) WHERE sha256 IS NOT NULL')
+    if conn.execute('PRAGMA user_version').fetchone()[0] < SCHEMA_VERSION:
+        # IMMEDIATE takes the write lock, so only one process runs the import
+        conn.execute('BEGIN IMMEDIATE')
+        if conn.execute('PRAGMA user_version').fetchone()[0] < SCHEMA_VERSION:
+            import_json(conn, INVOICE_DATA_DIR)
+            conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+        conn.commit()
+    return conn
+
+def import_json(conn, directory):
+    """
+    Loads legacy Data/InvoiceData/<client>.json files into the store.
+    """
+    if not os.path.isdir(directory):
+        return
+    imported = 0
+    for file in sorted(os.listdir(directory)):
+        if not file.endswith('.json'):
+            continue
+        with open(os.path.join(directory, file), 'r') as f:
+            data = json.load(f)
+        for record in data if isinstance(data, list) else [data]:
+            conn.execute(
+                'INSERT INTO invoices (client, date, sha256, record, created_at) VALUES (?, ?, NULL, ?, ?)',
+                (record.get('client', file[:-len('.json')]), record.get('date'), json.dumps(record), time.time())
+            )
+            imported += 1
+    logger.info(f"Imported {imported} invoice record(s) from {directory}.")
+
+def append(record, sha256=None):
+    """
+    Appends one invoice record; safe to call from several processes at once.
+
+    :param record: The client/date/brutto/net/vat/currency record.
+    :param sha256: Hash of the source file, so re-extracting it does not add the record twice.
+    :return: False when a record for this file is already stored.
+    """
+    with closing(connect()) as conn, conn:
+        cursor = conn.execute(
+            'INSERT OR IGNORE INTO invoices (client, date, sha256, record, created_at) VALUES (?, ?, ?, ?, ?)',
+            (record['client'], record.get('date'), sha256, json.dumps(record), time.time())
+        )
+    return cursor.rowcount == 1
+
+def clients():
+    with closing(connect()) as conn:
+        return [row[0] for row in conn.execute('SELECT DISTINCT client FROM invoices ORDER BY client')]
+
+def latest_ids():
+    """
+    Returns the id of the newest record of every client.
+    """
+    with closing(connect()) as conn:
+        return dict(conn.execute('SELECT client, MAX(id) FROM invoices GROUP BY client'))
+
+def records(client, after_id=0):
+    """
+    Returns (id, record) pairs of a client in insertion order.
+
+    :param after_id: Only return records stored after this id.
+    """
+    with closing(connect()) as conn:
+        rows = conn.execute(
+            'SELECT id, record FROM invoices WHERE client = ? AND id > ? ORDER BY id', (client, after_id)
+        ).fetchall()
+    return [(record_id, json.loads(record)) for record_id, record in rows]
+
+def export_client_json(client, directory=INVOICE_DATA_DIR):
+    """
+    Writes the <client>.json list layout from the store.
+    """
+    os.makedirs(directory, exist_ok=True)
+    file_path = os.path.join(directory, client + '.json')
+    tmp_path = file_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump([record for _, record in records(client)], f, indent=4)
+    os.replace(tmp_path, file_path)
+    return file_path
+
+def export_json(directory=INVOICE_DATA_DIR):
+    """
+    Writes the <client>.json file of every client, as read by upload_json2onedrive.
+    """
+    return [export_client_json(client, directory) for client in clients()]
+
+if __name__ == "__main__":
+    for path in export_json():
+        print(f"Exported {path}")
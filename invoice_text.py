@@ -0,0 +1,169 @@
+import os
+import re
+import logging
+import pypdfium2 as pdfium
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+TEXT_CONFIDENCE_THRESHOLD = float(os.getenv('PDF2JSON_TEXT_CONFIDENCE', '0.9'))
+MAX_TEXT_PAGES = 3  # invoice header and totals are on the first pages
+AMOUNT_TOLERANCE = 0.02  # allowed rounding difference between net + vat and gross
+
+CURRENCIES = {
+    'EUR': 'EUR', '€': 'EUR',
+    'CHF': 'CHF',
+    'USD': 'USD', '$': 'USD',
+    'GBP': 'GBP', '£': 'GBP',
+}
+COMPANY_SUFFIXES = r'(?:S\.?A\.?|S\.?à\.?\s?r\.?l\.?|SARL|SAS|GmbH|AG|Ltd\.?|LLC|Inc\.?|B\.?V\.?|N\.?V\.?|S\.?r\.?l\.?|plc)'
+
+AMOUNT_PATTERN = re.compile(r'-?\d{1,3}(?:[ .,\']\d{3})+(?:[.,]\d{2})|-?\d+[.,]\d{2}')
+# Checked in order per line, so 'Total incl. VAT' counts as gross and not as VAT
+LINE_LABELS = [
+    ('brutto', re.compile(r'total\s+incl|\bttc\b|\bgross\b|\bbrutto\b|amount\s+due|total\s+due|grand\s+total', re.IGNORECASE)),
+    ('net', re.compile(r'\bnet\b|\bnetto\b|sub-?total|total\s+excl|\bht\b', re.IGNORECASE)),
+    ('vat', re.compile(r'\bvat\b|\btva\b|\bmwst\b|\btax\b', re.IGNORECASE)),
+    ('brutto', re.compile(r'\btotal\b', re.IGNORECASE)),
+]
+MONTHS = r'(?:jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*'
+DATE_PATTERN = re.compile(
+    r'(?:date\s+of\s+issue|invoice\s+date|issue\s+date|date)\s*:?\s*'
+    r'(\d{1,2}\.?\s+' + MONTHS + r'\s+\d{4}|\d{1,2}[./-]\d{1,2}[./-]\d{2,4}|\d{4}-\d{2}-\d{2})',
+    re.IGNORECASE
+)
+SELLER_PATTERN = re.compile(r'^\s*([^\n]{2,80}?\s' + COMPANY_SUFFIXES + r')\s*$', re.MULTILINE)
+# Labels of the recipient's address block, whose company line is not the seller
+BUYER_LABEL = re.compile(
+    r'^\s*(?:(?:bill(?:ed)?|invoice|sold|ship|deliver(?:ed)?)\s+to\b|rechnung\s+an\b|factur[ée]\s+à'
+    r'|(?:customer|client|buyer|recipient|kunde|rechnungsempfänger|destinataire)\s*:)',
+    re.IGNORECASE
+)
+BUYER_BLOCK_LINES = 3  # address lines after a buyer label (name, street, city)
+
+def extract_text(pdf_path, max_pages=MAX_TEXT_PAGES):
+    """
+    Returns the text layer of the first pages of a PDF, empty for scans.
+    """
+    pdf = pdfium.PdfDocument(pdf_path)
+    try:
+        texts = []
+        for page_index in range(min(len(pdf), max_pages)):
+            page = pdf[page_index]
+            textpage = page.get_textpage()
+            texts.append(textpage.get_text_range())
+            textpage.close()
+            page.close()
+        return '\n'.join(texts)
+    finally:
+        pdf.close()
+
+def parse_amount(value):
+    """
+    Parses '1.234,56', '1,234.56', "1'234.56" or '1234.56' into a float.
+    """
+    value = value.replace(' ', '').replace("'", '')
+    if re.search(r'[.,]\d{2}$', value):
+        integer, decimals = value[:-3], value[-2:]
+    else:
+        integer, decimals = value, '00'
+    integer = integer.replace('.', '').replace(',', '')
+    return float(f'{integer}.{decimals}')
+
+def find_amounts(text):
+    """
+    Returns the last labelled amount per field ('brutto', 'net', 'vat').
+
+    The amount is the last one on its line, which is the total column in
+    most layouts (before it usually come quantities or VAT rates).
+    """
+    amounts = {}
+    for line in text.splitlines():
+        values = AMOUNT_PATTERN.findall(line)
+        if not values:
+            continue
+        for field, label in LINE_LABELS:
+            if label.search(line):
+                amounts[field] = parse_amount(values[-1])
+                break
+    return amounts
+
+def find_seller(text):
+    """
+    Returns the first company line outside the buyer's address block.
+
+    Both parties' names usually carry a legal suffix (GmbH, SA, Ltd), and the
+    buyer block can come first, so lines under a 'Bill to' label are skipped
+    up to BUYER_BLOCK_LINES or the next empty line.
+    """
+    buyer_lines = 0
+    for line in text.splitlines():
+        label = BUYER_LABEL.search(line)
+        if label:
+            # 'Customer: Acme GmbH' holds the first line of the block itself
+            buyer_lines = BUYER_BLOCK_LINES - 1 if line[label.end():].strip() else BUYER_BLOCK_LINES
+            continue
+        if not line.strip():
+            buyer_lines = 0
+            continue
+        if buyer_lines:
+            buyer_lines -= 1
+            continue
+        seller = SELLER_PATTERN.match(line)
+        if seller:
+            return seller.group(1).strip()
+    return None
+
+def parse_invoice_text(text):
+    """
+    Builds the client/date/brutto/net/vat/currency record from invoice text.
+
+    :return: The record (fields may be None) and a confidence between 0 and 1.
+        Every field found counts, and net + vat matching gross is required for
+        a full score since that rules out most mismatched amounts.
+    """
+    seller = find_seller(text)
+    date = DATE_PATTERN.search(text)
+    amounts = find_amounts(text)
+    currency = None
+    for symbol, code in CURRENCIES.items():
+        if re.search(r'(?<![A-Za-z])' + re.escape(symbol) + r'(?![A-Za-z])', text):
+            currency = code
+            break
+
+    record = {
+        "client": seller,
+        "date": date.group(1) if date else None,
+        "brutto": amounts.get('brutto'),
+        "net": amounts.get('net'),
+        "vat": amounts.get('vat'),
+        "currency": currency,
+    }
+    found = sum(value is not None for value in record.values())
+    confidence = found / len(record)
+    if None not in (record['brutto'], record['net'], record['vat']):
+        if abs(record['net'] + record['vat'] - record['brutto']) > AMOUNT_TOLERANCE:
+            confidence = min(confidence, 0.5)
+    else:
+        confidence = min(confidence, 0.5)
+    return record, confidence
+
+def extract_invoice(pdf_path):
+    """
+    Tries to read the invoice record from the PDF text layer.
+
+    :return: The record when it was read with enough confidence, otherwise
+        None and the caller falls back to the vision model.
+    """
+    try:
+        text = extract_text(pdf_path)
+    except pdfium.PdfiumError as e:
+        logger.warning(f"Could not read text layer of {pdf_path}: {e}")
+        return None
+    if not text.strip():
+        return None
+    record, confidence = parse_invoice_text(text)
+    logger.info(f"Text layer of {pdf_path} parsed with confidence {confidence:.2f}.")
+    if confidence < TEXT_CONFIDENCE_THRESHOLD:
+        return None
+    return record
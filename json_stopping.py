@@ -0,0 +1,87 @@
+try:
+    import torch
+    from transformers import StoppingCriteria
+except ImportError:
+    # The scanners do not need the model dependencies
+    torch = None
+    StoppingCriteria = object
+
+
+def scan_json(state, text):
+    """
+    Advances a brace/string scanner over text and marks it done once the
+    outermost JSON object is closed.
+    """
+    for char in text:
+        if state['done']:
+            return
+        if state['in_string']:
+            if state['escape']:
+                state['escape'] = False
+            elif char == '\\':
+                state['escape'] = True
+            elif char == '"':
+                state['in_string'] = False
+        elif char == '"':
+            state['in_string'] = True
+        elif char in '{[':
+            state['depth'] += 1
+        elif char in '}]':
+            state['depth'] -= 1
+            if state['depth'] <= 0:
+                state['done'] = True
+
+def strip_trailing_commas(text):
+    """
+    Removes commas right before a closing brace or bracket.
+
+    Commas inside string values are left alone, e.g. in "Rue de Flawetter, }".
+    """
+    out = []
+    in_string = False
+    escape = False
+    comma = None  # position in out of the last comma followed only by whitespace
+    for char in text:
+        if in_string:
+            if escape:
+                escape = False
+            elif char == '\\':
+                escape = True
+            elif char == '"':
+                in_string = False
+        elif char == ',':
+            comma = len(out)
+        elif char in '}]' and comma is not None:
+            del out[comma]
+            comma = None
+        elif not char.isspace():
+            comma = None
+            in_string = char == '"'
+        out.append(char)
+    return ''.join(out)
+
+
+class JsonObjectStoppingCriteria(StoppingCriteria):
+    """
+    Stops every sequence of a batch as soon as it has emitted one complete JSON object.
+
+    Generation otherwise runs until max_new_tokens or EOS, which for invoices
+    often means code fences, explanations or a repeated object after the JSON.
+    """
+
+    def __init__(self, tokenizer, batch_size, prefix=''):
+        """
+        :param tokenizer: Tokenizer used to decode each new token.
+        :param batch_size: Number of sequences in the batch.
+        :param prefix: Text already forced at the start of the answer, e.g. '{'.
+        """
+        self.tokenizer = tokenizer
+        self.states = [{'depth': 0, 'in_string': False, 'escape': False, 'done': False} for _ in range(batch_size)]
+        for state in self.states:
+            scan_json(state, prefix)
+
+    def __call__(self, input_ids, scores, **kwargs):
+        for state, token_id in zip(self.states, input_ids[:, -1].tolist()):
+            if not state['done']:
+                scan_json(state, self.tokenizer.decode([token_id], skip_special_tokens=True))
+        return torch.tensor([state['done'] for state in self.states], dtype=torch.bool, device=input_ids.device)
@@ -0,0 +1,98 @@
+import os
+import logging
+import pypdfium2 as pdfium
+import dedup_index
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+PDF_DPI = int(os.getenv('PDF2JSON_PDF_DPI', '150'))
+PAGE_CACHE_DIR = os.getenv('PDF2JSON_PAGE_CACHE_DIR', 'Data/cache/pages')
+PAGE_CACHE_MAX_BYTES = int(os.getenv('PDF2JSON_PAGE_CACHE_MAX_BYTES', str(512 * 1024 * 1024)))
+
+def page_cache_path(sha256, page_index, dpi, size):
+    width, height = size if size else (0, 0)
+    return os.path.join(PAGE_CACHE_DIR, f"{sha256}_{dpi}dpi_{width}x{height}_p{page_index}.png")
+
+def evict_pages(keep=None):
+    """
+    Deletes the least recently used pages while the cache is above PAGE_CACHE_MAX_BYTES.
+
+    :param keep: Path of a page that is about to be used and must stay.
+    """
+    pages = []
+    total = 0
+    with os.scandir(PAGE_CACHE_DIR) as entries:
+        for entry in entries:
+            if entry.name.endswith('.png'):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                pages.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+    if total <= PAGE_CACHE_MAX_BYTES:
+        return
+    evicted = 0
+    for _, size, path in sorted(pages):
+        if total <= PAGE_CACHE_MAX_BYTES:
+            break
+        if path == keep:
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        evicted += 1
+    logger.info(f"Evicted {evicted} cached page{'' if evicted == 1 else 's'}.")
+
+def iter_pdf_pages(pdf_path, dpi=PDF_DPI, size=None, sha256=None):
+    """
+    Yields the pages of a PDF as image files, one page at a time.
+
+    Rendered pages are stored in a content-addressed cache keyed by the PDF's
+    SHA-256, the DPI and the target size, so retries and re-extractions do
+    not render or resize again. Only the page being rendered is held in memory,
+    and the PDF is only opened once a page is missing from the cache. The
+    cache is kept under PAGE_CACHE_MAX_BYTES by evicting the least recently
+    used pages.
+
+    :param pdf_path: Path of the PDF.
+    :param dpi: Rasterization resolution.
+    :param size: Optional (width, height) the pages are resized to, matching the model input.
+    :param sha256: Content hash of the PDF if already known.
+    """
+    sha256 = sha256 or dedup_index.file_sha256(pdf_path)
+    os.makedirs(PAGE_CACHE_DIR, exist_ok=True)
+    pdf = None
+    page_index = 0
+    try:
+        while True:
+            cache_path = page_cache_path(sha256, page_index, dpi, size)
+            try:
+                # The modification time records the last use for eviction
+                os.utime(cache_path)
+            except FileNotFoundError:
+                if pdf is None:
+                    pdf = pdfium.PdfDocument(pdf_path)
+                if page_index >= len(pdf):
+                    return
+                page = pdf[page_index]
+                try:
+                    image = page.render(scale=dpi / 72).to_pil()
+                finally:
+                    page.close()
+                if size:
+                    image = image.resize(size)
+                # Write under a temporary name so a concurrent reader never sees half a file
+                tmp_path = cache_path + '.tmp'
+                image.save(tmp_path, format='PNG')
+                os.replace(tmp_path, cache_path)
+                logger.info(f"Rendered page {page_index + 1} of {pdf_path}.")
+                evict_pages(keep=cache_path)
+            yield cache_path
+            page_index += 1
+    finally:
+        if pdf is not None:
+            pdf.close()
@@ -1,5 +1,3 @@
 #!/bin/bash
 source /Users/mdpi/Personal/Projects/OutlookConnect/venv/bin/activate
-/Users/mdpi/Personal/Projects/OutlookConnect/venv/bin/python3 /Users/mdpi/Personal/Projects/OutlookConnect/app_outlook2pdf2onedrive.py
-/Users/mdpi/Personal/Projects/OutlookConnect/venv/bin/python3 /Users/mdpi/Personal/Projects/OutlookConnect/app_pdf2json.py
-/Users/mdpi/Personal/Projects/OutlookConnect/venv/bin/python3 /Users/mdpi/Personal/Projects/OutlookConnect/app_json2excel2onedrive.py
\ No newline at end of file
+/Users/mdpi/Personal/Projects/OutlookConnect/venv/bin/python3 /Users/mdpi/Personal/Projects/OutlookConnect/app_pipeline.py
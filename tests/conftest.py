@@ -0,0 +1,59 @@
+"""
+Shared fixtures.
+
+The app modules read their configuration (GRAPH_URL, rate limits) when they
+are imported and keep their state files relative to the working directory,
+so the emulator's address is fixed here, before any test module imports them,
+and every test runs in its own temporary directory.
+"""
+import os
+import sys
+import socket
+import tempfile
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+GRAPH_PORT = free_port()
+os.environ['GRAPH_URL'] = f'http://127.0.0.1:{GRAPH_PORT}/v1.0'
+# The emulated mailbox is dated 2023, sync all of it
+os.environ['SYNC_START'] = '2023-01-01'
+for name in ('GRAPH_MAIL_RATE', 'GRAPH_DRIVE_RATE', 'GRAPH_BATCH_RATE'):
+    os.environ[name] = '100000'
+# Log files opened on import end up here instead of in the repository
+os.chdir(tempfile.mkdtemp(prefix='outlook2onedrive_tests_'))
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+@pytest.fixture
+def graph_emulator(monkeypatch):
+    """
+    Starts a GraphEmulator on GRAPH_URL, e.g. graph_emulator(messages=3).
+    """
+    import graph_client
+    from graph_emulator import GraphEmulator
+
+    monkeypatch.setattr(graph_client, 'BACKOFF_BASE', 0.01)
+    graph_client.set_token_provider(lambda: 'test-token')
+    # Pooled connections to an emulator of an earlier test are dead
+    if graph_client._session is not None:
+        graph_client._session.close()
+        graph_client._session = None
+    emulators = []
+
+    def start(**kwargs):
+        emulator = GraphEmulator(port=GRAPH_PORT, **kwargs).start()
+        emulators.append(emulator)
+        return emulator
+
+    yield start
+    for emulator in emulators:
+        emulator.stop()
@@ -0,0 +1,76 @@
+import pytest
+import attachment_rules
+
+def attachment(**fields):
+    return dict({
+        '@odata.type': '#microsoft.graph.fileAttachment',
+        'name': 'invoice.pdf',
+        'contentType': 'application/pdf',
+        'size': 50 * 1024,
+        'isInline': False,
+    }, **fields)
+
+def message(sender='billing@example.com', subject='Invoice 42', has_attachments=True):
+    return {'subject': subject, 'hasAttachments': has_attachments, 'from': {'emailAddress': {'address': sender}}}
+
+def test_pdf_invoice_matches():
+    assert attachment_rules.attachment_matches(attachment())
+
+def test_small_pdf_is_kept():
+    assert attachment_rules.attachment_matches(attachment(size=3 * 1024))
+
+@pytest.mark.parametrize('fields', [
+    {'name': 'logo.png', 'contentType': 'image/png', 'size': 4 * 1024},
+    {'name': 'signature.jpg', 'contentType': 'application/octet-stream', 'size': 2 * 1024},
+])
+def test_small_images_are_skipped(fields):
+    assert not attachment_rules.attachment_matches(attachment(**fields))
+
+def test_scanned_image_matches():
+    assert attachment_rules.attachment_matches(attachment(name='scan.jpg', contentType='image/jpeg', size=300 * 1024))
+
+@pytest.mark.parametrize('fields', [
+    {'isInline': True},
+    {'@odata.type': '#microsoft.graph.itemAttachment'},
+    {'@odata.type': '#microsoft.graph.referenceAttachment'},
+    {'name': 'terms.docx', 'contentType': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'},
+    {'size': attachment_rules.ATTACHMENT_MAX_SIZE + 1},
+])
+def test_non_invoice_attachments_are_skipped(fields):
+    assert not attachment_rules.attachment_matches(attachment(**fields))
+
+def test_extension_matches_without_content_type():
+    assert attachment_rules.attachment_matches(attachment(name='INVOICE.PDF', contentType='application/octet-stream'))
+
+def test_message_without_attachments_is_skipped():
+    assert attachment_rules.message_matches(message())
+    assert not attachment_rules.message_matches(message(has_attachments=False))
+
+def test_sender_rules(monkeypatch):
+    monkeypatch.setattr(attachment_rules, 'SENDER_RULES', ['billing@example.com', '@supplier.ch'])
+
+    assert attachment_rules.message_matches(message('Billing@Example.com'))
+    assert attachment_rules.message_matches(message('accounts@supplier.ch'))
+    assert not attachment_rules.message_matches(message('someone@example.com'))
+
+def test_subject_keywords(monkeypatch):
+    monkeypatch.setattr(attachment_rules, 'SUBJECT_KEYWORDS', ['invoice', 'rechnung'])
+
+    assert attachment_rules.message_matches(message(subject='Your RECHNUNG 2024-03'))
+    assert not attachment_rules.message_matches(message(subject='Newsletter'))
+    assert not attachment_rules.message_matches(message(subject=None))
+
+def test_message_filter_without_sender_rules():
+    assert attachment_rules.message_filter() == 'receivedDateTime ge 1900-01-01T00:00:00Z and hasAttachments eq true'
+
+def test_message_filter_with_sender_addresses(monkeypatch):
+    monkeypatch.setattr(attachment_rules, 'SENDER_RULES', ['billing@example.com', "o'brien@example.com"])
+
+    assert attachment_rules.message_filter().endswith(
+        "and (from/emailAddress/address eq 'billing@example.com' or from/emailAddress/address eq 'o''brien@example.com')"
+    )
+
+def test_message_filter_leaves_domains_to_message_matches(monkeypatch):
+    monkeypatch.setattr(attachment_rules, 'SENDER_RULES', ['billing@example.com', '@supplier.ch'])
+
+    assert 'from/emailAddress' not in attachment_rules.message_filter()
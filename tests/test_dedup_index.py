@@ -0,0 +1,114 @@
+import json
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+import dedup_index
+import app_outlook2pdf2onedrive
+
+SHA = 'a' * 64
+
+def test_mark_processed_per_stage():
+    assert not dedup_index.is_processed('fetch', SHA)
+
+    dedup_index.mark_processed('fetch', SHA, 'msg1', 'att1', 'invoice.pdf', 1234)
+
+    assert dedup_index.is_processed('fetch', SHA)
+    assert not dedup_index.is_processed('extract', SHA)
+    assert dedup_index.is_attachment_seen('msg1', 'att1')
+    assert not dedup_index.is_attachment_seen('msg1', 'att2')
+    assert dedup_index.is_processed_size('fetch', 'invoice.pdf', 1234)
+    assert not dedup_index.is_processed_size('fetch', 'invoice.pdf', 1235)
+    assert not dedup_index.is_processed_size('extract', 'invoice.pdf', 1234)
+
+def test_file_sha256_matches_content_sha256(tmp_path, monkeypatch):
+    monkeypatch.setattr(dedup_index, 'HASH_BLOCK_SIZE', 7)
+    data = bytes(range(256)) * 3
+    (tmp_path / 'file.bin').write_bytes(data)
+
+    assert dedup_index.file_sha256(tmp_path / 'file.bin') == dedup_index.content_sha256(data)
+
+def test_claim_is_exclusive_until_released():
+    assert dedup_index.claim('fetch:' + SHA)
+    assert not dedup_index.claim('fetch:' + SHA)
+    assert dedup_index.claim('fetch:' + 'b' * 64)
+
+    dedup_index.release('fetch:' + SHA)
+
+    assert dedup_index.claim('fetch:' + SHA)
+
+def test_concurrent_claims_have_one_winner():
+    dedup_index.connect().close()
+    barrier = threading.Barrier(8)
+
+    def contend(_):
+        barrier.wait()
+        return dedup_index.claim('fetch:' + SHA)
+
+    with ThreadPoolExecutor(8) as executor:
+        results = list(executor.map(contend, range(8)))
+
+    assert results.count(True) == 1
+
+def test_stale_claim_is_taken_over(monkeypatch):
+    assert dedup_index.claim('fetch:' + SHA)
+    monkeypatch.setattr(dedup_index, 'CLAIM_TIMEOUT', -1)
+
+    assert dedup_index.claim('fetch:' + SHA)
+
+def test_index_follows_working_directory(tmp_path, monkeypatch):
+    dedup_index.mark_processed('fetch', SHA)
+    (tmp_path / 'other').mkdir()
+    monkeypatch.chdir(tmp_path / 'other')
+
+    assert not dedup_index.is_processed('fetch', SHA)
+    assert (tmp_path / 'other' / dedup_index.DEDUP_DB).exists()
+
+def test_index_without_size_column_is_migrated(tmp_path):
+    (tmp_path / 'Data').mkdir()
+    with sqlite3.connect(tmp_path / dedup_index.DEDUP_DB) as conn:
+        conn.execute("""
+            CREATE TABLE processed (
+                stage TEXT NOT NULL, sha256 TEXT NOT NULL, message_id TEXT, attachment_id TEXT,
+                name TEXT, processed_at REAL NOT NULL, PRIMARY KEY (stage, sha256)
+            )
+        """)
+        conn.execute("INSERT INTO processed VALUES ('fetch', ?, 'msg1', 'att1', 'old.pdf', 0)", (SHA,))
+    conn.close()
+
+    assert dedup_index.is_processed('fetch', SHA)
+    assert not dedup_index.is_processed_size('fetch', 'old.pdf', 10)
+    dedup_index.mark_processed('fetch', 'b' * 64, name='new.pdf', size=10)
+    assert dedup_index.is_processed_size('fetch', 'new.pdf', 10)
+
+@pytest.fixture
+def duplicated_large_attachment(graph_emulator):
+    """
+    Four messages carrying the same large invoice.
+    """
+    emulator = graph_emulator(messages=4, large_every=1, large_size=5 * 1024 * 1024, inline_logos=False)
+    first = emulator.attachments['msg000000'][0]
+    for attachments in emulator.attachments.values():
+        attachments[0]['name'] = 'invoice.pdf'
+        emulator.contents[attachments[0]['id']] = emulator.contents[first['id']]
+    app_outlook2pdf2onedrive.set_attachment_handler(lambda file_path: None)
+    return emulator
+
+def test_duplicate_large_attachments_are_uploaded_once(duplicated_large_attachment):
+    emulator = duplicated_large_attachment
+
+    app_outlook2pdf2onedrive.sync_emails('test-token')
+
+    assert list(emulator.uploaded_files) == ['/Attachments/invoice.pdf']
+    assert emulator.uploaded_bytes == emulator.large_size
+
+def test_concurrent_duplicates_wait_for_the_first_transfer(duplicated_large_attachment):
+    emulator = duplicated_large_attachment
+
+    for _ in range(2):
+        with ThreadPoolExecutor(4) as executor:
+            app_outlook2pdf2onedrive.sync_emails('test-token', executor, threading.BoundedSemaphore(8))
+
+    assert emulator.uploaded_bytes == emulator.large_size
+    with open(app_outlook2pdf2onedrive.DELTA_STATE_FILE) as f:
+        assert json.load(f)['retry_ids'] == {}
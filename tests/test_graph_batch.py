@@ -0,0 +1,120 @@
+import base64
+import pytest
+import graph_batch
+import graph_client
+
+class BatchResponse:
+    status_code = 200
+    headers = {}
+    text = ''
+
+    def __init__(self, responses):
+        self.responses = responses
+
+    def json(self):
+        return {'responses': self.responses}
+
+@pytest.fixture
+def batch_calls(monkeypatch):
+    """
+    Answers $batch calls from a script of {request id: status} per call, 200 for unscripted ids.
+    """
+    monkeypatch.setattr(graph_client, 'BACKOFF_BASE', 0.01)
+    calls = []
+    script = []
+
+    def post(url, access_token=None, json=None, **kwargs):
+        calls.append([entry['id'] for entry in json['requests']])
+        statuses = script.pop(0) if script else {}
+        return BatchResponse([
+            {'id': entry['id'], 'status': statuses.get(entry['id'], 200), 'headers': {}, 'body': {'url': entry['url']}}
+            for entry in json['requests']
+        ])
+
+    monkeypatch.setattr(graph_client, 'post', post)
+    return calls, script
+
+def entries(count, depends_on=None):
+    return [graph_batch.batch_request(i, 'GET', f'/me/messages/{i}', depends_on=(depends_on or {}).get(i)) for i in range(count)]
+
+def test_batch_request_encodes_bytes_bodies():
+    entry = graph_batch.batch_request(3, 'PUT', '/me/drive/root:/a.json:/content', body=b'{}', headers={'If-Match': '"1"'})
+
+    assert entry == {
+        'id': '3', 'method': 'PUT', 'url': '/me/drive/root:/a.json:/content',
+        'body': base64.b64encode(b'{}').decode('ascii'),
+        'headers': {'If-Match': '"1"', 'Content-Type': 'application/octet-stream'},
+    }
+
+def test_batch_request_json_body_and_dependencies():
+    entry = graph_batch.batch_request('b', 'POST', '/me/messages', body={'subject': 'x'}, depends_on=['a'])
+
+    assert entry['headers'] == {'Content-Type': 'application/json'}
+    assert entry['body'] == {'subject': 'x'}
+    assert entry['dependsOn'] == ['a']
+
+def test_pack_batches_splits_at_the_batch_limit():
+    batches = graph_batch.pack_batches(entries(45))
+
+    assert [len(batch) for batch in batches] == [20, 20, 5]
+
+def test_pack_batches_keeps_dependency_chains_together():
+    batch_entries = entries(19) + [
+        graph_batch.batch_request('a', 'GET', '/a'),
+        graph_batch.batch_request('b', 'GET', '/b', depends_on=['a']),
+    ]
+
+    batches = graph_batch.pack_batches(batch_entries)
+
+    assert [len(batch) for batch in batches] == [19, 2]
+    assert [entry['id'] for entry in batches[1]] == ['a', 'b']
+
+def test_pack_batches_drops_dependencies_outside_the_entries():
+    batch_entries = [graph_batch.batch_request('b', 'GET', '/b', depends_on=['a'])]
+
+    assert graph_batch.pack_batches(batch_entries) == [[{'id': 'b', 'method': 'GET', 'url': '/b'}]]
+
+def test_pack_batches_rejects_chains_over_the_limit():
+    chain = [graph_batch.batch_request(i, 'GET', f'/{i}', depends_on=[i - 1] if i else None) for i in range(21)]
+
+    with pytest.raises(ValueError):
+        graph_batch.pack_batches(chain)
+
+def test_send_batch_retries_only_throttled_items(batch_calls):
+    calls, script = batch_calls
+    script.extend([{'1': 429, '3': 503, '4': 404}, {'3': 503}])
+
+    results = graph_batch.send_batch('test-token', entries(5))
+
+    assert calls == [['0', '1', '2', '3', '4'], ['1', '3'], ['3']]
+    assert {i: result['status'] for i, result in results.items()} == {'0': 200, '1': 200, '2': 200, '3': 200, '4': 404}
+
+def test_send_batch_reruns_dependents_of_throttled_items(batch_calls):
+    calls, script = batch_calls
+    script.append({'0': 429, '1': 424})
+
+    results = graph_batch.send_batch('test-token', entries(3, depends_on={1: [0]}))
+
+    assert calls == [['0', '1', '2'], ['0', '1']]
+    assert results['1']['status'] == 200
+
+def test_send_batch_gives_up_after_max_retries(batch_calls, monkeypatch):
+    calls, script = batch_calls
+    monkeypatch.setattr(graph_batch, 'MAX_RETRIES', 2)
+    script.extend([{'0': 503}] * 5)
+
+    results = graph_batch.send_batch('test-token', entries(2))
+
+    assert calls == [['0', '1'], ['0'], ['0']]
+    assert results['0']['status'] == 503
+
+def test_fetch_attachment_metadata_with_faults(graph_emulator):
+    emulator = graph_emulator(messages=30, fault_rate=0.3, seed=1)
+    message_ids = [message['id'] for message in emulator.messages]
+
+    attachments = graph_batch.fetch_attachment_metadata('test-token', message_ids + ['deleted'])
+
+    assert attachments['deleted'] == []
+    for message_id in message_ids:
+        assert [a['id'] for a in attachments[message_id]] == [a['id'] for a in emulator.attachments[message_id]]
+    assert sum(count for (route, status), count in emulator.requests.items() if status in (429, 503)) > 0
@@ -0,0 +1,222 @@
+import time
+import pytest
+from email.utils import formatdate
+import graph_client
+from graph_client import GRAPH_URL
+
+MESSAGES_URL = f'{GRAPH_URL}/me/messages'
+UPLOAD_SESSION_URL = f'{GRAPH_URL}/me/drive/root:/Attachments/big.bin:/createUploadSession'
+# Rolls of the emulator's fault dice with fault_rate=1.0
+THROTTLED, UNAVAILABLE, OK = 0.0, 0.75, 1.0
+
+class Response:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+    def close(self):
+        pass
+
+@pytest.fixture
+def session(monkeypatch):
+    """
+    Records the headers of every request and answers from a script of status codes, 200 when it runs out.
+    """
+    monkeypatch.setattr(graph_client, 'BACKOFF_BASE', 0.01)
+    sent = []
+    script = []
+
+    class Session:
+        def request(self, method, url, headers=None, **kwargs):
+            sent.append(dict(headers))
+            return Response(script.pop(0) if script else 200)
+
+    monkeypatch.setattr(graph_client, 'get_session', Session)
+    return sent, script
+
+@pytest.fixture
+def rotating_tokens(monkeypatch):
+    tokens = iter(f'token-{i}' for i in range(1, 100))
+    monkeypatch.setattr(graph_client, '_token_provider', lambda: next(tokens))
+
+def test_provider_token_replaces_a_captured_one(session, rotating_tokens):
+    sent, script = session
+    script.append(503)
+
+    graph_client.get(f'{GRAPH_URL}/me/messages', access_token='expired-token')
+    graph_client.get(f'{GRAPH_URL}/me/messages', access_token='expired-token')
+
+    assert [headers['Authorization'] for headers in sent] == ['Bearer token-1', 'Bearer token-2', 'Bearer token-3']
+
+def test_access_token_is_used_without_provider(session, monkeypatch):
+    sent, _ = session
+    monkeypatch.setattr(graph_client, '_token_provider', None)
+
+    graph_client.get(f'{GRAPH_URL}/me/messages', access_token='test-token')
+
+    assert sent == [{'Authorization': 'Bearer test-token'}]
+
+def test_upload_urls_get_no_token(session, rotating_tokens):
+    sent, _ = session
+
+    graph_client.put('https://upload.example.com/session/1', data=b'x')
+
+    assert sent == [{}]
+
+class Clock:
+    """
+    Stands in for graph_client's time module; sleeping advances the clock instead of waiting.
+    """
+
+    def __init__(self):
+        self.skipped = 0.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return time.monotonic() + self.skipped
+
+    def perf_counter(self):
+        return time.perf_counter() + self.skipped
+
+    def time(self):
+        return time.time() + self.skipped
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.skipped += seconds
+
+class Rolls:
+    """
+    Replaces the emulator's random source with a script, OK once it runs out.
+    """
+
+    def __init__(self, rolls):
+        self.rolls = list(rolls)
+
+    def random(self):
+        return self.rolls.pop(0) if self.rolls else OK
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(graph_client, 'time', clock)
+    monkeypatch.setattr(graph_client, 'BACKOFF_BASE', 1.0)
+    # Pauses on the fake clock must not hold up the real buckets of later tests
+    monkeypatch.setattr(graph_client, '_buckets', {})
+    return clock
+
+@pytest.fixture
+def faults(graph_emulator):
+    """
+    Starts an emulator that injects the scripted faults, e.g. faults(THROTTLED, OK, retry_after=30).
+    """
+    def start(*rolls, retry_after=0):
+        emulator = graph_emulator(messages=1, fault_rate=1.0, retry_after=retry_after)
+        emulator.random = Rolls(rolls)
+        return emulator
+
+    return start
+
+def statuses(emulator, route):
+    return {status: count for (r, status), count in emulator.requests.items() if r == route}
+
+def test_retry_delay_reads_retry_after_seconds():
+    assert graph_client.retry_delay({'Retry-After': '7'}, 3) == 7.0
+
+def test_retry_delay_reads_retry_after_date():
+    delay = graph_client.retry_delay({'Retry-After': formatdate(time.time() + 30, usegmt=True)}, 0)
+
+    assert 28 < delay <= 30
+    assert graph_client.retry_delay({'Retry-After': formatdate(time.time() - 30, usegmt=True)}, 0) == 0.0
+
+@pytest.mark.parametrize('headers', [None, {}, {'Retry-After': 'soon'}])
+def test_retry_delay_backs_off_exponentially(headers):
+    assert 0.5 * 4 * graph_client.BACKOFF_BASE <= graph_client.retry_delay(headers, 2) <= 4 * graph_client.BACKOFF_BASE
+    assert graph_client.retry_delay(headers, 30) <= graph_client.BACKOFF_MAX
+
+def test_throttled_get_waits_retry_after_seconds(faults, clock):
+    emulator = faults(THROTTLED, OK, retry_after=30)
+
+    response = graph_client.get(MESSAGES_URL)
+
+    assert response.status_code == 200
+    assert statuses(emulator, 'messages') == {429: 1, 200: 1}
+    assert clock.sleeps == [30.0]
+
+def test_throttled_get_waits_until_retry_after_date(faults, clock):
+    emulator = faults(THROTTLED, OK, retry_after=formatdate(time.time() + 30, usegmt=True))
+
+    assert graph_client.get(MESSAGES_URL).status_code == 200
+
+    assert statuses(emulator, 'messages') == {429: 1, 200: 1}
+    (delay,) = clock.sleeps
+    assert 28 < delay <= 30
+
+def test_retry_after_pauses_the_endpoint_group(faults, clock):
+    faults(THROTTLED, OK, retry_after=30)
+    start = clock.monotonic()
+
+    graph_client.get(MESSAGES_URL)
+
+    # Delta and attachment requests share the mail group, uploads do not
+    assert graph_client.get_bucket('delta').paused_until >= start + 30
+    assert graph_client.get_bucket('drive_upload').paused_until == 0.0
+
+def test_transient_errors_of_idempotent_requests_are_retried(faults, clock):
+    emulator = faults(UNAVAILABLE, UNAVAILABLE, OK)
+
+    assert graph_client.get(MESSAGES_URL).status_code == 200
+
+    assert statuses(emulator, 'messages') == {503: 2, 200: 1}
+    assert 0.5 <= clock.sleeps[0] <= 1.0
+    assert 1.0 <= clock.sleeps[1] <= 2.0
+
+def test_post_is_not_retried_on_5xx(faults, clock):
+    emulator = faults(UNAVAILABLE, OK)
+
+    assert graph_client.post(UPLOAD_SESSION_URL, json={}).status_code == 503
+
+    assert statuses(emulator, 'upload_session') == {503: 1}
+    assert clock.sleeps == []
+
+def test_post_is_retried_on_5xx_when_forced(faults, clock):
+    emulator = faults(UNAVAILABLE, OK)
+
+    assert graph_client.post(UPLOAD_SESSION_URL, json={}, retry=True).status_code == 200
+
+    assert statuses(emulator, 'upload_session') == {503: 1, 200: 1}
+
+def test_throttled_post_is_retried(faults, clock):
+    emulator = faults(THROTTLED, OK)
+
+    assert graph_client.post(UPLOAD_SESSION_URL, json={}).status_code == 200
+
+    assert statuses(emulator, 'upload_session') == {429: 1, 200: 1}
+
+def test_retries_stop_at_max_retries(faults, clock, monkeypatch):
+    monkeypatch.setattr(graph_client, 'MAX_RETRIES', 2)
+    emulator = faults(*[UNAVAILABLE] * 5)
+
+    assert graph_client.get(MESSAGES_URL).status_code == 503
+
+    assert statuses(emulator, 'messages') == {503: 3}
+    assert len(clock.sleeps) == 2
+
+def test_token_bucket_limits_the_rate(clock):
+    bucket = graph_client.TokenBucket(rate=10, capacity=2)
+
+    for _ in range(3):
+        bucket.acquire()
+
+    (delay,) = clock.sleeps
+    assert delay == pytest.approx(0.1, abs=0.01)
+
+def test_token_bucket_pause(clock):
+    bucket = graph_client.TokenBucket(rate=10, capacity=2)
+    bucket.pause(5)
+    bucket.pause(1)
+
+    bucket.acquire()
+
+    # A shorter pause does not cut an earlier, longer one short
+    assert sum(clock.sleeps) == pytest.approx(5, abs=0.01)
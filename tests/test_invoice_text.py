@@ -0,0 +1,95 @@
+import pytest
+import invoice_text
+
+INVOICE = """\
+Bill to:
+Buyer Holdings GmbH
+Hauptstrasse 1
+8000 Zurich
+
+Seller Services SA
+Rue du Marche 3, 1204 Geneva
+Invoice date: 14.03.2024
+
+Description          Qty   Price      Amount
+Consulting            10   120.00   1'200.00
+Subtotal                            1'200.00
+VAT 8.1%                               97.20
+Total incl. VAT CHF                 1'297.20
+"""
+
+@pytest.mark.parametrize('value, expected', [
+    ('1.234,56', 1234.56),
+    ('1,234.56', 1234.56),
+    ("1'234.56", 1234.56),
+    ('1 234,56', 1234.56),
+    ('1234.56', 1234.56),
+    ('12,00', 12.0),
+    ('-45.10', -45.1),
+    ('1,234', 1234.0),
+])
+def test_parse_amount(value, expected):
+    assert invoice_text.parse_amount(value) == expected
+
+def test_find_amounts_takes_the_last_amount_of_labelled_lines():
+    amounts = invoice_text.find_amounts(INVOICE)
+
+    assert amounts == {'net': 1200.0, 'vat': 97.2, 'brutto': 1297.2}
+
+def test_total_including_vat_is_not_read_as_vat():
+    amounts = invoice_text.find_amounts('VAT 20%  10.00\nTotal incl. VAT  60.00\nNet  50.00')
+
+    assert amounts == {'vat': 10.0, 'brutto': 60.0, 'net': 50.0}
+
+@pytest.mark.parametrize('line, expected', [
+    ('Invoice date: 14.03.2024', '14.03.2024'),
+    ('Date of issue 3 March 2024', '3 March 2024'),
+    ('Issue date: 2024-03-14', '2024-03-14'),
+    ('Date 14/03/24', '14/03/24'),
+])
+def test_date_pattern(line, expected):
+    assert invoice_text.DATE_PATTERN.search(line).group(1) == expected
+
+@pytest.mark.parametrize('label', ['Bill to:', 'Invoice to', 'Ship to:', 'Customer:', 'Rechnung an', 'Facturé à :'])
+def test_buyer_block_is_not_the_seller(label):
+    text = f'{label}\nBuyer Holdings GmbH\nHauptstrasse 1\n\nSeller Services SA\nRue du Marche 3'
+
+    assert invoice_text.find_seller(text) == 'Seller Services SA'
+
+def test_buyer_on_the_label_line_is_not_the_seller():
+    text = 'Customer: Buyer Holdings GmbH\nHauptstrasse 1\n8000 Zurich\nSeller Services Ltd\n'
+
+    assert invoice_text.find_seller(text) == 'Seller Services Ltd'
+
+def test_seller_before_the_buyer_block():
+    text = 'Seller Services S.A.\nRue du Marche 3\nBill to:\nBuyer Holdings GmbH\n'
+
+    assert invoice_text.find_seller(text) == 'Seller Services S.A.'
+
+def test_no_company_line():
+    assert invoice_text.find_seller('Bill to:\nJohn Doe\nMain Street 1\n') is None
+
+def test_parse_invoice_text_with_matching_amounts():
+    record, confidence = invoice_text.parse_invoice_text(INVOICE)
+
+    assert record == {
+        'client': 'Seller Services SA',
+        'date': '14.03.2024',
+        'brutto': 1297.2,
+        'net': 1200.0,
+        'vat': 97.2,
+        'currency': 'CHF',
+    }
+    assert confidence == 1.0
+    assert confidence >= invoice_text.TEXT_CONFIDENCE_THRESHOLD
+
+def test_inconsistent_amounts_lower_the_confidence():
+    record, confidence = invoice_text.parse_invoice_text(INVOICE.replace('   97.20', '   79.20'))
+
+    assert record['vat'] == 79.2
+    assert confidence == 0.5
+
+def test_missing_amounts_lower_the_confidence():
+    _, confidence = invoice_text.parse_invoice_text('Seller Services SA\nInvoice date: 14.03.2024\nTotal EUR 10.00')
+
+    assert confidence == 0.5
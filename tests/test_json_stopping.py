@@ -0,0 +1,94 @@
+import json
+import pytest
+import json_stopping
+from json_stopping import scan_json, strip_trailing_commas
+from app_pdf2json import parse_output
+
+def scanned(text, prefix=''):
+    state = {'depth': 0, 'in_string': False, 'escape': False, 'done': False}
+    scan_json(state, prefix)
+    # One character at a time, like tokens
+    for char in text:
+        scan_json(state, char)
+    return state
+
+@pytest.mark.parametrize('text', [
+    '{"a": 1}',
+    '{"a": {"b": [1, 2, {"c": 3}]}}',
+    '{"address": "17, Rue {de} Flawetter ]"}',
+    r'{"name": "PSI \"Services\" SA", "note": "C:\\"}',
+    '{"a": 1}\n```\nThe JSON above',
+])
+def test_complete_object_is_done(text):
+    assert scanned(text)['done']
+
+@pytest.mark.parametrize('text', [
+    '{"a": 1',
+    '{"address": "Rue de Flawetter }"',
+    r'{"name": "PSI \"}',
+    '{"a": [1, 2}',
+])
+def test_incomplete_object_is_not_done(text):
+    assert not scanned(text)['done']
+
+def test_scanner_stops_at_the_end_of_the_object():
+    state = scanned('{"a": 1} {"b": 2')
+
+    assert state['done']
+    assert state['depth'] == 0
+
+def test_forced_prefix_counts():
+    assert scanned('"a": 1', prefix='{')['depth'] == 1
+    assert scanned('"a": 1}', prefix='{')['done']
+
+@pytest.mark.parametrize('text, expected', [
+    ('{"a": 1,}', '{"a": 1}'),
+    ('{"a": [1, 2,\n  ],\n}', '{"a": [1, 2\n  ]\n}'),
+    ('{"a": "x, }", "b": "y,]",}', '{"a": "x, }", "b": "y,]"}'),
+    (r'{"a": "\", }",}', r'{"a": "\", }"}'),
+    ('{"a": 1, "b": 2}', '{"a": 1, "b": 2}'),
+])
+def test_strip_trailing_commas(text, expected):
+    assert strip_trailing_commas(text) == expected
+
+def test_stripped_output_keeps_string_values():
+    text = '{"address": "17, Rue de Flawetter, }", "items": [{"net": 1,},],}'
+
+    assert json.loads(strip_trailing_commas(text)) == {'address': '17, Rue de Flawetter, }', 'items': [{'net': 1}]}
+
+OUTPUT = {
+    'invoice_number': '04/85/1345',
+    'date_of_issue': '04. January 2023',
+    'seller_info': {'name': 'PSI Services SA', 'address': '17, Rue de Flawetter, L-6775'},
+    'client_info': {'name': 'PSI Concepts SA'},
+    'invoice_items_table': [{'net_amount': 8000.0, 'vat_amount': 1360.0, 'gross_amount': 9360.0}],
+    'currency': 'EUR',
+}
+RECORD = {'client': 'PSI Services SA', 'date': '04. January 2023', 'brutto': 9360.0, 'net': 8000.0, 'vat': 1360.0, 'currency': 'EUR'}
+
+def test_parse_output():
+    assert parse_output('```json\n' + json.dumps(OUTPUT) + '\n```') == RECORD
+
+def test_parse_output_with_trailing_commas():
+    text = json.dumps(OUTPUT, indent=2).replace('"EUR"', '"EUR",').replace('9360.0', '9360.0,')
+
+    assert parse_output(text) == RECORD
+
+@pytest.mark.parametrize('text', ['{"seller_info": {"name": "PSI"', json.dumps({'currency': 'EUR'})])
+def test_unusable_output(text):
+    assert parse_output(text) is None
+
+def test_stopping_criteria_stops_each_sequence():
+    torch = pytest.importorskip('torch')
+
+    class Tokenizer:
+        tokens = ['"a"', ':', ' "}"', '}', ' 1']
+
+        def decode(self, token_ids, skip_special_tokens=True):
+            return ''.join(self.tokens[i] for i in token_ids)
+
+    criteria = json_stopping.JsonObjectStoppingCriteria(Tokenizer(), 2, prefix='{')
+    steps = [[0, 0], [1, 1], [2, 4], [3, 3]]
+    done = [criteria(torch.tensor([step]).T, None).tolist() for step in steps]
+
+    assert done == [[False, False], [False, False], [False, False], [True, True]]
@@ -0,0 +1,153 @@
+import os
+import json
+import hashlib
+import pytest
+import app_outlook2pdf2onedrive as app
+
+@pytest.fixture
+def handled(monkeypatch):
+    """
+    Local copies handed to extraction, with their content at hand-over time.
+    """
+    files = {}
+
+    def handler(file_path):
+        with open(file_path, 'rb') as f:
+            files[file_path] = f.read()
+
+    monkeypatch.setattr(app, 'attachment_handler', None)
+    app.set_attachment_handler(handler)
+    return files
+
+def read(file_path):
+    with open(file_path, 'rb') as f:
+        return f.read()
+
+def delta_state():
+    with open(app.DELTA_STATE_FILE) as f:
+        return json.load(f)
+
+def test_sync_transfers_new_messages_once(graph_emulator, handled):
+    emulator = graph_emulator(messages=3)
+
+    app.sync_emails('test-token')
+    app.sync_emails('test-token')
+
+    assert emulator.uploaded_bytes == 3 * emulator.attachment_size
+    assert len(handled) == 3
+    assert sorted(delta_state()['seen_ids']) == ['msg000000', 'msg000001', 'msg000002']
+
+def test_failed_transfer_is_retried_by_the_next_sync(graph_emulator, handled):
+    emulator = graph_emulator(messages=2, inline_logos=False)
+    attachment = emulator.attachments['msg000001'][0]
+    content = emulator.contents.pop(attachment['id'])
+
+    app.sync_emails('test-token')
+
+    state = delta_state()
+    assert state['seen_ids'] == ['msg000000']
+    assert state['retry_ids'] == {'msg000001': 1}
+
+    emulator.contents[attachment['id']] = content
+    app.sync_emails('test-token')
+
+    state = delta_state()
+    assert sorted(state['seen_ids']) == ['msg000000', 'msg000001']
+    assert state['retry_ids'] == {}
+    assert f"/Attachments/{attachment['name']}" in emulator.uploaded_files
+
+def test_retries_stop_after_max_message_retries(graph_emulator, handled, monkeypatch):
+    monkeypatch.setattr(app, 'MAX_MESSAGE_RETRIES', 2)
+    emulator = graph_emulator(messages=1, inline_logos=False)
+    emulator.contents.clear()
+
+    for attempts in (1, 2):
+        app.sync_emails('test-token')
+        assert delta_state()['retry_ids'] == {'msg000000': attempts}
+    app.sync_emails('test-token')
+
+    assert delta_state()['retry_ids'] == {}
+    assert delta_state()['seen_ids'] == ['msg000000']
+
+@pytest.mark.parametrize('large', [False, True])
+def test_failed_upload_leaves_no_local_copy(graph_emulator, handled, monkeypatch, large):
+    graph_emulator(messages=1, large_every=1 if large else 0, inline_logos=False)
+    monkeypatch.setattr(app, 'upload_bytes_to_onedrive', lambda *args: False)
+    monkeypatch.setattr(app.upload_session, 'stream_upload', lambda *args, **kwargs: False)
+
+    app.sync_emails('test-token')
+
+    assert handled == {}
+    assert os.listdir(app.ATTACHMENTS_DIR) == []
+    assert delta_state()['retry_ids'] == {'msg000000': 1}
+
+def test_same_named_attachments_keep_their_own_copies(graph_emulator, handled):
+    emulator = graph_emulator(messages=3, inline_logos=False)
+    for attachments in emulator.attachments.values():
+        attachments[0]['name'] = 'invoice.pdf'
+
+    app.sync_emails('test-token')
+
+    assert len(handled) == 3
+    assert all(os.path.basename(path).endswith('_invoice.pdf') for path in handled)
+    expected = sorted(emulator.contents[attachments[0]['id']] for attachments in emulator.attachments.values())
+    assert sorted(handled.values()) == expected
+    assert sorted(handled.values()) == sorted(read(path) for path in handled)
+
+def test_failed_large_upload_is_resumed_by_the_retry(graph_emulator, handled, monkeypatch):
+    emulator = graph_emulator(messages=1, large_every=1, inline_logos=False)
+    (attachment,) = emulator.attachments['msg000000']
+    real_put = app.graph_client.put
+    ranges = []
+
+    def put(url, access_token=None, **kwargs):
+        ranges.append(kwargs['headers']['Content-Range'])
+        if len(ranges) == 3:
+            raise ConnectionError('connection reset')
+        return real_put(url, access_token=access_token, **kwargs)
+
+    monkeypatch.setattr(app.graph_client, 'put', put)
+    assert not app.transfer_attachment('test-token', 'msg000000', attachment)
+    assert handled == {}
+    confirmed = int(ranges[1].split('-')[1].split('/')[0]) + 1
+
+    assert app.transfer_attachment('test-token', 'msg000000', attachment)
+
+    assert ranges[3].startswith(f'bytes {confirmed}-')
+    assert sum(count for (route, _), count in emulator.requests.items() if route == 'upload_session') == 1
+    content = emulator.contents[attachment['id']]
+    assert emulator.uploaded_bytes == len(content)
+    uploaded = emulator.uploaded_files[f"/Attachments/{attachment['name']}"]
+    assert uploaded['file']['hashes']['sha256Hash'] == hashlib.sha256(content).hexdigest().upper()
+    assert list(handled.values()) == [content]
+    assert app.upload_session.load_journal() == {}
+
+def test_initial_sync_starts_at_sync_start(graph_emulator, handled, monkeypatch):
+    emulator = graph_emulator(messages=5, inline_logos=False)
+    # Messages are received a minute apart from 2023-11-14T22:13:20Z on
+    monkeypatch.setattr(app, 'SYNC_START', '2023-11-14T22:15:00Z')
+
+    app.sync_emails('test-token')
+
+    assert sorted(delta_state()['seen_ids']) == ['msg000002', 'msg000003', 'msg000004']
+    assert delta_state()['sync_start'] == '2023-11-14T22:15:00Z'
+    assert emulator.uploaded_bytes == 3 * emulator.attachment_size
+
+def test_initial_sync_defaults_to_new_mail_only(graph_emulator, handled, monkeypatch):
+    emulator = graph_emulator(messages=3, inline_logos=False)
+    monkeypatch.setattr(app, 'SYNC_START', None)
+
+    app.sync_emails('test-token')
+    assert delta_state()['seen_ids'] == []
+    emulator.add_message()
+    emulator.messages[-1]['receivedDateTime'] = '2999-01-01T00:00:00Z'
+    app.sync_emails('test-token')
+
+    assert delta_state()['seen_ids'] == ['msg000003']
+
+@pytest.mark.parametrize('sync_start, expected', [
+    ('2024-01-01', '2024-01-01T00:00:00Z'),
+    ('2024-01-01T08:30:00Z', '2024-01-01T08:30:00Z'),
+])
+def test_sync_start_time(sync_start, expected):
+    assert app.sync_start_time(sync_start) == expected
@@ -0,0 +1,48 @@
+import os
+import time
+import pytest
+from PIL import Image
+import pdf_pages
+
+@pytest.fixture
+def pdf(tmp_path):
+    pages = [Image.new('RGB', (200, 300), color) for color in ('red', 'green', 'blue')]
+    pdf_path = str(tmp_path / 'invoice.pdf')
+    pages[0].save(pdf_path, save_all=True, append_images=pages[1:])
+    return pdf_path
+
+def cached_pages():
+    """
+    Size and page index of every cached page, e.g. '0x0_p1'.
+    """
+    return sorted(name.split('dpi_')[1][:-len('.png')] for name in os.listdir(pdf_pages.PAGE_CACHE_DIR))
+
+def cache_size():
+    return sum(entry.stat().st_size for entry in os.scandir(pdf_pages.PAGE_CACHE_DIR))
+
+def test_pages_are_rendered_once(pdf, monkeypatch):
+    assert len(list(pdf_pages.iter_pdf_pages(pdf, dpi=72))) == 3
+
+    def render(*args):
+        raise AssertionError('page rendered again')
+
+    monkeypatch.setattr(pdf_pages.pdfium, 'PdfDocument', render)
+    pages = pdf_pages.iter_pdf_pages(pdf, dpi=72)
+
+    assert [os.path.basename(next(pages)).split('_p')[-1] for _ in range(3)] == ['0.png', '1.png', '2.png']
+    assert cached_pages() == ['0x0_p0', '0x0_p1', '0x0_p2']
+
+def test_least_recently_used_pages_are_evicted(pdf, monkeypatch):
+    list(pdf_pages.iter_pdf_pages(pdf, dpi=72))
+    page_size = max(os.path.getsize(os.path.join(pdf_pages.PAGE_CACHE_DIR, n)) for n in os.listdir(pdf_pages.PAGE_CACHE_DIR))
+    for page_index, name in enumerate(sorted(os.listdir(pdf_pages.PAGE_CACHE_DIR))):
+        past = time.time() - 100 + page_index
+        os.utime(os.path.join(pdf_pages.PAGE_CACHE_DIR, name), (past, past))
+    # Reading the first page makes it the most recently used one
+    next(pdf_pages.iter_pdf_pages(pdf, dpi=72))
+    monkeypatch.setattr(pdf_pages, 'PAGE_CACHE_MAX_BYTES', 3 * page_size)
+
+    list(pdf_pages.iter_pdf_pages(pdf, dpi=72, size=(100, 150)))
+
+    assert cache_size() <= 3 * page_size
+    assert cached_pages() == ['0x0_p0', '100x150_p0', '100x150_p1', '100x150_p2']
@@ -0,0 +1,79 @@
+import os
+import json
+import queue
+import pytest
+import app_pipeline
+import app_pdf2json
+import app_json2excel2onedrive
+import token_provider
+
+INVOICE = json.dumps({
+    'seller_info': {'name': 'PSI Services SA'},
+    'date_of_issue': '04. January 2023',
+    'invoice_items_table': [{'net_amount': 100.0, 'vat_amount': 17.0, 'gross_amount': 117.0}],
+    'currency': 'EUR',
+})
+
+@pytest.fixture
+def extraction(monkeypatch):
+    """
+    Answers every image named invoice*.png with INVOICE and others with no invoice data.
+
+    Returns the set of local files whose upload to OneDrive should fail.
+    """
+    failing_uploads = set()
+
+    def generate_outputs(file_names):
+        return [INVOICE if os.path.basename(name).startswith('invoice') else '{}' for name in file_names]
+
+    def upload_to_onedrive(access_token, file_path, destination_file_name):
+        return file_path not in failing_uploads
+
+    monkeypatch.setattr(app_pdf2json, 'generate_outputs', generate_outputs)
+    monkeypatch.setattr(app_json2excel2onedrive, 'upload_to_onedrive', upload_to_onedrive)
+    monkeypatch.setattr(token_provider, 'get_access_token', lambda: 'test-token')
+    return failing_uploads
+
+def attachment(name, content):
+    os.makedirs('attachments', exist_ok=True)
+    file_path = os.path.join('attachments', name)
+    with open(file_path, 'wb') as f:
+        f.write(content)
+    return file_path
+
+def run_extract_stage(file_paths):
+    files = queue.Queue()
+    for file_path in file_paths:
+        files.put(file_path)
+    files.put(app_pipeline.STOP)
+    app_pipeline.extract_stage(files, queue.Queue())
+
+def test_extracted_attachments_are_removed(extraction):
+    file_paths = [
+        attachment('invoice_a.png', b'a'),
+        attachment('invoice_copy.png', b'a'),
+        attachment('invoice_b.png', b'b'),
+        attachment('letter.png', b'c'),
+    ]
+    extraction.add(file_paths[2])
+
+    run_extract_stage(file_paths)
+
+    # A failed upload and a file without invoice data are still pending
+    assert app_pipeline.pending_attachments() == ['attachments/invoice_b.png', 'attachments/letter.png']
+    assert os.listdir('Data/Attachments/PSI Services SA') == ['PSI Services SA_04 January 2023.png']
+
+def test_forwarded_copy_of_an_extracted_invoice_is_removed(extraction):
+    run_extract_stage([attachment('invoice.png', b'a')])
+    forwarded = attachment('FW_invoice.png', b'a')
+
+    run_extract_stage([forwarded])
+
+    assert not os.path.exists(forwarded)
+    assert app_pipeline.pending_attachments() == []
+
+def test_pending_attachments_skips_other_files():
+    attachment('invoice.pdf', b'%PDF')
+    attachment('notes.txt', b'x')
+
+    assert app_pipeline.pending_attachments() == ['attachments/invoice.pdf']
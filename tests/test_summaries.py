@@ -0,0 +1,86 @@
+import json
+import pytest
+from openpyxl import load_workbook
+import invoice_store
+import app_json2excel2onedrive
+from Json2Excel import main as json2excel
+
+CLIENT = 'PSI Services SA'
+
+def record(date, client=CLIENT, brutto=117.0):
+    return {'client': client, 'date': date, 'brutto': brutto, 'net': 100.0, 'vat': 17.0, 'currency': 'EUR'}
+
+def workbook_dates(excel_path):
+    sheet = load_workbook(excel_path)[json2excel.SHEET_TITLE]
+    return [row[1] for row in sheet.iter_rows(min_row=2, values_only=True)]
+
+def test_append_skips_files_already_stored():
+    assert invoice_store.append(record('1 Jan'), sha256='a' * 64)
+    assert not invoice_store.append(record('1 Jan'), sha256='a' * 64)
+    assert invoice_store.append(record('1 Jan'))
+    assert invoice_store.append(record('2 Jan', client='Other SA'))
+
+    assert invoice_store.clients() == ['Other SA', CLIENT]
+    assert [r['date'] for _, r in invoice_store.records(CLIENT)] == ['1 Jan', '1 Jan']
+    latest = invoice_store.latest_ids()
+    assert invoice_store.records(CLIENT, after_id=latest[CLIENT]) == []
+
+def test_new_store_imports_legacy_json(tmp_path):
+    (tmp_path / 'Data' / 'InvoiceData').mkdir(parents=True)
+    (tmp_path / 'Data' / 'InvoiceData' / f'{CLIENT}.json').write_text(json.dumps([record('1 Jan'), record('2 Jan')]))
+
+    assert [r['date'] for _, r in invoice_store.records(CLIENT)] == ['1 Jan', '2 Jan']
+
+    invoice_store.export_json(str(tmp_path / 'export'))
+    assert json.loads((tmp_path / 'export' / f'{CLIENT}.json').read_text()) == [record('1 Jan'), record('2 Jan')]
+
+def test_update_summary_appends_past_the_watermark(tmp_path):
+    excel_path = str(tmp_path / 'summary.xlsx')
+    client_state = {}
+    invoice_store.append(record('1 Jan'))
+    assert json2excel.update_summary(CLIENT, client_state, excel_path)
+    invoice_store.append(record('2 Jan'))
+    invoice_store.append(record('3 Jan'))
+
+    assert json2excel.update_summary(CLIENT, client_state, excel_path)
+    assert not json2excel.update_summary(CLIENT, client_state, excel_path)
+
+    assert workbook_dates(excel_path) == ['1 Jan', '2 Jan', '3 Jan']
+    assert client_state['summarized_id'] == invoice_store.latest_ids()[CLIENT]
+
+@pytest.mark.parametrize('damage', ['missing', 'corrupt'])
+def test_update_summary_rebuilds_a_lost_workbook(tmp_path, damage):
+    excel_path = tmp_path / 'summary.xlsx'
+    client_state = {}
+    invoice_store.append(record('1 Jan'))
+    json2excel.update_summary(CLIENT, client_state, str(excel_path))
+    invoice_store.append(record('2 Jan'))
+    if damage == 'missing':
+        excel_path.unlink()
+    else:
+        excel_path.write_bytes(b'not a zip')
+
+    assert json2excel.update_summary(CLIENT, client_state, str(excel_path))
+
+    assert workbook_dates(excel_path) == ['1 Jan', '2 Jan']
+
+def test_failed_upload_does_not_append_rows_twice(graph_emulator, monkeypatch, tmp_path):
+    graph_emulator(messages=0)
+    monkeypatch.setattr(app_json2excel2onedrive, 'get_access_token', lambda: 'test-token')
+    directory = str(tmp_path / 'Data' / 'InvoiceData')
+    invoice_store.append(record('1 Jan'))
+    app_json2excel2onedrive.upload_json2onedrive(directory=directory)
+    invoice_store.append(record('2 Jan'))
+
+    def lost_connection(access_token, uploads):
+        raise ConnectionError('Graph unreachable')
+
+    with monkeypatch.context() as patch:
+        patch.setattr(app_json2excel2onedrive, 'upload_files_batched', lost_connection)
+        with pytest.raises(ConnectionError):
+            app_json2excel2onedrive.upload_json2onedrive(directory=directory)
+    app_json2excel2onedrive.upload_json2onedrive(directory=directory)
+
+    assert workbook_dates(f'Data/Summaries/{CLIENT}.xlsx') == ['1 Jan', '2 Jan']
+    state = json2excel.load_summary_state()[CLIENT]
+    assert state['summarized_id'] == state['uploaded_id'] == invoice_store.latest_ids()[CLIENT]
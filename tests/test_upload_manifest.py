@@ -0,0 +1,118 @@
+import os
+import pytest
+import dedup_index
+import upload_manifest
+import app_json2excel2onedrive
+
+DESTINATION = '/Invoices/Invoice Data/a.json'
+ITEM = {'eTag': '"{ABC},1"', 'size': 5, 'file': {'hashes': {'quickXorHash': 'xor'}}}
+
+@pytest.fixture
+def uploaded(tmp_path):
+    file_path = tmp_path / 'a.json'
+    file_path.write_bytes(b'{"a"}')
+    upload_manifest.record_upload(DESTINATION, file_path, dedup_index.file_sha256(file_path), ITEM)
+    return file_path
+
+def test_new_file_is_changed(tmp_path):
+    (tmp_path / 'a.json').write_bytes(b'{"a"}')
+
+    changed, entry, sha256 = upload_manifest.check(tmp_path / 'a.json', DESTINATION)
+
+    assert changed
+    assert entry is None
+    assert sha256 == dedup_index.content_sha256(b'{"a"}')
+
+def test_unchanged_file_is_not_read(uploaded, monkeypatch):
+    monkeypatch.setattr(dedup_index, 'file_sha256', lambda file_path: pytest.fail('file was hashed'))
+
+    changed, entry, _ = upload_manifest.check(uploaded, DESTINATION)
+
+    assert not changed
+    assert entry['etag'] == ITEM['eTag']
+    assert entry['quick_xor_hash'] == 'xor'
+
+def test_rewritten_file_with_same_content_is_unchanged(uploaded):
+    os.utime(uploaded, ns=(0, 10 ** 18))
+
+    changed, _, _ = upload_manifest.check(uploaded, DESTINATION)
+
+    assert not changed
+    assert upload_manifest.get_entry(DESTINATION)['mtime_ns'] == 10 ** 18
+
+def test_edited_file_is_changed(uploaded):
+    uploaded.write_bytes(b'{"b"}')
+
+    changed, entry, sha256 = upload_manifest.check(uploaded, DESTINATION)
+
+    assert changed
+    assert entry['sha256'] != sha256
+
+@pytest.mark.parametrize('status, item, expected', [
+    (200, {'eTag': ITEM['eTag'], 'size': 5}, 'unchanged'),
+    (404, None, 'missing'),
+    (200, {'eTag': '"{DEF},2"', 'size': 5}, 'replaced'),
+    (200, {'eTag': ITEM['eTag'], 'size': 6}, 'replaced'),
+    (503, None, 'unchanged'),
+])
+def test_remote_state(uploaded, status, item, expected):
+    entry = upload_manifest.get_entry(DESTINATION)
+
+    assert upload_manifest.remote_state(entry, status, item) == expected
+
+def test_conditional_headers(uploaded):
+    assert upload_manifest.conditional_headers(upload_manifest.get_entry(DESTINATION)) == {'If-Match': ITEM['eTag']}
+    assert upload_manifest.conditional_headers(None) == {}
+
+@pytest.fixture
+def uploads(tmp_path):
+    (tmp_path / 'f').mkdir()
+    uploads = []
+    for name in 'ab':
+        (tmp_path / 'f' / f'{name}.json').write_text(name * 100)
+        uploads.append((str(tmp_path / 'f' / f'{name}.json'), f'{name} x.json', '/Invoices/Invoice Data'))
+    return uploads
+
+def puts(emulator):
+    # Every file is 100 bytes, batched PUTs are not counted per route
+    return emulator.uploaded_bytes // 100
+
+def test_unchanged_files_are_skipped_while_the_copy_is_ours(graph_emulator, uploads):
+    emulator = graph_emulator(messages=0)
+    assert all(app_json2excel2onedrive.upload_files_batched('test-token', uploads).values())
+    assert puts(emulator) == 2
+
+    assert all(app_json2excel2onedrive.upload_files_batched('test-token', uploads).values())
+
+    assert puts(emulator) == 2
+
+def test_deleted_copy_is_uploaded_again(graph_emulator, uploads):
+    emulator = graph_emulator(messages=0)
+    app_json2excel2onedrive.upload_files_batched('test-token', uploads)
+    del emulator.uploaded_files['/Invoices/Invoice Data/a x.json']
+
+    assert all(app_json2excel2onedrive.upload_files_batched('test-token', uploads).values())
+
+    assert puts(emulator) == 3
+    assert '/Invoices/Invoice Data/a x.json' in emulator.uploaded_files
+
+def test_replaced_copy_is_not_overwritten(graph_emulator, uploads):
+    emulator = graph_emulator(messages=0)
+    app_json2excel2onedrive.upload_files_batched('test-token', uploads)
+    emulator.uploaded_files['/Invoices/Invoice Data/b x.json']['eTag'] = '"{EDITED},5"'
+
+    assert not app_json2excel2onedrive.upload_to_onedrive('test-token', *uploads[1])
+    results = app_json2excel2onedrive.upload_files_batched('test-token', uploads)
+
+    assert results == {uploads[0]: True, uploads[1]: False}
+    assert emulator.uploaded_files['/Invoices/Invoice Data/b x.json']['eTag'] == '"{EDITED},5"'
+
+def test_replaced_copy_is_overwritten_when_allowed(graph_emulator, uploads, monkeypatch):
+    emulator = graph_emulator(messages=0)
+    monkeypatch.setattr(upload_manifest, 'OVERWRITE_CONFLICTS', True)
+    app_json2excel2onedrive.upload_to_onedrive('test-token', *uploads[1])
+    emulator.uploaded_files['/Invoices/Invoice Data/b x.json']['eTag'] = '"{EDITED},5"'
+
+    assert app_json2excel2onedrive.upload_to_onedrive('test-token', *uploads[1])
+
+    assert emulator.uploaded_files['/Invoices/Invoice Data/b x.json']['eTag'] != '"{EDITED},5"'
@@ -0,0 +1,182 @@
+import os
+import json
+import hashlib
+import pytest
+import graph_client
+import upload_session
+from upload_session import CHUNK_UNIT, MIN_CHUNK_SIZE
+
+FILE_SIZE = 3 * 1024 * 1024 + 12345
+
+class LostResponse:
+    status_code = 504
+    headers = {}
+    text = 'Gateway Timeout'
+
+@pytest.fixture
+def big_file(tmp_path):
+    data = os.urandom(FILE_SIZE)
+    (tmp_path / 'big.bin').write_bytes(data)
+    return str(tmp_path / 'big.bin'), hashlib.sha256(data).hexdigest().upper()
+
+@pytest.fixture
+def chunk_puts(monkeypatch):
+    """
+    Counts chunk PUTs and lets a test fail the n-th one, after (lose) or instead of (crash) sending it.
+    """
+    real_put = graph_client.put
+    failures = {}
+    calls = []
+
+    def put(url, access_token=None, **kwargs):
+        calls.append(kwargs['headers']['Content-Range'])
+        failure = failures.get(len(calls))
+        if failure == 'crash':
+            raise ConnectionError('process killed')
+        response = real_put(url, access_token=access_token, **kwargs)
+        return LostResponse() if failure == 'lose' else response
+
+    monkeypatch.setattr(graph_client, 'put', put)
+    return calls, failures
+
+def byte_range(content_range):
+    start, end = content_range.split(' ')[1].split('/')[0].split('-')
+    return int(start), int(end)
+
+def uploaded_hash(emulator, name='big.bin'):
+    return emulator.uploaded_files[f'/Attachments/{name}']['file']['hashes']['sha256Hash']
+
+def sessions_created(emulator):
+    return sum(count for (route, _), count in emulator.requests.items() if route == 'upload_session')
+
+@pytest.mark.parametrize('chunk_size, sent, elapsed, expected', [
+    (MIN_CHUNK_SIZE, MIN_CHUNK_SIZE, 0, 2 * MIN_CHUNK_SIZE),
+    (MIN_CHUNK_SIZE, MIN_CHUNK_SIZE, 0.001, 2 * MIN_CHUNK_SIZE),
+    (4 * CHUNK_UNIT, 4 * CHUNK_UNIT, 4.0, 2 * CHUNK_UNIT),
+    (4 * CHUNK_UNIT, 4 * CHUNK_UNIT, 100.0, MIN_CHUNK_SIZE),
+    (upload_session.MAX_CHUNK_SIZE, upload_session.MAX_CHUNK_SIZE, 0.001, upload_session.MAX_CHUNK_SIZE),
+])
+def test_next_chunk_size(chunk_size, sent, elapsed, expected):
+    size = upload_session.next_chunk_size(chunk_size, sent, elapsed)
+
+    assert size == expected
+    assert size % CHUNK_UNIT == 0
+
+def test_resumable_upload(graph_emulator, big_file):
+    emulator = graph_emulator(messages=0)
+    file_path, sha256 = big_file
+
+    assert upload_session.resumable_upload('test-token', file_path, 'big.bin', '/Attachments')
+
+    assert uploaded_hash(emulator) == sha256
+    assert upload_session.load_journal() == {}
+
+def test_upload_resumes_from_the_journal_after_a_crash(graph_emulator, big_file, chunk_puts):
+    emulator = graph_emulator(messages=0)
+    file_path, sha256 = big_file
+    calls, failures = chunk_puts
+    failures[3] = 'crash'
+    with pytest.raises(ConnectionError):
+        upload_session.resumable_upload('test-token', file_path, 'big.bin', '/Attachments')
+    (entry,) = upload_session.load_journal().values()
+    confirmed = entry['confirmed'][1]
+    assert confirmed > 0
+
+    assert upload_session.resumable_upload('test-token', file_path, 'big.bin', '/Attachments')
+
+    assert byte_range(calls[3])[0] == confirmed
+    assert sessions_created(emulator) == 1
+    assert uploaded_hash(emulator) == sha256
+    assert upload_session.load_journal() == {}
+
+def test_upload_restarts_when_the_session_expired(graph_emulator, big_file, chunk_puts):
+    emulator = graph_emulator(messages=0)
+    file_path, sha256 = big_file
+    chunk_puts[1][2] = 'crash'
+    with pytest.raises(ConnectionError):
+        upload_session.resumable_upload('test-token', file_path, 'big.bin', '/Attachments')
+    emulator.upload_sessions.clear()
+
+    assert upload_session.resumable_upload('test-token', file_path, 'big.bin', '/Attachments')
+
+    assert sessions_created(emulator) == 2
+    assert uploaded_hash(emulator) == sha256
+
+def test_lost_chunk_response_is_resumed_from_next_expected_ranges(graph_emulator, big_file, chunk_puts):
+    emulator = graph_emulator(messages=0)
+    file_path, sha256 = big_file
+    calls, failures = chunk_puts
+    failures[2] = 'lose'
+
+    assert upload_session.resumable_upload('test-token', file_path, 'big.bin', '/Attachments')
+
+    # The server kept the chunk, so the next one starts after it instead of resending it
+    assert byte_range(calls[2])[0] == byte_range(calls[1])[1] + 1
+    assert uploaded_hash(emulator) == sha256
+
+def test_stream_upload_rewinds_within_the_buffer(graph_emulator, big_file, chunk_puts, tmp_path):
+    emulator = graph_emulator(messages=0)
+    file_path, sha256 = big_file
+    calls, failures = chunk_puts
+    failures[2] = 'lose'
+
+    def chunks():
+        with open(file_path, 'rb') as f:
+            yield from iter(lambda: f.read(64 * 1024), b'')
+
+    with open(tmp_path / 'tee.bin', 'wb') as tee:
+        assert upload_session.stream_upload('test-token', chunks(), FILE_SIZE, 'big.bin', '/Attachments', tee=tee)
+
+    assert uploaded_hash(emulator) == sha256
+    assert hashlib.sha256((tmp_path / 'tee.bin').read_bytes()).hexdigest().upper() == sha256
+
+def test_stream_upload_fails_when_the_stream_ends_early(graph_emulator, big_file):
+    graph_emulator(messages=0)
+
+    assert not upload_session.stream_upload('test-token', [b'x' * 1000], FILE_SIZE, 'short.bin', '/Attachments')
+
+def test_journal_keeps_other_uploads(tmp_path):
+    upload_session.update_journal('a', {'uploadUrl': 'u1'})
+    upload_session.update_journal('b', {'uploadUrl': 'u2'})
+    upload_session.update_journal('a', None)
+
+    with open(upload_session.UPLOAD_JOURNAL_FILE) as f:
+        assert json.load(f) == {'b': {'uploadUrl': 'u2'}}
+
+def test_rewritten_file_with_same_content_resumes(graph_emulator, big_file, chunk_puts):
+    emulator = graph_emulator(messages=0)
+    file_path, sha256 = big_file
+    chunk_puts[1][2] = 'crash'
+    with pytest.raises(ConnectionError):
+        upload_session.resumable_upload('test-token', file_path, 'big.bin', '/Attachments')
+    os.utime(file_path, (0, 0))
+
+    assert upload_session.resumable_upload('test-token', file_path, 'big.bin', '/Attachments')
+
+    assert sessions_created(emulator) == 1
+    assert uploaded_hash(emulator) == sha256
+
+def test_stale_entries_are_pruned(tmp_path):
+    (tmp_path / 'kept.bin').write_bytes(b'x')
+    upload_session.save_journal({
+        'expired': {'uploadUrl': 'u1', 'expirationDateTime': '2020-01-01T00:00:00.1234567Z'},
+        'file gone': {'uploadUrl': 'u2', 'expirationDateTime': '2999-01-01T00:00:00Z', 'file_path': str(tmp_path / 'gone.bin')},
+        'resumable': {'uploadUrl': 'u3', 'expirationDateTime': '2999-01-01T00:00:00Z', 'file_path': str(tmp_path / 'kept.bin')},
+    })
+    assert upload_session.get_journal_entry('expired') is None
+
+    upload_session.update_journal('new', {'uploadUrl': 'u4'})
+
+    assert sorted(upload_session.load_journal()) == ['new', 'resumable']
+
+def test_failed_upload_of_a_removed_file_is_not_kept(graph_emulator, big_file, chunk_puts):
+    graph_emulator(messages=0)
+    file_path, _ = big_file
+    chunk_puts[1][2] = 'crash'
+    with pytest.raises(ConnectionError):
+        upload_session.resumable_upload('test-token', file_path, 'big.bin', '/Attachments')
+    os.remove(file_path)
+
+    upload_session.update_journal('other', {'uploadUrl': 'u'})
+
+    assert list(upload_session.load_journal()) == ['other']
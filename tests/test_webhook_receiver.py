@@ -0,0 +1,135 @@
+import os
+import json
+import stat
+import threading
+import urllib.error
+import urllib.request
+from urllib.parse import quote
+import pytest
+import webhook_receiver
+import app_outlook2pdf2onedrive
+
+CLIENT_STATE = 'expected-client-state'
+
+@pytest.fixture
+def receiver():
+    state = {'id': None, 'expirationDateTime': None, 'clientState': CLIENT_STATE}
+    renew_now = threading.Event()
+    webhook_receiver.changes.clear()
+    server = webhook_receiver.start_receiver(state, renew_now, host='127.0.0.1', port=0)
+    yield f'http://127.0.0.1:{server.server_address[1]}/notifications', state, renew_now
+    server.shutdown()
+    server.server_close()
+
+def post(url, body=None):
+    data = json.dumps(body).encode('utf-8') if body is not None else b''
+    request = urllib.request.Request(url, data=data, headers={'Content-Type': 'application/json'}, method='POST')
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return response.status, response.headers['Content-Type'], response.read().decode('utf-8')
+    except urllib.error.HTTPError as e:
+        return e.code, e.headers['Content-Type'], e.read().decode('utf-8')
+
+def notification(client_state=CLIENT_STATE, **fields):
+    return {'value': [dict({'subscriptionId': 'sub', 'clientState': client_state, 'changeType': 'created'}, **fields)]}
+
+def test_validation_token_is_echoed_as_text(receiver):
+    url, _, _ = receiver
+    token = 'Validation: Testing client application reachability for subscription Request-Id: 1+2/3='
+
+    status, content_type, body = post(f'{url}?validationToken={quote(token)}')
+
+    assert status == 200
+    assert content_type.startswith('text/plain')
+    assert body == token
+    assert not webhook_receiver.changes.is_set()
+
+def test_notification_triggers_sync(receiver):
+    url, _, renew_now = receiver
+
+    status, _, _ = post(url, notification(resource='Users/me/Messages/msg1'))
+
+    assert status == 202
+    # The receiver answers before it handles the notification
+    assert webhook_receiver.changes.wait(5)
+    assert not renew_now.is_set()
+
+def test_notification_with_wrong_client_state_is_ignored(receiver):
+    url, _, _ = receiver
+
+    status, _, _ = post(url, notification(client_state='forged'))
+    assert status == 202
+    status, _, _ = post(url, {'value': [{'subscriptionId': 'sub', 'changeType': 'created'}]})
+    assert status == 202
+
+    assert not webhook_receiver.changes.wait(0.5)
+
+def test_lifecycle_notification_requests_renewal(receiver):
+    url, _, renew_now = receiver
+
+    post(url, notification(lifecycleEvent='reauthorizationRequired'))
+
+    assert renew_now.wait(5)
+    assert not webhook_receiver.changes.is_set()
+
+def test_malformed_notification_is_rejected(receiver):
+    url, _, _ = receiver
+    request = urllib.request.Request(url, data=b'{not json', method='POST')
+
+    with pytest.raises(urllib.error.HTTPError) as error:
+        urllib.request.urlopen(request, timeout=10)
+
+    assert error.value.code == 400
+    assert not webhook_receiver.changes.is_set()
+
+def test_subscription_state_is_private(receiver, graph_emulator, monkeypatch):
+    url, state, _ = receiver
+    emulator = graph_emulator(messages=0)
+    monkeypatch.setattr(webhook_receiver, 'WEBHOOK_PUBLIC_URL', url)
+
+    # The emulator validates the notification URL against the receiver, like Graph
+    assert webhook_receiver.create_subscription('test-token', state)
+
+    assert state['id'] in emulator.subscriptions
+    assert emulator.subscriptions[state['id']]['clientState'] == CLIENT_STATE
+    mode = stat.S_IMODE(os.stat(webhook_receiver.SUBSCRIPTION_STATE_FILE).st_mode)
+    assert mode == 0o600
+    assert webhook_receiver.load_subscription_state() == state
+
+def test_renewal_recreates_a_removed_subscription(receiver, graph_emulator, monkeypatch):
+    url, state, _ = receiver
+    emulator = graph_emulator(messages=0)
+    monkeypatch.setattr(webhook_receiver, 'WEBHOOK_PUBLIC_URL', url)
+    assert webhook_receiver.create_subscription('test-token', state)
+    old_id = state['id']
+    assert webhook_receiver.renew_subscription('test-token', state)
+    assert state['id'] == old_id
+
+    emulator.subscriptions.clear()
+    assert webhook_receiver.renew_subscription('test-token', state)
+
+    assert state['id'] != old_id
+    assert state['id'] in emulator.subscriptions
+
+def test_change_notification_wakes_delta_sync(receiver, graph_emulator, monkeypatch):
+    url, state, _ = receiver
+    emulator = graph_emulator(messages=1, inline_logos=False)
+    monkeypatch.setattr(webhook_receiver, 'WEBHOOK_PUBLIC_URL', url)
+    monkeypatch.setattr(webhook_receiver, 'CATCHUP_INTERVAL', 60)
+    app_outlook2pdf2onedrive.set_attachment_handler(lambda file_path: None)
+    assert webhook_receiver.create_subscription('test-token', state)
+    app_outlook2pdf2onedrive.sync_emails('test-token')
+    assert len(emulator.uploaded_files) == 1
+
+    woken = threading.Event()
+    waiter = threading.Thread(target=lambda: (webhook_receiver.wait_for_changes(), woken.set()))
+    waiter.start()
+    message_id = emulator.add_message()
+    assert emulator.notify(state['id'], message_id, client_state='forged') == 202
+    assert not woken.wait(1.5)
+    assert emulator.notify(state['id'], message_id) == 202
+    waiter.join(timeout=10)
+    assert woken.is_set()
+
+    app_outlook2pdf2onedrive.sync_emails('test-token')
+    assert len(emulator.uploaded_files) == 2
@@ -0,0 +1,152 @@
+import os
+import time
+import fcntl
+import logging
+import threading
+from contextlib import contextmanager
+from msal import PublicClientApplication, SerializableTokenCache
+import graph_client
+from dotenv import load_dotenv
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+CLIENT_ID = os.getenv('CLIENT_ID')
+AUTHORITY = os.getenv('TOKEN_AUTHORITY', 'https://login.microsoftonline.com/common')
+SCOPES = os.getenv('TOKEN_SCOPES', 'Mail.Read Files.ReadWrite').split()
+TOKEN_CACHE_FILE = 'token_cache.json'
+TOKEN_LOCK_FILE = TOKEN_CACHE_FILE + '.lock'
+REFRESH_MARGIN = int(os.getenv('TOKEN_REFRESH_MARGIN', '300'))  # seconds before expiry the token is renewed
+REFRESH_RETRY_INTERVAL = 60
+
+_lock = threading.Lock()
+_app = None
+_cache = SerializableTokenCache()
+_cache_mtime = None
+_token = None
+_expires_at = 0
+_refresher = None
+
+@contextmanager
+def cache_lock():
+    """
+    Holds an exclusive lock on the token cache file across processes.
+    """
+    with open(TOKEN_LOCK_FILE, 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def load_token_cache():
+    """
+    Reloads the cache file if another process changed it since we last read it.
+    """
+    global _cache_mtime
+    if not os.path.exists(TOKEN_CACHE_FILE):
+        return
+    mtime = os.stat(TOKEN_CACHE_FILE).st_mtime_ns
+    if mtime != _cache_mtime:
+        with open(TOKEN_CACHE_FILE, 'r') as f:
+            _cache.deserialize(f.read())
+        _cache_mtime = mtime
+
+def save_token_cache():
+    global _cache_mtime
+    if _cache.has_state_changed:
+        tmp_path = TOKEN_CACHE_FILE + '.tmp'
+        # The cache holds refresh tokens, keep it private to the user
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            f.write(_cache.serialize())
+        os.replace(tmp_path, TOKEN_CACHE_FILE)
+        _cache_mtime = os.stat(TOKEN_CACHE_FILE).st_mtime_ns
+
+def get_app():
+    global _app
+    if _app is None:
+        _app = PublicClientApplication(client_id=CLIENT_ID, authority=AUTHORITY, token_cache=_cache)
+    return _app
+
+def acquire_token(interactive=True):
+    """
+    Gets a token that is valid for longer than REFRESH_MARGIN.
+
+    Runs under the cache file lock, so when several processes need a new
+    token only the first one refreshes and the others pick up its result.
+
+    :param interactive: Fall back to the device code flow when no cached account can be used.
+    :return: The MSAL result with 'access_token' and 'expires_in'.
+    """
+    with cache_lock():
+        load_token_cache()
+        app = get_app()
+        result = None
+        accounts = app.get_accounts()
+        if accounts:
+            result = app.acquire_token_silent(SCOPES, account=accounts[0])
+            if result and 'access_token' in result and result.get('expires_in', 0) <= REFRESH_MARGIN:
+                result = app.acquire_token_silent(SCOPES, account=accounts[0], force_refresh=True)
+        if result and 'access_token' in result:
+            logger.info("Acquired token silently.")
+        elif interactive:
+            flow = app.initiate_device_flow(scopes=SCOPES)
+            if 'user_code' not in flow:
+                logger.error(f"Device flow initiation failed: {flow.get('error')}")
+                raise Exception(f"Device flow initiation failed: {flow.get('error')}")
+
+            logger.info("Initiating device code flow. Please authenticate.")
+            print(flow['message'])
+            result = app.acquire_token_by_device_flow(flow)
+            if 'access_token' not in result:
+                logger.error(f"Failed to get access token: {result.get('error_description')}")
+                raise Exception(f"Failed to get access token: {result.get('error_description')}")
+            logger.info("Acquired token via device code flow.")
+        else:
+            return None
+        save_token_cache()
+    return result
+
+def refresh(interactive=True):
+    global _token, _expires_at
+    result = acquire_token(interactive)
+    if result is None:
+        return False
+    _token = result['access_token']
+    _expires_at = time.time() + int(result.get('expires_in', 0))
+    return True
+
+def refresh_loop():
+    """
+    Renews the token REFRESH_MARGIN seconds before it expires, so callers never wait on it.
+    """
+    while True:
+        time.sleep(max(0, _expires_at - REFRESH_MARGIN - time.time()))
+        try:
+            with _lock:
+                refreshed = time.time() < _expires_at - REFRESH_MARGIN or refresh(interactive=False)
+            if not refreshed:
+                logger.warning("Background token refresh needs interactive sign-in.")
+                time.sleep(REFRESH_RETRY_INTERVAL)
+        except Exception as e:
+            logger.error(f"Background token refresh failed: {e}")
+            time.sleep(REFRESH_RETRY_INTERVAL)
+
+def get_access_token():
+    """
+    Returns the current access token, from memory once one was acquired.
+    """
+    global _refresher
+    if _token is not None and time.time() < _expires_at - REFRESH_RETRY_INTERVAL:
+        return _token
+    with _lock:
+        if _token is None or time.time() >= _expires_at - REFRESH_RETRY_INTERVAL:
+            refresh()
+        if _refresher is None:
+            _refresher = threading.Thread(target=refresh_loop, name='token-refresh', daemon=True)
+            _refresher.start()
+        return _token
+
+graph_client.set_token_provider(get_access_token)
@@ -0,0 +1,102 @@
+import os
+import time
+import sqlite3
+import logging
+from contextlib import closing
+import dedup_index
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+UPLOAD_MANIFEST_DB = os.getenv('UPLOAD_MANIFEST_DB', 'Data/upload_manifest.sqlite')
+# Overwrite OneDrive files that were edited since our last upload instead of failing the upload
+OVERWRITE_CONFLICTS = os.getenv('UPLOAD_OVERWRITE_CONFLICTS', '0') == '1'
+
+def connect():
+    os.makedirs(os.path.dirname(UPLOAD_MANIFEST_DB) or '.', exist_ok=True)
+    conn = sqlite3.connect(UPLOAD_MANIFEST_DB, timeout=30)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS manifest (
+            destination TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            sha256 TEXT NOT NULL,
+            etag TEXT,
+            quick_xor_hash TEXT,
+            uploaded_at REAL NOT NULL
+        )
+    """)
+    return conn
+
+def destination_path(destination_folder, destination_file_name):
+    return f"{destination_folder.rstrip('/')}/{destination_file_name}"
+
+def get_entry(destination):
+    with closing(connect()) as conn:
+        conn.row_factory = sqlite3.Row
+        row = conn.execute('SELECT * FROM manifest WHERE destination = ?', (destination,)).fetchone()
+    return dict(row) if row else None
+
+def check(file_path, destination):
+    """
+    Compares a local file with what was last uploaded to a destination.
+
+    Size and mtime are compared first so unchanged files are not even read;
+    a file that was rewritten with the same content is caught by its hash.
+    The OneDrive copy is checked separately, see remote_state().
+
+    :return: (changed, manifest entry or None, sha256 of the file or None if not computed)
+    """
+    entry = get_entry(destination)
+    stat = os.stat(file_path)
+    if entry and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+        return False, entry, entry['sha256']
+    sha256 = dedup_index.file_sha256(file_path)
+    if entry and entry['size'] == stat.st_size and entry['sha256'] == sha256:
+        with closing(connect()) as conn, conn:
+            conn.execute('UPDATE manifest SET mtime_ns = ? WHERE destination = ?', (stat.st_mtime_ns, destination))
+        return False, entry, sha256
+    return True, entry, sha256
+
+def remote_state(entry, status, item):
+    """
+    Compares the drive item with the copy we last uploaded, from a GET of its eTag and size.
+
+    A deleted or replaced file must be uploaded again, even though the local
+    file did not change. When the item cannot be read the manifest is trusted.
+
+    :return: 'unchanged', 'missing' or 'replaced'.
+    """
+    if status == 404:
+        return 'missing'
+    if status != 200 or not isinstance(item, dict):
+        logger.warning(f"Could not check the OneDrive copy ({status}), trusting the upload manifest.")
+        return 'unchanged'
+    if item.get('size') != entry['size'] or (entry.get('etag') and item.get('eTag') != entry['etag']):
+        return 'replaced'
+    return 'unchanged'
+
+def conditional_headers(entry):
+    """
+    If-Match header so an upload fails with 412 when the OneDrive copy changed since our last upload.
+    """
+    if entry and entry.get('etag'):
+        return {'If-Match': entry['etag']}
+    return {}
+
+def record_upload(destination, file_path, sha256, item):
+    """
+    Stores the uploaded state of a destination.
+
+    :param item: driveItem returned by the upload, for its eTag and quickXorHash.
+    """
+    item = item if isinstance(item, dict) else {}
+    stat = os.stat(file_path)
+    quick_xor_hash = item.get('file', {}).get('hashes', {}).get('quickXorHash')
+    with closing(connect()) as conn, conn:
+        conn.execute(
+            'INSERT OR REPLACE INTO manifest (destination, size, mtime_ns, sha256, etag, quick_xor_hash, uploaded_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (destination, stat.st_size, stat.st_mtime_ns, sha256, item.get('eTag'), quick_xor_hash, time.time())
+        )
@@ -0,0 +1,299 @@
+import os
+import json
+import time
+import logging
+import threading
+from datetime import datetime, timezone
+import graph_client
+import dedup_index
+from graph_client import GRAPH_URL
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+UPLOAD_JOURNAL_FILE = 'upload_journal.json'
+CHUNK_UNIT = 320 * 1024  # Graph requires chunk sizes in multiples of 320 KiB
+MIN_CHUNK_SIZE = CHUNK_UNIT
+MAX_CHUNK_SIZE = int(os.getenv('UPLOAD_MAX_CHUNK_SIZE', str(32 * CHUNK_UNIT)))  # 10 MiB, Graph allows up to 60 MiB
+TARGET_CHUNK_SECONDS = 2.0  # grow chunks until one takes about this long
+MAX_RESUMES = 3  # re-syncs with the session after a failed chunk before giving up
+
+_journal_lock = threading.Lock()
+
+def load_journal():
+    if os.path.exists(UPLOAD_JOURNAL_FILE):
+        with open(UPLOAD_JOURNAL_FILE, 'r') as f:
+            return json.load(f)
+    return {}
+
+def save_journal(journal):
+    tmp_file = UPLOAD_JOURNAL_FILE + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(journal, f, indent=4)
+    os.replace(tmp_file, UPLOAD_JOURNAL_FILE)
+
+def is_stale(entry):
+    """
+    Tells whether a journal entry can no longer be resumed: its session
+    expired, or the local file it uploads from is gone.
+    """
+    if entry.get('file_path') and not os.path.exists(entry['file_path']):
+        return True
+    expiration = entry.get('expirationDateTime')
+    if not expiration:
+        return False
+    # Graph sends UTC with up to 7 fractional digits, which fromisoformat may reject
+    expires = datetime.fromisoformat(expiration.rstrip('Z').split('.')[0]).replace(tzinfo=timezone.utc)
+    return expires <= datetime.now(timezone.utc)
+
+def update_journal(key, entry):
+    """
+    Stores (or with entry=None removes) the journal entry of one upload.
+
+    Stale entries of failed uploads are dropped on the way, so the journal
+    only holds uploads that can still be resumed.
+    """
+    with _journal_lock:
+        journal = {k: v for k, v in load_journal().items() if not is_stale(v)}
+        if entry is None:
+            journal.pop(key, None)
+        else:
+            journal[key] = entry
+        save_journal(journal)
+
+def get_journal_entry(key):
+    with _journal_lock:
+        entry = load_journal().get(key)
+    if entry is None or is_stale(entry):
+        return None
+    return entry
+
+def journal_key(destination_folder, file_name, source):
+    """
+    Identifies an upload by its destination and its content rather than the
+    file's path and mtime: a file rewritten with the same bytes resumes, an
+    edited one starts a new session.
+
+    :param source: SHA-256 of the content, or another stable id of it.
+    """
+    return f"{destination_folder}/{file_name}|{source}"
+
+def create_upload_session(access_token, destination_folder, file_name):
+    destination_folder = destination_folder.replace(' ', '%20')
+    upload_session_url = f"{GRAPH_URL}/me/drive/root:{destination_folder}/{file_name}:/createUploadSession"
+
+    upload_session_payload = {
+        "item": {
+            "@microsoft.graph.conflictBehavior": "rename",
+            "name": file_name
+        }
+    }
+
+    response = graph_client.post(upload_session_url, access_token=access_token, json=upload_session_payload, retry=True)
+    if response.status_code == 200:
+        return response.json()
+    logger.error(f"Failed to create upload session for {file_name}: {response.status_code} - {response.text}")
+    return None
+
+def get_next_expected_offset(upload_url):
+    """
+    Asks the upload session which byte it expects next.
+
+    Returns None when the session is gone (expired or already completed).
+    """
+    response = graph_client.get(upload_url)
+    if response.status_code != 200:
+        logger.warning(f"Upload session is no longer available: {response.status_code} - {response.text}")
+        return None
+    ranges = response.json().get('nextExpectedRanges', [])
+    if not ranges:
+        return None
+    return int(ranges[0].split('-')[0])
+
+def next_chunk_size(chunk_size, sent, elapsed):
+    """
+    Picks the next chunk size from the measured throughput of the last chunk.
+
+    The size moves towards what can be sent in TARGET_CHUNK_SECONDS, at most
+    doubling per step, and always stays a multiple of CHUNK_UNIT.
+    """
+    if elapsed <= 0:
+        target = chunk_size * 2
+    else:
+        target = sent / elapsed * TARGET_CHUNK_SECONDS
+    target = min(target, chunk_size * 2)
+    target = int(target) // CHUNK_UNIT * CHUNK_UNIT
+    return max(MIN_CHUNK_SIZE, min(MAX_CHUNK_SIZE, target))
+
+def open_session(access_token, key, destination_folder, file_name, file_path=None):
+    """
+    Continues the journaled session of an upload, or creates and journals a new one.
+
+    :param key: Journal key of the upload, None to not journal it.
+    :param file_path: Local file the upload reads from; its entry is dropped once the file is gone.
+    :return: (journal entry, offset the session expects next), or (None, None) when no session could be created.
+    """
+    entry = get_journal_entry(key) if key else None
+    if entry:
+        offset = get_next_expected_offset(entry['uploadUrl'])
+        if offset is not None:
+            logger.info(f"Resuming upload of {file_name} at byte {offset}.")
+            return entry, offset
+    session = create_upload_session(access_token, destination_folder, file_name)
+    if session is None:
+        return None, None
+    entry = {'uploadUrl': session['uploadUrl'], 'expirationDateTime': session.get('expirationDateTime'), 'confirmed': [0, 0]}
+    if file_path:
+        entry['file_path'] = os.path.abspath(file_path)
+    if key:
+        update_journal(key, entry)
+    return entry, 0
+
+def resumable_upload(access_token, file_path, file_name, destination_folder, source=None):
+    """
+    Uploads a file through an upload session that survives crashes.
+
+    The uploadUrl and the confirmed byte range are kept in UPLOAD_JOURNAL_FILE.
+    A later call for the same file asks the session for nextExpectedRanges and
+    continues from there instead of starting over.
+
+    :param access_token: OAuth2 access token.
+    :param file_path: Local path to the file.
+    :param file_name: Name to save the file as in OneDrive.
+    :param destination_folder: OneDrive folder path where the file will be uploaded.
+    :param source: Stable id of content that can be fetched again, e.g. a mail
+        attachment in a temporary file. The session is then kept for a later
+        copy of it, otherwise it is keyed on the file's hash and dropped with the file.
+    :return: True when the upload completed.
+    """
+    if source:
+        key = journal_key(destination_folder, file_name, source)
+    else:
+        key = journal_key(destination_folder, file_name, dedup_index.file_sha256(file_path))
+    entry, offset = open_session(access_token, key, destination_folder, file_name, None if source else file_path)
+    if entry is None:
+        return False
+
+    upload_url = entry['uploadUrl']
+    file_size = os.path.getsize(file_path)
+    chunk_size = entry.get('chunk_size', MIN_CHUNK_SIZE)
+    resumes = 0
+    with open(file_path, 'rb') as f:
+        while offset < file_size:
+            f.seek(offset)
+            chunk_data = f.read(chunk_size)
+            end_range = offset + len(chunk_data) - 1
+            headers = {
+                'Content-Length': str(len(chunk_data)),
+                'Content-Range': f'bytes {offset}-{end_range}/{file_size}'
+            }
+            start = time.perf_counter()
+            chunk_response = graph_client.put(upload_url, headers=headers, data=chunk_data)
+            elapsed = time.perf_counter() - start
+
+            if chunk_response.status_code in [200, 201]:
+                offset = file_size
+            elif chunk_response.status_code == 202:
+                offset = end_range + 1
+                chunk_size = next_chunk_size(chunk_size, len(chunk_data), elapsed)
+                entry.update(confirmed=[0, offset], chunk_size=chunk_size)
+                update_journal(key, entry)
+                logger.info(f"Uploaded {offset}/{file_size} bytes of {file_name}.")
+            else:
+                logger.error(f"Failed to upload chunk {offset}-{end_range} of {file_name}: {chunk_response.status_code} - {chunk_response.text}")
+                resumes += 1
+                expected = get_next_expected_offset(upload_url) if resumes <= MAX_RESUMES else None
+                if expected is None:
+                    logger.error(f"Giving up on {file_name} for now, it will be resumed on the next run.")
+                    return False
+                offset = expected
+                chunk_size = max(MIN_CHUNK_SIZE, chunk_size // 2 // CHUNK_UNIT * CHUNK_UNIT)
+
+    update_journal(key, None)
+    logger.info(f"Finished uploading {file_name} to OneDrive.")
+    return True
+
+def stream_upload(access_token, chunks, file_size, file_name, destination_folder, tee=None, source=None):
+    """
+    Uploads a stream of known size through an upload session.
+
+    Data from chunks is collected in a buffer of at most the current chunk size
+    and sent as soon as it is full, so memory stays bounded by MAX_CHUNK_SIZE.
+    After a failed chunk it can only rewind within the data still in the
+    buffer. With a source the session is journaled like resumable_upload()
+    does; a later stream of the same source is then read past the bytes the
+    session already has, and only the rest is sent.
+
+    :param access_token: OAuth2 access token.
+    :param chunks: Iterable of bytes, e.g. response.iter_content().
+    :param file_size: Total number of bytes in the stream.
+    :param file_name: Name to save the file as in OneDrive.
+    :param destination_folder: OneDrive folder path where the file will be uploaded.
+    :param tee: Optional open file that receives a copy of every byte read.
+    :param source: Stable id of the stream's content, e.g. the message and attachment id.
+    :return: True when the upload completed.
+    """
+    key = journal_key(destination_folder, file_name, source) if source else None
+    entry, offset = open_session(access_token, key, destination_folder, file_name)
+    if entry is None:
+        return False
+
+    upload_url = entry['uploadUrl']
+    chunks = iter(chunks)
+    buffer = bytearray()
+    exhausted = False
+    skip = offset  # bytes the resumed session already has
+    chunk_size = entry.get('chunk_size', MIN_CHUNK_SIZE)
+    resumes = 0
+    while offset < file_size:
+        while len(buffer) < chunk_size and not exhausted:
+            data = next(chunks, None)
+            if data is None:
+                exhausted = True
+                break
+            if tee is not None:
+                tee.write(data)
+            if skip:
+                skipped = min(skip, len(data))
+                data = data[skipped:]
+                skip -= skipped
+            buffer += data
+        if not buffer:
+            logger.error(f"Stream of {file_name} ended at byte {offset} of {file_size}.")
+            return False
+
+        chunk_data = bytes(buffer[:chunk_size])
+        end_range = offset + len(chunk_data) - 1
+        headers = {
+            'Content-Length': str(len(chunk_data)),
+            'Content-Range': f'bytes {offset}-{end_range}/{file_size}'
+        }
+        start = time.perf_counter()
+        chunk_response = graph_client.put(upload_url, headers=headers, data=chunk_data)
+        elapsed = time.perf_counter() - start
+
+        if chunk_response.status_code in [200, 201]:
+            offset = file_size
+        elif chunk_response.status_code == 202:
+            offset = end_range + 1
+            del buffer[:len(chunk_data)]
+            chunk_size = next_chunk_size(chunk_size, len(chunk_data), elapsed)
+            if key:
+                entry.update(confirmed=[0, offset], chunk_size=chunk_size)
+                update_journal(key, entry)
+            logger.info(f"Uploaded {offset}/{file_size} bytes of {file_name}.")
+        else:
+            logger.error(f"Failed to upload chunk {offset}-{end_range} of {file_name}: {chunk_response.status_code} - {chunk_response.text}")
+            resumes += 1
+            expected = get_next_expected_offset(upload_url) if resumes <= MAX_RESUMES else None
+            if expected is None or not offset <= expected <= offset + len(buffer):
+                logger.error(f"Cannot resume streamed upload of {file_name}.")
+                return False
+            del buffer[:expected - offset]
+            offset = expected
+            chunk_size = max(MIN_CHUNK_SIZE, chunk_size // 2 // CHUNK_UNIT * CHUNK_UNIT)
+
+    if key:
+        update_journal(key, None)
+    logger.info(f"Finished uploading {file_name} to OneDrive.")
+    return True
@@ -0,0 +1,212 @@
+"""
+Event-driven ingestion: Graph change notifications trigger the pipeline.
+
+A small HTTP receiver accepts notifications for new inbox messages, and each
+notification wakes a delta sync, which also catches up on anything missed
+while the receiver was down. Nothing runs while the mailbox is idle.
+
+    python webhook_receiver.py
+
+WEBHOOK_PUBLIC_URL must be the HTTPS URL under which Graph reaches this
+receiver (e.g. through a reverse proxy or tunnel to WEBHOOK_PORT).
+"""
+import os
+import json
+import time
+import secrets
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import graph_client
+from graph_client import GRAPH_URL
+from token_provider import get_access_token
+from dotenv import load_dotenv
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8080'))
+WEBHOOK_PUBLIC_URL = os.getenv('WEBHOOK_PUBLIC_URL')
+SUBSCRIPTION_STATE_FILE = 'subscription_state.json'
+SUBSCRIPTION_RESOURCE = "me/mailFolders('inbox')/messages"
+SUBSCRIPTION_MINUTES = int(os.getenv('WEBHOOK_SUBSCRIPTION_MINUTES', '4200'))  # Outlook allows at most 4230
+RENEW_MARGIN = 3600  # seconds before expiry the subscription is renewed
+CATCHUP_INTERVAL = int(os.getenv('WEBHOOK_CATCHUP_INTERVAL', '3600'))  # delta sync without notification, 0 = never
+
+changes = threading.Event()
+
+def load_subscription_state():
+    if os.path.exists(SUBSCRIPTION_STATE_FILE):
+        with open(SUBSCRIPTION_STATE_FILE, 'r') as f:
+            return json.load(f)
+    # The client state is a shared secret echoed back in every notification
+    return {'id': None, 'expirationDateTime': None, 'clientState': os.getenv('WEBHOOK_CLIENT_STATE') or secrets.token_urlsafe(32)}
+
+def save_subscription_state(state):
+    tmp_file = SUBSCRIPTION_STATE_FILE + '.tmp'
+    # The state holds the clientState secret, keep it private to the user
+    fd = os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    # A leftover temporary file keeps its old mode
+    os.fchmod(fd, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp_file, SUBSCRIPTION_STATE_FILE)
+
+def expiration_time(minutes=SUBSCRIPTION_MINUTES):
+    return (datetime.now(timezone.utc) + timedelta(minutes=minutes)).strftime('%Y-%m-%dT%H:%M:%S.0000000Z')
+
+def seconds_until(expiration_date_time):
+    # Graph sends UTC with up to 7 fractional digits, which fromisoformat may reject
+    expires = datetime.fromisoformat(expiration_date_time.rstrip('Z').split('.')[0]).replace(tzinfo=timezone.utc)
+    return (expires - datetime.now(timezone.utc)).total_seconds()
+
+def create_subscription(access_token, state):
+    """
+    Subscribes to new inbox messages; Graph validates WEBHOOK_PUBLIC_URL before answering.
+    """
+    body = {
+        'changeType': 'created',
+        'notificationUrl': WEBHOOK_PUBLIC_URL,
+        'lifecycleNotificationUrl': WEBHOOK_PUBLIC_URL,
+        'resource': SUBSCRIPTION_RESOURCE,
+        'expirationDateTime': expiration_time(),
+        'clientState': state['clientState'],
+    }
+    response = graph_client.post(f'{GRAPH_URL}/subscriptions', access_token=access_token, json=body)
+    if response.status_code != 201:
+        logger.error(f"Failed to create subscription: {response.status_code} - {response.text}")
+        return False
+    subscription = response.json()
+    state['id'] = subscription['id']
+    state['expirationDateTime'] = subscription['expirationDateTime']
+    save_subscription_state(state)
+    logger.info(f"Created subscription {state['id']} until {state['expirationDateTime']}.")
+    return True
+
+def renew_subscription(access_token, state):
+    """
+    Extends the subscription, or creates a new one if Graph no longer knows it.
+    """
+    if not state.get('id'):
+        return create_subscription(access_token, state)
+    response = graph_client.patch(
+        f"{GRAPH_URL}/subscriptions/{state['id']}", access_token=access_token,
+        json={'expirationDateTime': expiration_time()}, retry=True
+    )
+    if response.status_code == 404:
+        logger.warning(f"Subscription {state['id']} is gone, creating a new one.")
+        return create_subscription(access_token, state)
+    if response.status_code != 200:
+        logger.error(f"Failed to renew subscription: {response.status_code} - {response.text}")
+        return False
+    state['expirationDateTime'] = response.json()['expirationDateTime']
+    save_subscription_state(state)
+    logger.info(f"Renewed subscription {state['id']} until {state['expirationDateTime']}.")
+    return True
+
+def maintain_subscription(state, renew_now):
+    """
+    Renews the subscription RENEW_MARGIN seconds before it expires, or right
+    away when a lifecycle notification asks for it.
+    """
+    while True:
+        try:
+            if renew_subscription(get_access_token(), state):
+                # A gap without subscription may have missed messages
+                changes.set()
+                delay = max(0, seconds_until(state['expirationDateTime']) - RENEW_MARGIN)
+            else:
+                delay = 60
+        except Exception as e:
+            logger.error(f"Subscription renewal failed: {e}")
+            delay = 60
+        renew_now.wait(delay)
+        renew_now.clear()
+
+class NotificationHandler(BaseHTTPRequestHandler):
+    """
+    Answers Graph's validation requests and turns notifications into sync triggers.
+    """
+    state = None
+    renew_now = None
+
+    def do_POST(self):
+        validation_token = parse_qs(urlparse(self.path).query).get('validationToken')
+        if validation_token:
+            # Graph expects the token back as plain text within 10 seconds
+            self.respond(200, validation_token[0].encode('utf-8'), 'text/plain')
+            return
+
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            notifications = json.loads(self.rfile.read(length) or b'{}').get('value', [])
+        except ValueError:
+            self.respond(400)
+            return
+        # Answer first, Graph retries and eventually drops slow endpoints
+        self.respond(202)
+
+        for notification in notifications:
+            if not secrets.compare_digest(str(notification.get('clientState', '')), self.state['clientState']):
+                logger.warning(f"Ignoring notification with invalid clientState for {notification.get('subscriptionId')}.")
+                continue
+            lifecycle_event = notification.get('lifecycleEvent')
+            if lifecycle_event in ('reauthorizationRequired', 'subscriptionRemoved'):
+                logger.info(f"Lifecycle notification {lifecycle_event}, renewing subscription.")
+                self.renew_now.set()
+            else:
+                # Created messages and 'missed' notifications are both handled by a delta sync
+                changes.set()
+
+    def respond(self, status, body=b'', content_type='text/plain'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.info(format % args)
+
+def wait_for_changes():
+    """
+    Blocks until a notification arrives, or until the periodic catch-up is due.
+    """
+    changes.wait(CATCHUP_INTERVAL or None)
+    # Notifications arriving from here on trigger the next sync
+    changes.clear()
+    # Let a burst of notifications for one delivery settle into a single sync
+    time.sleep(1)
+
+def start_receiver(state, renew_now, host=WEBHOOK_HOST, port=WEBHOOK_PORT):
+    NotificationHandler.state = state
+    NotificationHandler.renew_now = renew_now
+    server = ThreadingHTTPServer((host, port), NotificationHandler)
+    threading.Thread(target=server.serve_forever, name='webhook', daemon=True).start()
+    logger.info(f"Webhook receiver listening on {host}:{port}.")
+    return server
+
+def serve():
+    """
+    Runs the receiver, keeps the subscription alive and feeds the pipeline.
+
+    The receiver is started before the subscription is created, since Graph
+    validates the notification URL while creating it. The pipeline starts
+    with a delta sync, which catches up on messages from before startup.
+    """
+    import app_pipeline
+
+    if not WEBHOOK_PUBLIC_URL:
+        raise Exception("WEBHOOK_PUBLIC_URL is not set.")
+    state = load_subscription_state()
+    renew_now = threading.Event()
+    start_receiver(state, renew_now)
+    threading.Thread(target=maintain_subscription, args=(state, renew_now), name='subscription', daemon=True).start()
+    app_pipeline.run_pipeline(wait_for_changes=wait_for_changes)
+
+if __name__ == "__main__":
+    serve()